@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+"""
+End to end throughput of secure RQ jobs against plain ``django_rq`` jobs.
+
+Each scenario enqueues N jobs, through ``delay``, ``delay_many``, ``enqueue_at`` or ``enqueue_at_many`` of a
+``secure_rq.job`` task or through ``delay`` of a ``django_rq.job`` task, then drains them with a burst mode worker.
+The enqueue rate, the worker throughput, the stored payload bytes per job and the time spent in
+``secure_job_proxy`` are written as JSON, to track them from one release to the next:
+
+    python benchmarks/rq_benchmark.py --redis-url redis://localhost:6379/15 --output results.json
+    python benchmarks/rq_benchmark.py --fakeredis
+
+Jobs go to the ``secure_redis_benchmark`` queue, which is emptied first. Use a database without other data anyway,
+scheduled jobs share the scheduler sorted set of the server.
+"""
+from __future__ import division, print_function, unicode_literals
+
+import argparse
+from functools import wraps
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from django.conf import settings  # noqa: E402
+
+
+QUEUE_NAME = 'secure_redis_benchmark'
+SECRET_KEY = 'kPEDO_pSrPh3qGJVfGAflLZXKAh4AuHU64tTlP-f_PY='
+DEFAULT_JOBS = 1000
+DEFAULT_PAYLOAD_SIZE = 100
+# Number of jobs whose stored payload is measured per scenario
+PAYLOAD_SAMPLE = 100
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+def configure(redis_url, cache_options):
+    settings.configure(
+        INSTALLED_APPS=['django_rq', 'secure_redis'],
+        CACHES={
+            'default': {
+                'BACKEND': 'secure_redis.cache.SecureRedisCache',
+                'LOCATION': redis_url,
+                'OPTIONS': dict({
+                    'SERIALIZER': 'secure_redis.serializer.SecureSerializer',
+                    'REDIS_SECRET_KEY': SECRET_KEY,
+                }, **cache_options),
+            },
+        },
+        RQ_QUEUES={
+            QUEUE_NAME: {
+                'USE_REDIS_CACHE': 'default',
+            },
+        },
+    )
+    import django
+    django.setup()
+
+
+def use_fakeredis():
+    """
+    Serve every connection of the caches, queues and scheduler from a single in process fakeredis server.
+    """
+    import fakeredis
+    from django_redis.pool import ConnectionFactory
+
+    server = fakeredis.FakeServer()
+    ConnectionFactory.get_connection = lambda self, params: fakeredis.FakeStrictRedis(server=server)
+
+
+class ProxyTimer(object):
+    """
+    Time spent in ``secure_job_proxy`` by the worker, and in decrypting the job arguments within it.
+    """
+
+    def __init__(self):
+        self.proxy_seconds = 0.0
+        self.decrypt_seconds = 0.0
+        self.calls = 0
+
+    def reset(self):
+        self.__init__()
+
+    def install(self):
+        from secure_redis import secure_rq
+
+        def timed(func, attribute):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                start = timer()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    setattr(self, attribute, getattr(self, attribute) + timer() - start)
+                    if attribute == 'proxy_seconds':
+                        self.calls += 1
+            return wrapper
+
+        # Workers import the proxy by name and the proxy looks the decryption up in its module, both get the wrappers
+        secure_rq.secure_job_proxy = timed(secure_rq.secure_job_proxy, 'proxy_seconds')
+        secure_rq.decrypt_job_args = timed(secure_rq.decrypt_job_args, 'decrypt_seconds')
+
+
+proxy_timer = ProxyTimer()
+
+
+def plain_task(payload):
+    return len(payload)
+
+
+def secure_task(payload):
+    return len(payload)
+
+
+def get_tasks():
+    import django_rq
+    from secure_redis import secure_rq
+
+    return (django_rq.job(QUEUE_NAME, result_ttl=0)(plain_task),
+            secure_rq.job(QUEUE_NAME, result_ttl=0)(secure_task))
+
+
+def get_payload_bytes(connection, job_ids):
+    from rq.job import Job
+
+    pipeline = connection.pipeline(transaction=False)
+    for job_id in job_ids[:PAYLOAD_SAMPLE]:
+        pipeline.hget(Job.key_for(job_id), 'data')
+    sizes = [len(data) for data in pipeline.execute() if data is not None]
+    return sum(sizes) / len(sizes) if sizes else None
+
+
+def promote(scheduler, job_ids):
+    """
+    Move scheduled jobs to their queue the way the scheduler does once they are due.
+    """
+    from secure_redis.bulk import fetch_jobs
+
+    for job in fetch_jobs(job_ids, scheduler.connection):
+        scheduler.enqueue_job(job)
+
+
+def drop_finished(queue):
+    """
+    Delete the results kept by jobs created without ``result_ttl=0``, the scheduled ones.
+    """
+    from rq.job import Job
+    from rq.registry import FinishedJobRegistry
+
+    registry = FinishedJobRegistry(queue.name, connection=queue.connection)
+    job_ids = registry.get_job_ids()
+    if job_ids:
+        pipeline = queue.connection.pipeline()
+        pipeline.delete(*[Job.key_for(job_id) for job_id in job_ids])
+        pipeline.zrem(registry.key, *job_ids)
+        pipeline.execute()
+
+
+def count_failed(queue):
+    try:
+        from rq.registry import FailedJobRegistry
+    except ImportError:
+        # Before rq 1.0 failed jobs are moved to the failed queue
+        from rq.queue import get_failed_queue
+        return get_failed_queue(connection=queue.connection).count
+    return FailedJobRegistry(queue.name, connection=queue.connection).count
+
+
+def run_scenario(name, count, payload_size):
+    import django_rq
+    from rq import SimpleWorker
+
+    plain, secure = get_tasks()
+    queue = django_rq.get_queue(QUEUE_NAME)
+    scheduler = django_rq.get_scheduler(QUEUE_NAME)
+    queue.empty()
+    payload = 'x' * payload_size
+    failed_before = count_failed(queue)
+    target_date = datetime.datetime.utcnow()
+
+    start = timer()
+    if name == 'django_rq.delay':
+        job_ids = [plain.delay(payload).id for _ in range(count)]
+    elif name == 'secure.delay':
+        job_ids = [secure.delay(payload).id for _ in range(count)]
+    elif name == 'secure.delay_many':
+        job_ids = secure.delay_many(((payload, ), {}) for _ in range(count))
+    elif name == 'secure.enqueue_at':
+        job_ids = [secure.enqueue_at(target_date, QUEUE_NAME, payload).id for _ in range(count)]
+    else:
+        job_ids = secure.enqueue_at_many(((target_date, (payload, ), {}) for _ in range(count)),
+                                         scheduler_name=QUEUE_NAME)
+    enqueue_seconds = timer() - start
+    payload_bytes = get_payload_bytes(queue.connection, job_ids)
+
+    promote_seconds = None
+    if name.startswith('secure.enqueue_at'):
+        start = timer()
+        promote(scheduler, job_ids)
+        promote_seconds = timer() - start
+
+    proxy_timer.reset()
+    worker = SimpleWorker([queue], connection=queue.connection)
+    start = timer()
+    worker.work(burst=True, logging_level='WARNING')
+    drain_seconds = timer() - start
+    drop_finished(queue)
+
+    result = {
+        'jobs': count,
+        'enqueue_seconds': enqueue_seconds,
+        'enqueue_rate': count / enqueue_seconds,
+        'drain_seconds': drain_seconds,
+        'worker_throughput': count / drain_seconds,
+        'payload_bytes': payload_bytes,
+        'failed': count_failed(queue) - failed_before,
+    }
+    if promote_seconds is not None:
+        result['promote_seconds'] = promote_seconds
+    if name.startswith('secure.'):
+        result.update({
+            'proxy_seconds': proxy_timer.proxy_seconds,
+            'proxy_us_per_job': proxy_timer.proxy_seconds * 1e6 / max(proxy_timer.calls, 1),
+            'decrypt_seconds': proxy_timer.decrypt_seconds,
+            'decrypt_us_per_job': proxy_timer.decrypt_seconds * 1e6 / max(proxy_timer.calls, 1),
+        })
+    return result
+
+
+SCENARIOS = ['django_rq.delay', 'secure.delay', 'secure.delay_many', 'secure.enqueue_at', 'secure.enqueue_at_many']
+
+
+def get_environment(fake):
+    import django
+    import redis
+    import rq
+    import secure_redis
+
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'redis': redis.__version__,
+        'rq': rq.__version__,
+        'secure_redis': secure_redis.__version__,
+        'server': 'fakeredis' if fake else 'redis',
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--jobs', type=int, default=DEFAULT_JOBS, help='number of jobs per scenario')
+    parser.add_argument('--payload-size', type=int, default=DEFAULT_PAYLOAD_SIZE,
+                        help='size of the string argument of each job')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--redis-url', default=os.getenv('REDIS_URL', 'redis://localhost:6379/15'))
+    parser.add_argument('--fakeredis', action='store_true', help='use an in process fakeredis server instead')
+    parser.add_argument('--cache-options', type=json.loads, default={},
+                        help='JSON object of extra secure cache OPTIONS, e.g. {"SECURE_CIPHER": "aes-gcm"}')
+    parser.add_argument('--output', help='write the JSON results to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    configure(args.redis_url, args.cache_options)
+    if args.fakeredis:
+        use_fakeredis()
+    proxy_timer.install()
+
+    report = {
+        'environment': get_environment(args.fakeredis),
+        'payload_size': args.payload_size,
+        'cache_options': args.cache_options,
+        'results': dict((name, run_scenario(name, args.jobs, args.payload_size)) for name in args.scenarios),
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+    return 1 if any(result['failed'] for result in report['results'].values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
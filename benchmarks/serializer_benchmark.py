@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+"""
+Micro-benchmarks of ``SecureSerializer`` against django-redis' ``PickleSerializer``, no Redis needed.
+
+Each case serializes and deserializes one value shape at one payload size with one serializer variant: the plain
+pickle reference, the default secure serializer, and the default with a single option changed, so every cipher,
+codec and inner serializer is measured. Results can be saved as a baseline, later runs fail when a case got slower
+than the baseline by more than the threshold:
+
+    python benchmarks/serializer_benchmark.py --save baseline.json
+    python benchmarks/serializer_benchmark.py --baseline baseline.json --threshold 0.2
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import json
+import os
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from django.conf import settings  # noqa: E402
+
+if not settings.configured:
+    settings.configure()
+
+from django.core.exceptions import ImproperlyConfigured  # noqa: E402
+from django_redis.serializers.pickle import PickleSerializer  # noqa: E402
+
+from secure_redis.serializer import SecureSerializer  # noqa: E402
+
+
+SECRET_KEY = 'kPEDO_pSrPh3qGJVfGAflLZXKAh4AuHU64tTlP-f_PY='
+SIZES = [100, 10 * 1000, 1000 * 1000, 10 * 1000 * 1000]
+QUICK_SIZES = [100, 10 * 1000]
+DEFAULT_THRESHOLD = 0.2
+DEFAULT_MIN_TIME = 0.2
+MIN_ITERATIONS = 3
+
+timer = getattr(time, 'perf_counter', time.time)
+
+# Options of each variant, on top of the secret key. ``None`` is the plain pickle reference.
+VARIANTS = [
+    ('pickle', None),
+    ('secure', {}),
+    ('aes-gcm', {'SECURE_CIPHER': 'aes-gcm'}),
+    ('chacha20-poly1305', {'SECURE_CIPHER': 'chacha20-poly1305'}),
+    ('zlib', {'SECURE_COMPRESSION': 'zlib'}),
+    ('bz2', {'SECURE_COMPRESSION': 'bz2'}),
+    ('lzma', {'SECURE_COMPRESSION': 'lzma'}),
+    ('json', {'SECURE_INNER_SERIALIZER': 'json'}),
+    ('msgpack', {'SECURE_INNER_SERIALIZER': 'msgpack'}),
+    ('pickle5', {'SECURE_INNER_SERIALIZER': 'pickle5'}),
+]
+
+
+def make_dict(count):
+    return dict(('key_{}'.format(i), {'id': i, 'name': 'name {}'.format(i), 'active': i % 2 == 0, 'score': i * 0.5})
+                for i in range(count))
+
+
+def make_rows(count):
+    """
+    Rows as returned by ``QuerySet.values()``, once converted to plain types.
+    """
+    return [{'id': i, 'email': 'user{}@example.com'.format(i), 'created': '2020-01-01T00:00:{:02d}Z'.format(i % 60),
+             'amount': i * 100, 'note': None} for i in range(count)]
+
+
+def make_blob(size):
+    # Half random, half repeated so compression has something to do
+    return os.urandom(size // 2) + b'\x00' * (size - size // 2)
+
+
+SHAPES = [
+    ('dict', make_dict, True),
+    ('rows', make_rows, True),
+    ('blob', make_blob, False),
+]
+
+
+def make_value(factory, scalable, size, reference):
+    """
+    :return: a value of the shape built by ``factory`` whose pickle is about ``size`` bytes
+    """
+    if not scalable:
+        return factory(size)
+    sample_count = 100
+    sample_size = len(reference.dumps(factory(sample_count)))
+    return factory(max(1, size * sample_count // sample_size))
+
+
+def measure(func, arg, min_time):
+    iterations = 0
+    start = timer()
+    while True:
+        func(arg)
+        iterations += 1
+        elapsed = timer() - start
+        if iterations >= MIN_ITERATIONS and elapsed >= min_time:
+            return iterations / elapsed
+
+
+def peak_allocation(func, arg):
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    try:
+        func(arg)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_case(serializer, value, plain_size, min_time):
+    try:
+        encoded = serializer.dumps(value)
+    except (TypeError, ValueError):
+        # The inner serializer does not support this shape
+        return
+    dumps_ops = measure(serializer.dumps, value, min_time)
+    loads_ops = measure(serializer.loads, encoded, min_time)
+    return {
+        'dumps_ops': dumps_ops,
+        'loads_ops': loads_ops,
+        'dumps_bytes': dumps_ops * plain_size,
+        'loads_bytes': loads_ops * plain_size,
+        'size': len(encoded),
+        'overhead': float(len(encoded)) / plain_size,
+        'dumps_peak': peak_allocation(serializer.dumps, value),
+        'loads_peak': peak_allocation(serializer.loads, encoded),
+    }
+
+
+def build_serializers(names):
+    serializers = []
+    for name, options in VARIANTS:
+        if names and name not in names:
+            continue
+        if options is None:
+            serializers.append((name, PickleSerializer({})))
+            continue
+        try:
+            serializers.append((name, SecureSerializer(dict(options, REDIS_SECRET_KEY=SECRET_KEY))))
+        except ImproperlyConfigured as e:
+            print('Skipping {}: {}'.format(name, e), file=sys.stderr)
+    return serializers
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1000:
+            return '{:.0f}{}'.format(size, unit)
+        size /= 1000.0
+    return '{:.0f}TB'.format(size)
+
+
+def run(sizes, shapes, variants, min_time):
+    reference = PickleSerializer({})
+    serializers = build_serializers(variants)
+    results = {}
+    print('{:<6} {:>6} {:<18} {:>10} {:>10} {:>10} {:>10} {:>9} {:>10} {:>10}'.format(
+        'shape', 'size', 'variant', 'dumps/s', 'loads/s', 'dumps B/s', 'loads B/s', 'overhead', 'dumps peak',
+        'loads peak'))
+    for shape, factory, scalable in SHAPES:
+        if shapes and shape not in shapes:
+            continue
+        for size in sizes:
+            value = make_value(factory, scalable, size, reference)
+            plain_size = len(reference.dumps(value))
+            for name, serializer in serializers:
+                result = run_case(serializer, value, plain_size, min_time)
+                if result is None:
+                    continue
+                results['{}/{}/{}'.format(shape, size, name)] = result
+                print('{:<6} {:>6} {:<18} {:>10.0f} {:>10.0f} {:>10} {:>10} {:>8.2f}x {:>10} {:>10}'.format(
+                    shape, format_size(size), name, result['dumps_ops'], result['loads_ops'],
+                    format_size(result['dumps_bytes']), format_size(result['loads_bytes']), result['overhead'],
+                    format_size(result['dumps_peak']) if result['dumps_peak'] is not None else '-',
+                    format_size(result['loads_peak']) if result['loads_peak'] is not None else '-'))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    :return: descriptions of the cases slower than ``baseline`` by more than ``threshold``, or whose encrypted size
+    grew by more than ``threshold``
+    """
+    regressions = []
+    for case, result in sorted(results.items()):
+        expected = baseline.get(case)
+        if expected is None:
+            continue
+        for metric in ('dumps_ops', 'loads_ops'):
+            if result[metric] < expected[metric] * (1 - threshold):
+                regressions.append('{} {}: {:.0f} < {:.0f}'.format(case, metric, result[metric], expected[metric]))
+        if result['size'] > expected['size'] * (1 + threshold):
+            regressions.append('{} size: {} > {}'.format(case, result['size'], expected['size']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action='store_true', help='only payloads up to 10KB')
+    parser.add_argument('--sizes', type=int, nargs='+', help='payload sizes in bytes')
+    parser.add_argument('--shapes', nargs='+', choices=[shape for shape, _, _ in SHAPES])
+    parser.add_argument('--variants', nargs='+', choices=[name for name, _ in VARIANTS])
+    parser.add_argument('--min-time', type=float, default=DEFAULT_MIN_TIME,
+                        help='minimum number of seconds each case is repeated for')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON file of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='allowed slowdown against the baseline, as a fraction')
+    args = parser.parse_args(argv)
+
+    sizes = args.sizes or (QUICK_SIZES if args.quick else SIZES)
+    results = run(sizes, args.shapes, args.variants, args.min_time)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print('\nRegressions above {:.0%}:'.format(args.threshold), file=sys.stderr)
+            for regression in regressions:
+                print('  ' + regression, file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
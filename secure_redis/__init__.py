@@ -1,4 +1 @@
-from . import settings
-
-
 __version__ = '1.1.4'
@@ -0,0 +1,210 @@
+"""
+Asyncio API of the secure caches, Python 3 only. Requires redis>=4.2 for ``redis.asyncio``.
+"""
+import asyncio
+import functools
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import six
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+from . import chunks
+from . import settings
+from .client import SecureDefaultClient
+from .serializer import get_executor
+
+
+DEFAULT_OFFLOAD_THRESHOLD = 16 * 1024
+DEFAULT_OFFLOAD_WORKERS = 4
+
+
+class AsyncSecureCache(object):
+    """
+    Secure cache ``cache_name`` used from asyncio code, with the same keys and envelopes as its synchronous client.
+    Redis is accessed with ``redis.asyncio``, and the values of at least ``SECURE_ASYNC_THRESHOLD`` bytes are
+    serialized, encrypted and decrypted in a thread pool of ``SECURE_ASYNC_WORKERS`` threads shared by the process,
+    smaller ones on the event loop where a thread hand off would cost more than the cipher. Values other than strings,
+    bytes and numbers, whose size is only known once serialized, are always written from the thread pool. Chunked
+    values are fetched with ``SECURE_CHUNK_BATCH`` chunks per ``MGET`` and always decrypted in the thread pool.
+
+    The cache must use ``SecureDefaultClient``, as ``secure_redis.cache.SecureRedisCache`` does by default.
+
+    Redis asyncio connections belong to the event loop they were opened in, build one instance per event loop.
+    """
+
+    def __init__(self, cache_name=None):
+        if aioredis is None:
+            raise ImproperlyConfigured('The async secure cache requires redis>=4.2 for redis.asyncio')
+        if cache_name is None:
+            cache_name = settings.get_secure_cache_name()
+        if settings.get_secure_cache_opts(cache_name) is None:
+            raise ImproperlyConfigured('The cache {} does not use SecureSerializer'.format(cache_name))
+
+        self.cache = caches[cache_name]
+        self.client = self.cache.client
+        if not isinstance(self.client, SecureDefaultClient):
+            raise ImproperlyConfigured('The cache {} does not use {}.{} as CLIENT_CLASS'.format(
+                cache_name, SecureDefaultClient.__module__, SecureDefaultClient.__name__))
+        self.serializer = self.client._serializer
+        options = self.client._options
+        self.offload_threshold = options.get('SECURE_ASYNC_THRESHOLD', DEFAULT_OFFLOAD_THRESHOLD)
+        self.executor = get_executor('thread', options.get('SECURE_ASYNC_WORKERS', DEFAULT_OFFLOAD_WORKERS))
+
+        connection_kwargs = {}
+        if options.get('DB') is not None:
+            connection_kwargs['db'] = options['DB']
+        if options.get('PASSWORD'):
+            connection_kwargs['password'] = options['PASSWORD']
+        self.redis = aioredis.from_url(self.client._server[0], **connection_kwargs)
+
+    async def _run(self, func, value):
+        if len(value) < self.offload_threshold:
+            return func(value)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, value)
+
+    def _is_small(self, value):
+        if value is None or isinstance(value, (bool, float) + six.integer_types):
+            return True
+        if isinstance(value, (six.binary_type, six.text_type, bytearray)):
+            return len(value) < self.offload_threshold
+        return False
+
+    async def encode(self, value):
+        if self._is_small(value):
+            return self.client.encode(value)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.client.encode, value)
+
+    async def decode(self, value):
+        """
+        :raise ChunkMissing: when ``value`` is the manifest of a chunked value whose chunk no longer exists
+        """
+        manifest = chunks.parse_manifest(value)
+        if manifest is not None:
+            return await self._load_chunks(*manifest)
+        try:
+            # Integers written in plain text by older versions
+            return int(value)
+        except (ValueError, TypeError):
+            return await self._run(self.serializer.loads, self.client._decompress(value))
+
+    async def _load_chunks(self, value_id, count):
+        prefix = self.client._chunk_prefix
+        batch = self.client._chunk_batch
+        keys = [chunks.get_chunk_key(prefix, value_id, i) for i in range(count)]
+        fetched = {}
+        for i in range(0, count, batch):
+            values = await self.redis.mget(keys[i:i + batch])
+            if None in values:
+                raise chunks.ChunkMissing(value_id)
+            fetched.update(zip(keys[i:i + batch], values))
+
+        load = functools.partial(
+            chunks.load, self.serializer, prefix, value_id, count, lambda keys: [fetched[key] for key in keys],
+            chunk_size=self.client._chunk_size or chunks.DEFAULT_CHUNK_SIZE, batch=batch)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, load)
+
+    def _drop_chunks(self, nkeys, pipeline):
+        """
+        Queue the deletion of the chunks of the values of ``nkeys``, which are about to be replaced, like the
+        synchronous client does.
+        """
+        if self.client._chunk_size:
+            pipeline.eval(chunks.CHUNKS_SCRIPT, len(nkeys), *(list(nkeys) + [
+                chunks.MANIFEST_MAGIC, self.client._chunk_prefix, chunks.DROP]))
+
+    def _timeout(self, timeout):
+        """
+        :return: time to live in milliseconds, ``None`` for keys which never expire
+        """
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.cache.default_timeout
+        if timeout is None:
+            return None
+        return int(timeout * 1000)
+
+    async def _invalidate(self, nkeys):
+        near = self.client._near_cache
+        if near is None:
+            return
+        near.invalidate(nkeys)
+        for nkey in nkeys:
+            await self.redis.publish(near.channel, nkey)
+
+    async def aget(self, key, default=None, version=None):
+        value = await self.redis.get(self.client.make_key(key, version=version))
+        if value is None:
+            return default
+        try:
+            return await self.decode(value)
+        except chunks.ChunkMissing:
+            return default
+
+    async def aget_many(self, keys, version=None):
+        """
+        :return: dict of the keys found to their value, read with a single ``MGET``
+        """
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = await self.redis.mget([self.client.make_key(key, version=version) for key in keys])
+        found = [(key, value) for key, value in zip(keys, values) if value is not None]
+        decoded = await asyncio.gather(*[self.decode(value) for _, value in found], return_exceptions=True)
+        result = {}
+        for (key, _), value in zip(found, decoded):
+            if isinstance(value, chunks.ChunkMissing):
+                continue
+            if isinstance(value, BaseException):
+                raise value
+            result[key] = value
+        return result
+
+    async def aset(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, nx=False):
+        nkey = self.client.make_key(key, version=version)
+        ttl = self._timeout(timeout)
+        if ttl is not None and ttl <= 0:
+            # Like django-redis, a key which expires now is deleted instead
+            if nx:
+                return not await self.redis.exists(nkey)
+            async with self.redis.pipeline(transaction=False) as pipeline:
+                self._drop_chunks([nkey], pipeline)
+                pipeline.delete(nkey)
+                await pipeline.execute()
+            await self._invalidate([six.text_type(nkey)])
+            return True
+
+        value = await self.encode(value)
+        if nx:
+            result = await self.redis.set(nkey, value, px=ttl, nx=True)
+        else:
+            async with self.redis.pipeline(transaction=False) as pipeline:
+                self._drop_chunks([nkey], pipeline)
+                pipeline.set(nkey, value, px=ttl)
+                result = (await pipeline.execute())[-1]
+        await self._invalidate([six.text_type(nkey)])
+        return bool(result)
+
+    async def aset_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        """
+        Encrypt the values concurrently and write them with a single pipeline.
+        """
+        keys = list(data.keys())
+        if not keys:
+            return
+        ttl = self._timeout(timeout)
+        nkeys = [self.client.make_key(key, version=version) for key in keys]
+        values = await asyncio.gather(*[self.encode(data[key]) for key in keys])
+        async with self.redis.pipeline(transaction=False) as pipeline:
+            self._drop_chunks(nkeys, pipeline)
+            for nkey, value in zip(nkeys, values):
+                if ttl is not None and ttl <= 0:
+                    pipeline.delete(nkey)
+                else:
+                    pipeline.set(nkey, value, px=ttl)
+            await pipeline.execute()
+        await self._invalidate([six.text_type(nkey) for nkey in nkeys])
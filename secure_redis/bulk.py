@@ -0,0 +1,229 @@
+from __future__ import unicode_literals
+
+from collections import defaultdict
+
+from rq.exceptions import NoSuchJobError
+from rq.job import Job
+from rq.queue import Queue
+
+from django_rq.queues import get_queue, get_queue_by_index
+
+from . import settings
+from . import task_index
+from . import tasks
+
+
+DEFAULT_CHUNK_SIZE = 1000
+BACKGROUND_JOB_TIMEOUT = 60 * 60
+PROGRESS_KEY = 'secure_redis:requeue:{}'
+# Refreshed after every chunk, the progress of a requeue which died disappears soon after
+PROGRESS_TTL = 10 * 60
+
+# Replace every occurrence of the ids to remove by a tombstone while walking the queue once, then remove every
+# tombstone with a single LREM, and delete the job hashes. KEYS are the queue followed by the hash and dependents key
+# of each job, ARGV the tombstone followed by the job ids.
+DELETE_SCRIPT = """
+local ids = {}
+for i = 2, #ARGV do
+    ids[ARGV[i]] = true
+end
+local length = redis.call('LLEN', KEYS[1])
+local start = 0
+while start < length do
+    local chunk = redis.call('LRANGE', KEYS[1], start, start + 999)
+    for offset, id in ipairs(chunk) do
+        if ids[id] then
+            redis.call('LSET', KEYS[1], start + offset - 1, ARGV[1])
+        end
+    end
+    start = start + 1000
+end
+local removed = redis.call('LREM', KEYS[1], 0, ARGV[1])
+for i = 2, #KEYS do
+    redis.call('DEL', KEYS[i])
+end
+return removed
+"""
+TOMBSTONE = 'secure_redis:deleted'
+
+
+class _PrefetchedConnection(object):
+    """
+    Stands for the connection of a job while ``Job.refresh`` parses a hash that was already fetched.
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    def hgetall(self, key):
+        return self.data
+
+
+def fetch_jobs(job_ids, connection):
+    """
+    Fetch the jobs of a page in a single round trip, jobs which no longer exist are skipped.
+    """
+    if hasattr(Job, 'fetch_many'):
+        return [job for job in Job.fetch_many(job_ids, connection=connection) if job is not None]
+
+    pipeline = connection.pipeline()
+    for job_id in job_ids:
+        pipeline.hgetall(Job.key_for(job_id))
+
+    jobs = []
+    for job_id, data in zip(job_ids, pipeline.execute()):
+        if not data:
+            continue
+        job = Job(job_id, connection=_PrefetchedConnection(data))
+        try:
+            job.refresh()
+        except NoSuchJobError:
+            continue
+        job.connection = connection
+        jobs.append(job)
+    return jobs
+
+
+def delete_jobs(queue, job_ids):
+    """
+    Remove every occurrence of ``job_ids`` from ``queue`` and delete the jobs with a single script, the queue is
+    walked once whatever the number of jobs.
+    :return: number of ids removed from ``queue``
+    """
+    if not job_ids:
+        return 0
+    keys = [queue.key]
+    for job_id in job_ids:
+        keys.append(Job.key_for(job_id))
+        keys.append(Job.dependents_key_for(job_id))
+    return queue.connection.eval(DELETE_SCRIPT, len(keys), *(keys + [TOMBSTONE] + list(job_ids)))
+
+
+def delete_matching(queue, predicate, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Delete the jobs of ``queue`` for which ``predicate`` is true. The queue is streamed in chunks of ``chunk_size``
+    jobs, each fetched with a single pipeline, and the matching jobs of a chunk are deleted by ``delete_jobs``. Jobs
+    pushed meanwhile are not considered.
+    :param predicate: function called with a list of jobs and returning the jobs to delete
+    :return: number of jobs removed from ``queue``
+    """
+    deleted = 0
+    start = 0
+    remaining = queue.count
+    while remaining > 0:
+        job_ids = queue.get_job_ids(start, min(chunk_size, remaining))
+        if not job_ids:
+            break
+        remaining -= len(job_ids)
+        jobs = predicate(fetch_jobs(job_ids, queue.connection))
+        removed = delete_jobs(queue, [job.id for job in jobs])
+        if task_index.is_enabled():
+            task_index.remove_jobs(jobs, queue.connection)
+        deleted += removed
+        # Duplicated ids may have been removed further in the queue too
+        start = max(0, start + len(job_ids) - removed)
+    return deleted
+
+
+def get_progress_key(queue):
+    return PROGRESS_KEY.format(queue.key)
+
+
+def get_progress(queue):
+    """
+    :return: tuple of the number of jobs requeued so far and the number of jobs to requeue, ``None`` if no requeue of
+    ``queue`` is running
+    """
+    progress = queue.connection.hmget(get_progress_key(queue), 'requeued', 'total')
+    if None in progress:
+        return
+    return tuple(int(value) for value in progress)
+
+
+def requeue_jobs(queue, limit=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Move the jobs of ``queue``, usually the failed queue, back to their origin queue. Job ids are streamed in chunks
+    of ``chunk_size`` and each chunk is requeued and removed from ``queue`` in a single transaction, so a requeue
+    which dies leaves every job either in ``queue`` or in its origin queue. The progress is kept in Redis for
+    ``get_progress``. Jobs which no longer exist are dropped from the queue.
+    :param limit: maximum number of jobs to requeue, defaults to the length of ``queue`` when called so jobs failing
+    meanwhile are left in the queue
+    :return: number of jobs removed from ``queue``
+    """
+    connection = queue.connection
+    if limit is None:
+        limit = queue.count
+    progress_key = get_progress_key(queue)
+    pipeline = connection.pipeline()
+    pipeline.hset(progress_key, 'requeued', 0)
+    pipeline.hset(progress_key, 'total', limit)
+    pipeline.expire(progress_key, PROGRESS_TTL)
+    pipeline.execute()
+
+    origin_queues = {}
+    requeued = 0
+    try:
+        while requeued < limit:
+            job_ids = queue.get_job_ids(0, min(chunk_size, limit - requeued))
+            if not job_ids:
+                break
+
+            pipeline = connection.pipeline()
+            jobs = fetch_jobs(job_ids, connection)
+            for job in jobs:
+                origin_queue = origin_queues.get(job.origin)
+                if origin_queue is None:
+                    origin_queue = origin_queues[job.origin] = Queue(job.origin, connection=connection)
+                job.exc_info = None
+                origin_queue.enqueue_job(job, pipeline=pipeline)
+            if task_index.is_enabled():
+                add_to_index(jobs, origin_queues, pipeline)
+            for job_id in job_ids:
+                # At the head of the queue unless another client removed jobs meanwhile
+                pipeline.lrem(queue.key, 1, job_id)
+            pipeline.hincrby(progress_key, 'requeued', len(job_ids))
+            pipeline.expire(progress_key, PROGRESS_TTL)
+            pipeline.execute()
+            requeued += len(job_ids)
+    finally:
+        connection.delete(progress_key)
+    return requeued
+
+
+def add_to_index(jobs, origin_queues, pipeline):
+    """
+    Index again the secure jobs requeued, they were removed from the index when they failed.
+    :param origin_queues: dict of queue name to queue of the origins of ``jobs``
+    """
+    job_ids = defaultdict(list)
+    for job in jobs:
+        fingerprint = (job.kwargs or {}).get(tasks.FINGERPRINT_KWARG)
+        if fingerprint:
+            job_ids[(job.origin, fingerprint)].append(job.id)
+    for (origin, fingerprint), ids in job_ids.items():
+        task_index.add_jobs(origin_queues[origin], fingerprint, ids, pipeline=pipeline)
+
+
+def index_requeued(jobs, connection):
+    """
+    Index again secure jobs requeued one by one, like ``requeue_jobs`` does for the jobs it moves.
+    """
+    origin_queues = dict((job.origin, Queue(job.origin, connection=connection)) for job in jobs)
+    pipeline = connection.pipeline()
+    add_to_index(jobs, origin_queues, pipeline)
+    pipeline.execute()
+
+
+def requeue_all(queue_index, limit=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Background job of ``start_requeue``.
+    """
+    return requeue_jobs(get_queue_by_index(queue_index), limit=limit, chunk_size=chunk_size)
+
+
+def start_requeue(queue_index, limit=None):
+    """
+    Requeue the jobs of the queue ``queue_index`` from a job of the ``SECURE_RQ_BULK_QUEUE`` queue.
+    """
+    return get_queue(settings.get_bulk_queue_name()).enqueue_call(
+        requeue_all, args=(queue_index, limit), timeout=BACKGROUND_JOB_TIMEOUT)
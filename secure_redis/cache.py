@@ -0,0 +1,27 @@
+from __future__ import unicode_literals
+
+from django_redis.cache import RedisCache, omit_exception
+
+
+class SecureRedisCache(RedisCache):
+    """
+    django-redis cache backend using ``secure_redis.client.SecureDefaultClient`` unless another ``CLIENT_CLASS`` is
+    given, and exposing the client's atomic operations on encrypted values.
+    """
+
+    def __init__(self, server, params):
+        options = dict(params.get('OPTIONS') or {})
+        options.setdefault('CLIENT_CLASS', 'secure_redis.client.SecureDefaultClient')
+        super(SecureRedisCache, self).__init__(server, dict(params, OPTIONS=options))
+
+    @omit_exception
+    def cas(self, *args, **kwargs):
+        return self.client.cas(*args, **kwargs)
+
+    @omit_exception
+    def cas_many(self, *args, **kwargs):
+        return self.client.cas_many(*args, **kwargs)
+
+    @omit_exception
+    def incr_many(self, *args, **kwargs):
+        return self.client.incr_many(*args, **kwargs)
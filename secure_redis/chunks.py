@@ -0,0 +1,195 @@
+from __future__ import unicode_literals
+
+import binascii
+import io
+import os
+import pickle
+import struct
+
+from cryptography.fernet import InvalidToken
+
+from django.utils import six
+
+from . import serializer as secure_serializer
+
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+# Number of chunks written or read per round trip
+DEFAULT_CHUNK_BATCH = 8
+
+# Stored in place of the value, can not start an encrypted envelope, a compressed value or an integer
+MANIFEST_MAGIC = b'\x00secure-chunks:'
+CHUNK_KEY = '{}secure_chunk:{}:{}'
+VALUE_ID_SIZE = 16
+# Authenticated with each chunk: the id of the value it belongs to, its index and whether it is the last one
+CHUNK_HEADER = struct.Struct('>{}sI?'.format(VALUE_ID_SIZE))
+
+# Apply to the chunks of the values stored in KEYS which are manifests, either ``drop`` to delete them or ``sync`` to
+# give them the time to live of their manifest. ARGV are the manifest magic, the prefix of the chunk keys and the mode.
+CHUNKS_SCRIPT = """
+local total = 0
+for _, manifest_key in ipairs(KEYS) do
+    local value = redis.call('GET', manifest_key)
+    if value and string.sub(value, 1, #ARGV[1]) == ARGV[1] then
+        local value_id, count = string.match(string.sub(value, #ARGV[1] + 1), '^(%x+):(%d+)$')
+        if value_id then
+            local ttl = redis.call('PTTL', manifest_key)
+            for i = 0, tonumber(count) - 1 do
+                local key = ARGV[2] .. 'secure_chunk:' .. value_id .. ':' .. i
+                if ARGV[3] == 'drop' then
+                    redis.call('DEL', key)
+                elseif ttl > 0 then
+                    redis.call('PEXPIRE', key, ttl)
+                else
+                    redis.call('PERSIST', key)
+                end
+            end
+            total = total + tonumber(count)
+        end
+    end
+end
+return total
+"""
+DROP = 'drop'
+SYNC = 'sync'
+
+
+class ChunkMissing(Exception):
+    """
+    A chunk of a value expired or was evicted before its manifest, the value is lost.
+    """
+
+
+def get_chunk_key(prefix, value_id, index):
+    return CHUNK_KEY.format(prefix, value_id, index)
+
+
+def make_manifest(value_id, count):
+    return MANIFEST_MAGIC + value_id.encode('ascii') + b':' + six.text_type(count).encode('ascii')
+
+
+def parse_manifest(value):
+    """
+    :return: tuple of the value id and the number of chunks, ``None`` if ``value`` is not a manifest
+    """
+    if not isinstance(value, bytes) or not value.startswith(MANIFEST_MAGIC):
+        return
+    value_id, count = value[len(MANIFEST_MAGIC):].split(b':')
+    return value_id.decode('ascii'), int(count)
+
+
+class ChunkWriter(object):
+    """
+    File like object which cuts what is written into chunks of ``chunk_size`` bytes and hands each encrypted chunk
+    to ``store(value_id, index, chunk)`` as soon as it is full, so the whole plain text is never held in memory.
+    """
+
+    def __init__(self, serializer, chunk_size, store):
+        self.serializer = serializer
+        self.chunk_size = chunk_size
+        self.store = store
+        self.raw_value_id = os.urandom(VALUE_ID_SIZE)
+        self.value_id = binascii.hexlify(self.raw_value_id).decode('ascii')
+        self.count = 0
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) > self.chunk_size:
+            self._emit(self.buffer[:self.chunk_size], last=False)
+            del self.buffer[:self.chunk_size]
+        return len(data)
+
+    def _emit(self, data, last):
+        header = CHUNK_HEADER.pack(self.raw_value_id, self.count, last)
+        self.store(self.value_id, self.count, self.serializer.encrypt(header + bytes(data)))
+        self.count += 1
+
+    def dump(self, value):
+        """
+        Serialize ``value`` like ``SecureSerializer.serialize``, pickles are streamed by the pickler.
+        :return: the plain text when it fits in a single chunk and nothing was stored, otherwise ``None``
+        """
+        if self.serializer.inner_serializer == secure_serializer.INNER_PICKLE and not self.serializer.compression:
+            pickle.Pickler(self, getattr(self.serializer, '_pickle_version', pickle.HIGHEST_PROTOCOL)).dump(value)
+        else:
+            plaintext = memoryview(self.serializer.serialize(value))
+            for i in range(0, len(plaintext), self.chunk_size):
+                self.write(plaintext[i:i + self.chunk_size])
+        return self.finish()
+
+    def finish(self, inline=True):
+        """
+        Store the last chunk.
+        :param inline: return the plain text instead of storing it when it fits in a single chunk
+        :return: the plain text when ``inline`` and nothing was stored yet, otherwise ``None``
+        """
+        if not self.count and inline:
+            return bytes(self.buffer)
+        self._emit(self.buffer, last=True)
+        self.buffer = bytearray()
+
+    @property
+    def manifest(self):
+        return make_manifest(self.value_id, self.count)
+
+
+class ChunkReader(io.RawIOBase):
+    """
+    Readable stream of the plain text of a chunked value, chunks are fetched ``batch`` at a time with
+    ``fetch(keys)`` and decrypted one by one, each read copies straight from the decrypted chunk.
+    """
+
+    def __init__(self, serializer, prefix, value_id, count, fetch, batch=DEFAULT_CHUNK_BATCH):
+        super(ChunkReader, self).__init__()
+        self.serializer = serializer
+        self.prefix = prefix
+        self.value_id = value_id
+        self.raw_value_id = binascii.unhexlify(value_id)
+        self.count = count
+        self.fetch = fetch
+        self.batch = batch
+        self.index = 0
+        self.pending = []
+        self.current = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def _next_chunk(self):
+        if not self.pending:
+            indexes = range(self.index, min(self.index + self.batch, self.count))
+            self.pending = list(self.fetch([get_chunk_key(self.prefix, self.value_id, i) for i in indexes]))
+            self.pending.reverse()
+        chunk = self.pending.pop()
+        if chunk is None:
+            raise ChunkMissing(self.value_id)
+        plaintext = self.serializer.decrypt(chunk)
+        value_id, index, last = CHUNK_HEADER.unpack_from(plaintext)
+        if value_id != self.raw_value_id or index != self.index or last != (index == self.count - 1):
+            raise InvalidToken
+        self.index += 1
+        return memoryview(plaintext)[CHUNK_HEADER.size:]
+
+    def readinto(self, b):
+        while not len(self.current):
+            if self.index == self.count:
+                return 0
+            self.current = self._next_chunk()
+        size = min(len(b), len(self.current))
+        b[:size] = self.current[:size]
+        self.current = self.current[size:]
+        return size
+
+
+def load(serializer, prefix, value_id, count, fetch, chunk_size=DEFAULT_CHUNK_SIZE, batch=DEFAULT_CHUNK_BATCH):
+    """
+    Deserialize a chunked value, pickles are unpickled as their chunks are decrypted.
+    :raise ChunkMissing: when a chunk no longer exists
+    """
+    stream = io.BufferedReader(ChunkReader(serializer, prefix, value_id, count, fetch, batch),
+                               buffer_size=min(chunk_size, io.DEFAULT_BUFFER_SIZE * 16))
+    header = six.indexbytes(stream.peek(1), 0) if stream.peek(1) else None
+    if header is not None and header > secure_serializer.HEADER_MASK:
+        return pickle.load(stream)
+    return serializer.deserialize(stream.read())
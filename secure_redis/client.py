@@ -0,0 +1,451 @@
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+import random
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.utils import six
+
+from django_redis.client import DefaultClient
+from django_redis.client.default import _main_exceptions
+from django_redis.exceptions import ConnectionInterrupted
+
+from redis.exceptions import WatchError
+
+try:
+    from django_redis.exceptions import CompressorError
+except ImportError:
+    # django-redis versions without pluggable compressors
+    CompressorError = None
+
+from . import chunks
+from . import near_cache
+
+
+DEFAULT_CAS_RETRIES = 10
+DEFAULT_CAS_BACKOFF = 0.005
+MAX_CAS_BACKOFF = 0.1
+
+# Passed as ``timeout`` to keep the remaining time to live of the keys
+KEEP_TTL = object()
+
+# Read the values and remaining time to live of the watched keys in a single round trip
+GET_WITH_TTL_SCRIPT = """
+local result = {}
+for i, key in ipairs(KEYS) do
+    result[i * 2 - 1] = redis.call('GET', key)
+    result[i * 2] = redis.call('PTTL', key)
+end
+return result
+"""
+
+
+class _Encoded(object):
+    """
+    Marks a value that has already been through ``encode`` so ``set`` can store it as is.
+    """
+    __slots__ = ('value', )
+
+    def __init__(self, value):
+        self.value = value
+
+
+class SecureDefaultClient(DefaultClient):
+    """
+    django-redis client which sends the values of ``get_many`` and ``set_many`` through the serializer's batch API,
+    enable it by setting ``CLIENT_CLASS`` to ``secure_redis.client.SecureDefaultClient`` in the cache ``OPTIONS``.
+
+    When ``SECURE_NEAR_CACHE`` is defined in the ``OPTIONS``, ``get`` is served from a process local cache of
+    decrypted values, and every write publishes the written keys so the other processes drop their copy.
+
+    Integers are encrypted like any other value, ``incr`` and ``decr`` are implemented on top of ``cas_many``.
+
+    When ``SECURE_CHUNK_SIZE`` is defined in the ``OPTIONS``, ``set`` stores values larger than that many bytes as
+    separately encrypted chunks under their own keys, with a manifest in place of the value, and reads decrypt them
+    chunk by chunk.
+    """
+
+    def __init__(self, server, params, backend):
+        super(SecureDefaultClient, self).__init__(server, params, backend)
+        near_cache_options = self._options.get('SECURE_NEAR_CACHE')
+        if near_cache_options:
+            channel = near_cache_options.get(
+                'CHANNEL', 'secure_redis:near_cache:{}'.format(getattr(backend, 'key_prefix', '')))
+            self._near_cache = near_cache.get_near_cache(channel, near_cache_options)
+        else:
+            self._near_cache = None
+
+        self._chunk_size = self._options.get('SECURE_CHUNK_SIZE')
+        self._chunk_batch = self._options.get('SECURE_CHUNK_BATCH', chunks.DEFAULT_CHUNK_BATCH)
+        key_prefix = getattr(backend, 'key_prefix', '')
+        self._chunk_prefix = '{}:'.format(key_prefix) if key_prefix else ''
+
+        self._cas_retries = self._options.get('SECURE_CAS_RETRIES', DEFAULT_CAS_RETRIES)
+        self._cas_backoff = self._options.get('SECURE_CAS_BACKOFF', DEFAULT_CAS_BACKOFF)
+
+    def encode(self, value, *args, **kwargs):
+        if isinstance(value, _Encoded):
+            return value.value
+        # Unlike the default client, integers are not stored in plain text
+        return self._compress(self._serializer.dumps(value))
+
+    def decode(self, value, client=None):
+        manifest = chunks.parse_manifest(value)
+        if manifest is None:
+            return super(SecureDefaultClient, self).decode(value)
+        if client is None:
+            client = self.get_client(write=False)
+        value_id, count = manifest
+        return chunks.load(self._serializer, self._chunk_prefix, value_id, count, lambda keys: client.mget(*keys),
+                           chunk_size=self._chunk_size or chunks.DEFAULT_CHUNK_SIZE, batch=self._chunk_batch)
+
+    def encode_many(self, values):
+        return [self._compress(value) for value in self._dumps_many(values)]
+
+    def decode_many(self, values):
+        values = list(values)
+        indexes = []
+        for i, value in enumerate(values):
+            if chunks.parse_manifest(value) is not None:
+                try:
+                    values[i] = self.decode(value)
+                except chunks.ChunkMissing:
+                    values[i] = chunks.ChunkMissing
+                continue
+            try:
+                values[i] = int(value)
+            except (ValueError, TypeError):
+                values[i] = self._decompress(value)
+                indexes.append(i)
+        for i, value in zip(indexes, self._loads_many([values[i] for i in indexes])):
+            values[i] = value
+        return values
+
+    def get(self, key, default=None, version=None, client=None):
+        if self._near_cache is None:
+            try:
+                return super(SecureDefaultClient, self).get(key, default=default, version=version, client=client)
+            except chunks.ChunkMissing:
+                return default
+
+        if client is None:
+            client = self.get_client(write=False)
+        self._near_cache.listen(client)
+
+        nkey = six.text_type(self.make_key(key, version=version))
+        plaintext = self._near_cache.get(nkey)
+        if plaintext is not None:
+            return self._serializer.deserialize(plaintext)
+
+        generation = self._near_cache.generation
+        try:
+            pipeline = client.pipeline(transaction=False)
+            pipeline.get(nkey)
+            pipeline.pttl(nkey)
+            value, ttl = pipeline.execute()
+        except _main_exceptions as e:
+            raise ConnectionInterrupted(connection=client, parent=e)
+
+        if value is None:
+            return default
+        if chunks.parse_manifest(value) is not None:
+            # Too large for the near cache
+            try:
+                return self.decode(value, client=client)
+            except chunks.ChunkMissing:
+                return default
+        try:
+            return int(value)
+        except (ValueError, TypeError):
+            pass
+        plaintext = self._serializer.decrypt(self._decompress(value))
+        self._near_cache.set(nkey, plaintext, ttl, generation)
+        return self._serializer.deserialize(plaintext)
+
+    def get_many(self, keys, version=None, client=None):
+        if client is None:
+            client = self.get_client(write=False)
+
+        if not keys:
+            return {}
+
+        recovered_data = OrderedDict()
+        if self._near_cache is not None:
+            self._near_cache.listen(client)
+            for key in keys:
+                plaintext = self._near_cache.get(six.text_type(self.make_key(key, version=version)))
+                if plaintext is not None:
+                    recovered_data[key] = self._serializer.deserialize(plaintext)
+            keys = [key for key in keys if key not in recovered_data]
+            if not keys:
+                return recovered_data
+
+        new_keys = [self.make_key(k, version=version) for k in keys]
+        try:
+            results = client.mget(*new_keys)
+        except _main_exceptions as e:
+            raise ConnectionInterrupted(connection=client, parent=e)
+
+        found = [(key, value) for key, value in zip(keys, results) if value is not None]
+        values = self.decode_many(value for _, value in found)
+        recovered_data.update((key, value) for (key, _), value in zip(found, values)
+                              if value is not chunks.ChunkMissing)
+        return recovered_data
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, client=None, nx=False, **kwargs):
+        if self._chunk_size and not nx and not kwargs and not isinstance(value, _Encoded):
+            result = self._set_chunked(key, value, timeout, version, client)
+        else:
+            if not nx:
+                # The value replaces, or deletes when the timeout is over, a manifest whose chunks would be left behind
+                self._apply_to_chunks([self.make_key(key, version=version)], chunks.DROP, client)
+            result = super(SecureDefaultClient, self).set(
+                key, value, timeout=timeout, version=version, client=client, nx=nx, **kwargs)
+        self._invalidate([key], version, client)
+        return result
+
+    def _set_chunked(self, key, value, timeout, version, client):
+        """
+        Store ``value`` as a single envelope when it fits in a chunk, otherwise as chunks written ``SECURE_CHUNK_BATCH``
+        per round trip followed by the manifest, all with the same time to live. The chunks of the previous value of
+        ``key`` are deleted.
+        """
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self._backend.default_timeout
+        if timeout is not None and timeout <= 0:
+            return super(SecureDefaultClient, self).set(key, value, timeout=timeout, version=version, client=client)
+        px = None if timeout is None else int(timeout * 1000)
+        if client is None:
+            client = self.get_client(write=True)
+        nkey = self.make_key(key, version=version)
+
+        try:
+            pipeline = client.pipeline(transaction=False)
+
+            def store(value_id, index, chunk):
+                pipeline.set(chunks.get_chunk_key(self._chunk_prefix, value_id, index), chunk, px=px)
+                if len(pipeline) >= self._chunk_batch:
+                    pipeline.execute()
+
+            writer = chunks.ChunkWriter(self._serializer, self._chunk_size, store)
+            plaintext = writer.dump(value)
+            if plaintext is None:
+                nvalue = writer.manifest
+            else:
+                nvalue = self._compress(self._serializer.encrypt(plaintext))
+            self._apply_to_chunks([nkey], chunks.DROP, pipeline)
+            pipeline.set(nkey, nvalue, px=px)
+            return bool(pipeline.execute()[-1])
+        except _main_exceptions as e:
+            raise ConnectionInterrupted(connection=client, parent=e)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None, client=None):
+        if client is None:
+            client = self.get_client(write=True)
+
+        keys = list(data.keys())
+        values = self.encode_many(data[key] for key in keys)
+        try:
+            pipeline = client.pipeline()
+            self._apply_to_chunks([self.make_key(key, version=version) for key in keys], chunks.DROP, pipeline)
+            for key, value in zip(keys, values):
+                super(SecureDefaultClient, self).set(key, _Encoded(value), timeout, version=version, client=pipeline)
+            pipeline.execute()
+        except _main_exceptions as e:
+            raise ConnectionInterrupted(connection=client, parent=e)
+        self._invalidate(keys, version, client)
+
+    def delete(self, key, version=None, prefix=None, client=None):
+        self._apply_to_chunks([self.make_key(key, version=version, prefix=prefix)], chunks.DROP, client)
+        result = super(SecureDefaultClient, self).delete(key, version=version, prefix=prefix, client=client)
+        self._invalidate([key], version, client, prefix=prefix)
+        return result
+
+    def delete_many(self, keys, version=None, client=None):
+        self._apply_to_chunks([self.make_key(key, version=version) for key in keys], chunks.DROP, client)
+        result = super(SecureDefaultClient, self).delete_many(keys, version=version, client=client)
+        self._invalidate(keys, version, client)
+        return result
+
+    def delete_pattern(self, *args, **kwargs):
+        result = super(SecureDefaultClient, self).delete_pattern(*args, **kwargs)
+        self._invalidate_all(kwargs.get('client'))
+        return result
+
+    def clear(self, client=None):
+        result = super(SecureDefaultClient, self).clear(client=client)
+        self._invalidate_all(client)
+        return result
+
+    def cas(self, key, func, default=None, timeout=KEEP_TTL, version=None, client=None):
+        """
+        Atomically replace the value of ``key`` with ``func(value)``, ``default`` is passed when the key is missing.
+        :return: the new value
+        """
+        def replace(values):
+            return {key: func(values.get(key, default))}
+        return self.cas_many([key], replace, timeout=timeout, version=version, client=client)[key]
+
+    def cas_many(self, keys, func, timeout=KEEP_TTL, version=None, client=None):
+        """
+        Atomically replace the values of ``keys`` in a single optimistic transaction: the keys are watched while
+        their values are read, ``func`` gets a dict of the existing values and returns a dict of the values to write.
+        When another client changes one of the keys in between, ``func`` is called again after a short backoff.
+        :param timeout: timeout of the written keys, by default their remaining time to live is kept
+        :return: the dict returned by ``func``
+        :raise WatchError: when the keys kept changing for ``SECURE_CAS_RETRIES`` attempts
+        """
+        if client is None:
+            client = self.get_client(write=True)
+
+        nkeys = OrderedDict((self.make_key(key, version=version), key) for key in keys)
+        for attempt in range(self._cas_retries + 1):
+            try:
+                with client.pipeline() as pipeline:
+                    pipeline.watch(*nkeys)
+                    result = pipeline.eval(GET_WITH_TTL_SCRIPT, len(nkeys), *nkeys)
+                    ttls = dict(zip(nkeys, result[1::2]))
+                    values = dict((nkeys[nkey], self.decode(value))
+                                  for nkey, value in zip(nkeys, result[::2]) if value is not None)
+
+                    new_values = func(values)
+                    encoded = self.encode_many(new_values.values())
+
+                    pipeline.multi()
+                    self._apply_to_chunks([self.make_key(key, version=version) for key in new_values], chunks.DROP,
+                                          pipeline)
+                    for key, value in zip(new_values, encoded):
+                        nkey = self.make_key(key, version=version)
+                        px = self._cas_timeout(timeout, ttls.get(nkey))
+                        if px is not None and px <= 0:
+                            pipeline.delete(nkey)
+                        else:
+                            pipeline.set(nkey, value, px=px)
+                    pipeline.execute()
+            except WatchError:
+                if attempt == self._cas_retries:
+                    raise
+                backoff = min(MAX_CAS_BACKOFF, self._cas_backoff * 2 ** attempt)
+                time.sleep(backoff * random.random())
+            except _main_exceptions as e:
+                raise ConnectionInterrupted(connection=client, parent=e)
+            else:
+                self._invalidate(new_values, version, client)
+                return new_values
+
+    def incr(self, key, delta=1, version=None, client=None, ignore_key_check=False):
+        return self.incr_many({key: delta}, version=version, client=client, ignore_key_check=ignore_key_check)[key]
+
+    def decr(self, key, delta=1, version=None, client=None, ignore_key_check=False):
+        return self.incr(key, -delta, version=version, client=client, ignore_key_check=ignore_key_check)
+
+    def incr_many(self, deltas, version=None, client=None, ignore_key_check=False):
+        """
+        Increment several encrypted counters in a single transaction.
+        :param deltas: dict of key to the value to add to it
+        :return: dict of key to its new value
+        """
+        def increment(values):
+            for key in deltas:
+                if key not in values and not ignore_key_check:
+                    raise ValueError("Key '{}' not found".format(key))
+            return dict((key, values.get(key, 0) + delta) for key, delta in deltas.items())
+        return self.cas_many(list(deltas), increment, version=version, client=client)
+
+    def expire(self, key, timeout, version=None, client=None):
+        result = super(SecureDefaultClient, self).expire(key, timeout, version=version, client=client)
+        self._invalidate([key], version, client)
+        self._apply_to_chunks([self.make_key(key, version=version)], chunks.SYNC, client)
+        return result
+
+    def persist(self, key, version=None, client=None):
+        result = super(SecureDefaultClient, self).persist(key, version=version, client=client)
+        self._invalidate([key], version, client)
+        self._apply_to_chunks([self.make_key(key, version=version)], chunks.SYNC, client)
+        return result
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None, client=None):
+        result = super(SecureDefaultClient, self).touch(key, timeout=timeout, version=version, client=client)
+        self._invalidate([key], version, client)
+        self._apply_to_chunks([self.make_key(key, version=version)], chunks.SYNC, client)
+        return result
+
+    def _apply_to_chunks(self, nkeys, mode, client):
+        """
+        Delete the chunks of the values of ``nkeys``, or give them the time to live of their manifest, when chunked
+        storage is enabled. Runs as a single script, queued when ``client`` is a pipeline.
+        """
+        if not self._chunk_size or not nkeys:
+            return
+        if client is None:
+            client = self.get_client(write=True)
+        try:
+            client.eval(chunks.CHUNKS_SCRIPT, len(nkeys), *(list(nkeys) + [
+                chunks.MANIFEST_MAGIC, self._chunk_prefix, mode]))
+        except _main_exceptions as e:
+            raise ConnectionInterrupted(connection=client, parent=e)
+
+    def _cas_timeout(self, timeout, ttl):
+        """
+        :return: the time to live in milliseconds of a key written by ``cas_many``, or ``None`` for no expiry
+        """
+        if timeout is KEEP_TTL:
+            if ttl is not None and ttl > 0:
+                return ttl
+            if ttl == -1:
+                return None
+            # New key
+            timeout = DEFAULT_TIMEOUT
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self._backend.default_timeout
+        if timeout is None:
+            return None
+        return int(timeout * 1000)
+
+    def _invalidate(self, keys, version, client, prefix=None):
+        if self._near_cache is None:
+            return
+        nkeys = [six.text_type(self.make_key(key, version=version, prefix=prefix)) for key in keys]
+        self._near_cache.invalidate(nkeys)
+        self._publish(nkeys, client)
+
+    def _invalidate_all(self, client):
+        if self._near_cache is None:
+            return
+        self._near_cache.clear()
+        self._publish([near_cache.FLUSH_ALL], client)
+
+    def _publish(self, messages, client):
+        if client is None:
+            client = self.get_client(write=True)
+        try:
+            for message in messages:
+                client.publish(self._near_cache.channel, message)
+        except _main_exceptions as e:
+            raise ConnectionInterrupted(connection=client, parent=e)
+
+    def _dumps_many(self, values):
+        if hasattr(self._serializer, 'dumps_many'):
+            return self._serializer.dumps_many(values)
+        return [self._serializer.dumps(value) for value in values]
+
+    def _loads_many(self, values):
+        if hasattr(self._serializer, 'loads_many'):
+            return self._serializer.loads_many(values)
+        return [self._serializer.loads(value) for value in values]
+
+    def _compress(self, value):
+        compressor = getattr(self, '_compressor', None)
+        if compressor is None:
+            return value
+        return compressor.compress(value)
+
+    def _decompress(self, value):
+        compressor = getattr(self, '_compressor', None)
+        if compressor is None:
+            return value
+        try:
+            return compressor.decompress(value)
+        except CompressorError:
+            return value
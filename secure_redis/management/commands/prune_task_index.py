@@ -0,0 +1,23 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from django_rq.queues import get_queue_by_index
+from django_rq.settings import QUEUES_LIST
+
+from secure_redis import task_index
+
+
+class Command(BaseCommand):
+    help = ('Remove from the SECURE_RQ_TASK_INDEX index the jobs which expired or were deleted without being removed '
+            'from it, so the per task counts are exact again.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', dest='batch_size', type=int, default=task_index.DEFAULT_PRUNE_BATCH,
+                            help='Number of indexed jobs checked per round trip')
+
+    def handle(self, *args, **options):
+        for queue_index in range(len(QUEUES_LIST)):
+            queue = get_queue_by_index(queue_index)
+            removed = task_index.prune_stale(queue, batch_size=options['batch_size'])
+            self.stdout.write('Removed {} stale jobs from the index of {}'.format(removed, queue.name))
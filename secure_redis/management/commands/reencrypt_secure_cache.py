@@ -0,0 +1,120 @@
+from __future__ import (division, unicode_literals)
+
+import time
+
+from cryptography.fernet import InvalidToken
+
+from django.conf import settings
+from django.core import cache
+from django.core.cache.backends.base import InvalidCacheBackendError
+from django.core.management.base import BaseCommand, CommandError
+
+from secure_redis import chunks
+
+
+# Replace each value only if it did not change since it was read, and keep its remaining time to live
+REPLACE_SCRIPT = """
+local replaced = 0
+for i, key in ipairs(KEYS) do
+    if redis.call('GET', key) == ARGV[i * 2 - 1] then
+        local ttl = redis.call('PTTL', key)
+        if ttl > 0 then
+            redis.call('SET', key, ARGV[i * 2], 'PX', ttl)
+        else
+            redis.call('SET', key, ARGV[i * 2])
+        end
+        replaced = replaced + 1
+    end
+end
+return replaced
+"""
+
+PROGRESS_TTL = 60 * 60 * 24 * 7
+
+
+class Command(BaseCommand):
+    help = ('Re-encrypt the values of a secure cache with the primary key of REDIS_SECRET_KEYS, the scan position is '
+            'saved after each batch so an interrupted run continues where it stopped.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cache', dest='cache_name',
+                            default=getattr(settings, 'DJANGO_REDIS_SECURE_CACHE_NAME', 'default'),
+                            help='Name of the secure cache, defaults to DJANGO_REDIS_SECURE_CACHE_NAME')
+        parser.add_argument('--batch-size', dest='batch_size', type=int, default=500,
+                            help='Number of keys scanned and replaced per round trip')
+        parser.add_argument('--rate', dest='rate', type=float, default=0,
+                            help='Maximum number of keys scanned per second, 0 for no limit')
+        parser.add_argument('--restart', dest='restart', action='store_true', default=False,
+                            help='Ignore the saved progress and scan from the beginning')
+
+    def handle(self, *args, **options):
+        try:
+            secure_cache = cache.caches[options['cache_name']]
+        except InvalidCacheBackendError:
+            raise CommandError('Unknown cache: {}'.format(options['cache_name']))
+
+        serializer = secure_cache.client._serializer
+        if not hasattr(serializer, 'reencrypt'):
+            raise CommandError('Cache {} does not use SecureSerializer'.format(options['cache_name']))
+
+        client = secure_cache.client.get_client(write=True)
+        self.replace = client.register_script(REPLACE_SCRIPT)
+        self.scanned = self.replaced = self.failed = 0
+        self.started = time.time()
+        self.reencrypt(client, serializer, secure_cache.client.make_key('*'), options)
+        # The chunks of chunked values are stored outside of the keys of the cache, and their manifests are not
+        # encrypted. Only the secure client writes chunks.
+        chunk_prefix = getattr(secure_cache.client, '_chunk_prefix', None)
+        if chunk_prefix is not None:
+            self.reencrypt(client, serializer, chunks.get_chunk_key(chunk_prefix, '*', '*'), options)
+
+        self.stdout.write('Scanned {} keys, re-encrypted {}, could not decrypt {}'.format(
+            self.scanned, self.replaced, self.failed))
+
+    def reencrypt(self, client, serializer, pattern, options):
+        """
+        Re-encrypt the values of the keys matching ``pattern``.
+        """
+        progress_key = 'secure_redis:reencrypt:{}'.format(pattern)
+
+        cursor = 0 if options['restart'] else int(client.get(progress_key) or 0)
+        if cursor:
+            self.stdout.write('Resuming {} from cursor {}'.format(pattern, cursor))
+
+        while True:
+            cursor, keys = client.scan(cursor, match=pattern, count=options['batch_size'])
+            self.scanned += len(keys)
+
+            script_keys, script_args = [], []
+            for key, value in zip(keys, client.mget(keys) if keys else []):
+                if value is None or _is_integer(value) or chunks.parse_manifest(value) is not None:
+                    continue
+                try:
+                    new_value = serializer.reencrypt(value)
+                except InvalidToken:
+                    self.failed += 1
+                    continue
+                if new_value is not None:
+                    script_keys.append(key)
+                    script_args.extend([value, new_value])
+            if script_keys:
+                self.replaced += self.replace(keys=script_keys, args=script_args)
+
+            if not cursor:
+                client.delete(progress_key)
+                break
+            client.set(progress_key, cursor, ex=PROGRESS_TTL)
+
+            if options['rate']:
+                delay = self.scanned / options['rate'] - (time.time() - self.started)
+                if delay > 0:
+                    time.sleep(delay)
+
+
+def _is_integer(value):
+    # django-redis stores integers as is
+    try:
+        int(value)
+    except (ValueError, TypeError):
+        return False
+    return True
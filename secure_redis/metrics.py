@@ -0,0 +1,321 @@
+from __future__ import division, unicode_literals
+
+from collections import defaultdict
+from functools import wraps
+import logging
+import math
+import os
+import threading
+import time
+
+from django.core.signals import setting_changed
+from django.dispatch import Signal
+from django.utils.module_loading import import_string
+
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from . import settings
+
+
+logger = logging.getLogger(__name__)
+
+# Redis hash of the aggregates flushed by ``RedisBackend``
+METRICS_KEY = 'secure_redis:metrics'
+QUANTILES = (0.5, 0.95, 0.99)
+
+timer = getattr(time, 'perf_counter', time.time)
+
+# Sent by ``SignalBackend`` for each measurement, with the ``kind`` ("histogram" or "counter"), ``name``, ``value``
+# and ``tags`` arguments
+metric_recorded = Signal()
+
+
+def format_tags(tags):
+    return ','.join('{}={}'.format(key, tags[key]) for key in sorted(tags))
+
+
+def get_bucket(value):
+    """
+    :return: exponent of the smallest power of two above ``value``, histograms count values per power of two
+    """
+    return math.frexp(value)[1]
+
+
+class Histogram(object):
+    __slots__ = ('count', 'total', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.buckets = defaultdict(int)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.buckets[get_bucket(value)] += 1
+
+    def copy(self):
+        histogram = Histogram()
+        histogram.count = self.count
+        histogram.total = self.total
+        histogram.buckets.update(self.buckets)
+        return histogram
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def quantile(self, q):
+        """
+        :return: upper bound of the bucket holding the ``q`` quantile, within a factor of two of the actual value
+        """
+        rank = q * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return 2.0 ** bucket
+        return 0.0
+
+
+class MetricsBackend(object):
+    """
+    Receives the measurements of the secure serializers, jobs and admin views. ``tags`` are the ``key=value`` pairs
+    of the measurement, such as the cache alias or the task name, joined by commas.
+    """
+
+    def observe(self, name, value, tags):
+        pass
+
+    def increment(self, name, amount, tags):
+        pass
+
+    def flush(self):
+        pass
+
+
+class SignalBackend(MetricsBackend):
+    """
+    Send every measurement as the ``metric_recorded`` signal, to forward them to statsd, Prometheus or logs.
+    """
+
+    def observe(self, name, value, tags):
+        metric_recorded.send(sender=self.__class__, kind='histogram', name=name, value=value, tags=tags)
+
+    def increment(self, name, amount, tags):
+        metric_recorded.send(sender=self.__class__, kind='counter', name=name, value=amount, tags=tags)
+
+
+class MemoryBackend(MetricsBackend):
+    """
+    Aggregate the measurements of the current process in histograms and counters, shown by the admin panel.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = defaultdict(Histogram)
+        self.counters = defaultdict(int)
+
+    def observe(self, name, value, tags):
+        with self.lock:
+            self.histograms[name, tags].add(value)
+
+    def increment(self, name, amount, tags):
+        with self.lock:
+            self.counters[name, tags] += amount
+
+    def snapshot(self):
+        """
+        :return: tuple of dicts of ``(name, tags)`` to their ``Histogram`` and to their count
+        """
+        with self.lock:
+            return (dict((key, histogram.copy()) for key, histogram in self.histograms.items()),
+                    dict(self.counters))
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+
+class RedisBackend(MemoryBackend):
+    """
+    Aggregate in memory like ``MemoryBackend``, and add the aggregates to the ``METRICS_KEY`` hash of the secure
+    cache's Redis every ``SECURE_REDIS_METRICS_FLUSH_INTERVAL`` seconds and after each secure job, so the admin panel
+    shows the totals of every web process and worker.
+    """
+
+    def __init__(self):
+        super(RedisBackend, self).__init__()
+        self.flush_interval = settings.get_metrics_flush_interval()
+        self.flushed_at = timer()
+        self.pid = os.getpid()
+
+    def _check_fork(self):
+        if self.pid != os.getpid():
+            # Work horse forked by a worker, the measurements inherited from the worker are flushed by the worker
+            super(RedisBackend, self).reset()
+            self.pid = os.getpid()
+
+    def observe(self, name, value, tags):
+        self._check_fork()
+        super(RedisBackend, self).observe(name, value, tags)
+        if timer() - self.flushed_at >= self.flush_interval:
+            self.flush()
+
+    def increment(self, name, amount, tags):
+        self._check_fork()
+        super(RedisBackend, self).increment(name, amount, tags)
+        if timer() - self.flushed_at >= self.flush_interval:
+            self.flush()
+
+    def get_connection(self):
+        return get_redis_connection(settings.get_secure_cache_name())
+
+    def flush(self):
+        with self.lock:
+            histograms, counters = self.histograms, self.counters
+            self.histograms, self.counters = defaultdict(Histogram), defaultdict(int)
+            self.flushed_at = timer()
+        if not histograms and not counters:
+            return
+
+        try:
+            pipeline = self.get_connection().pipeline(transaction=False)
+            for (name, tags), histogram in histograms.items():
+                field = 'h|{}|{}|'.format(name, tags)
+                pipeline.hincrby(METRICS_KEY, field + 'count', histogram.count)
+                pipeline.hincrbyfloat(METRICS_KEY, field + 'sum', histogram.total)
+                for bucket, count in histogram.buckets.items():
+                    pipeline.hincrby(METRICS_KEY, field + str(bucket), count)
+            for (name, tags), count in counters.items():
+                pipeline.hincrby(METRICS_KEY, 'c|{}|{}'.format(name, tags), count)
+            pipeline.execute()
+        except RedisError:
+            logger.warning('Could not flush the secure redis metrics', exc_info=True)
+
+    def snapshot(self):
+        self.flush()
+        histograms, counters = defaultdict(Histogram), {}
+        for field, value in self.get_connection().hgetall(METRICS_KEY).items():
+            if isinstance(field, bytes):
+                field = field.decode('utf-8')
+            parts = field.split('|')
+            if parts[0] == 'c':
+                counters[parts[1], parts[2]] = int(value)
+                continue
+            histogram = histograms[parts[1], parts[2]]
+            if parts[3] == 'count':
+                histogram.count = int(value)
+            elif parts[3] == 'sum':
+                histogram.total = float(value)
+            else:
+                histogram.buckets[int(parts[3])] = int(value)
+        return dict(histograms), counters
+
+    def reset(self):
+        super(RedisBackend, self).reset()
+        self.get_connection().delete(METRICS_KEY)
+
+
+_backends = None
+_backends_lock = threading.Lock()
+
+
+def get_backends():
+    """
+    :return: the backends of ``SECURE_REDIS_METRICS_BACKENDS``, built on first use, an empty list when metrics are
+    disabled so the instrumented code only pays for this call
+    """
+    global _backends
+    backends = _backends
+    if backends is None:
+        with _backends_lock:
+            if _backends is None:
+                _backends = [import_string(path)() for path in settings.get_metrics_backends()]
+            backends = _backends
+    return backends
+
+
+def is_enabled():
+    return bool(get_backends())
+
+
+def observe(name, value, **tags):
+    """
+    Add ``value`` to the histogram ``name``, timings are in seconds and sizes in bytes.
+    """
+    backends = get_backends()
+    if backends:
+        tags = format_tags(tags)
+        for backend in backends:
+            backend.observe(name, value, tags)
+
+
+def increment(name, amount=1, **tags):
+    backends = get_backends()
+    if backends:
+        tags = format_tags(tags)
+        for backend in backends:
+            backend.increment(name, amount, tags)
+
+
+def flush():
+    for backend in get_backends():
+        backend.flush()
+
+
+def get_aggregating_backend():
+    """
+    :return: the first backend keeping aggregates, ``None`` if there is none
+    """
+    for backend in get_backends():
+        if isinstance(backend, MemoryBackend):
+            return backend
+
+
+def summarize(histograms, counters):
+    """
+    :return: tuple of the rows of the admin panel for ``histograms`` and ``counters``, timings in milliseconds
+    """
+    histogram_rows = []
+    for (name, tags), histogram in sorted(histograms.items()):
+        scale = 1000 if name.endswith('_seconds') else 1
+        histogram_rows.append({
+            'name': name[:-len('_seconds')] + '_ms' if scale != 1 else name,
+            'tags': tags,
+            'count': histogram.count,
+            'mean': histogram.mean * scale,
+            'quantiles': [histogram.quantile(q) * scale for q in QUANTILES],
+            'total': histogram.total * scale,
+        })
+    counter_rows = [{'name': name, 'tags': tags, 'count': count} for (name, tags), count in sorted(counters.items())]
+    return histogram_rows, counter_rows
+
+
+def timed_view(view):
+    """
+    Record the time taken by an admin view, tagged with the view name.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not get_backends():
+            return view(request, *args, **kwargs)
+        start = timer()
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            observe('view_seconds', timer() - start, view=view.__name__)
+    return wrapper
+
+
+def reset_backends(**kwargs):
+    global _backends
+    if kwargs.get('setting') in (None, 'SECURE_REDIS_METRICS_BACKENDS', 'SECURE_REDIS_METRICS_FLUSH_INTERVAL',
+                                 'CACHES', 'DJANGO_REDIS_SECURE_CACHE_NAME'):
+        with _backends_lock:
+            _backends = None
+
+
+setting_changed.connect(reset_backends)
@@ -0,0 +1,152 @@
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+import logging
+import os
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_TIMEOUT = 60
+RECONNECT_DELAY = 1
+
+# Published instead of a key to drop every entry, keys always carry the cache prefix so they can never be equal to it
+FLUSH_ALL = '*'
+
+_near_caches = {}
+_near_caches_lock = threading.Lock()
+
+
+class NearCache(object):
+    """
+    Process local LRU of decrypted values, bounded by number of entries and total size. Entries are dropped when
+    their Redis time to live runs out, after ``timeout`` seconds at most, or when another process publishes the key on
+    the invalidation channel.
+    """
+
+    def __init__(self, channel, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES,
+                 timeout=DEFAULT_TIMEOUT):
+        self.channel = channel
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.size = 0
+        # Bumped on every invalidation, values read from Redis before a bump may be stale and are not stored
+        self.generation = 0
+        self.listening = False
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def get(self, key):
+        """
+        :return: the cached plain text, or ``None`` on a miss or while invalidations can not be received
+        """
+        if not self.listening:
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            value, expires_at = entry
+            if expires_at < time.time():
+                self._remove(key)
+                return
+            # Mark as most recently used
+            del self._entries[key]
+            self._entries[key] = entry
+            return value
+
+    def set(self, key, value, ttl, generation):
+        """
+        :param ttl: remaining time to live of the key in Redis in milliseconds, as returned by ``PTTL``
+        :param generation: value of ``generation`` before the value was read from Redis
+        """
+        if not self.listening or len(value) > self.max_bytes:
+            return
+        timeout = self.timeout if ttl is None or ttl < 0 else min(self.timeout, ttl / 1000.0)
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._remove(key)
+            self._entries[key] = (value, time.time() + timeout)
+            self.size += len(value)
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, keys):
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+
+    def listen(self, connection):
+        """
+        Start the thread receiving invalidations published by other processes, once per process.
+        """
+        if self._listener is None:
+            with self._lock:
+                if self._listener is None:
+                    self._listener = threading.Thread(target=self._listen, args=(connection, ),
+                                                      name='secure_redis near cache {}'.format(self.channel))
+                    self._listener.daemon = True
+                    self._listener.start()
+
+    def _listen(self, connection):
+        while True:
+            pubsub = connection.pubsub()
+            try:
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    if message['type'] == 'subscribe':
+                        self.listening = True
+                    elif message['type'] == 'message':
+                        key = message['data']
+                        if isinstance(key, bytes):
+                            key = key.decode('utf-8')
+                        if key == FLUSH_ALL:
+                            self.clear()
+                        else:
+                            self.invalidate([key])
+            except Exception:
+                logger.exception('Lost the near cache invalidation channel %s', self.channel)
+            finally:
+                # Invalidations may be missed until subscribed again
+                self.listening = False
+                self.clear()
+                pubsub.close()
+            time.sleep(RECONNECT_DELAY)
+
+
+def get_near_cache(channel, options):
+    """
+    :return: the near cache of this process for ``channel``, shared by all threads
+    """
+    pid = os.getpid()
+    with _near_caches_lock:
+        near_cache, near_cache_pid = _near_caches.get(channel, (None, None))
+        # Listener threads do not survive a fork
+        if near_cache is None or near_cache_pid != pid:
+            near_cache = NearCache(
+                channel,
+                max_entries=options.get('MAX_ENTRIES', DEFAULT_MAX_ENTRIES),
+                max_bytes=options.get('MAX_BYTES', DEFAULT_MAX_BYTES),
+                timeout=options.get('TIMEOUT', DEFAULT_TIMEOUT),
+            )
+            _near_caches[channel] = (near_cache, pid)
+        return near_cache
@@ -0,0 +1,157 @@
+from __future__ import unicode_literals
+
+import threading
+
+from django.core.signals import setting_changed
+
+from rq import get_current_job
+from rq.defaults import DEFAULT_RESULT_TTL
+
+from . import chunks
+from . import settings
+from .serializer import SecureSerializer, default_secure_serializer
+
+
+# Prefix of the chunk keys of the results above ``SECURE_RQ_RESULT_MAX_SIZE``
+CHUNK_PREFIX = 'secure_redis:result:'
+
+
+class EncryptedResult(object):
+    """
+    Result of a secure task stored by RQ in place of the actual value, the serialized value in a secure envelope.
+    """
+
+    def __init__(self, envelope):
+        self.envelope = envelope
+
+    def __repr__(self):
+        return '<EncryptedResult: {} bytes>'.format(len(self.envelope))
+
+
+class ChunkedResult(object):
+    """
+    Result of a secure task larger than ``SECURE_RQ_RESULT_MAX_SIZE``, stored as encrypted chunks next to the job.
+    """
+
+    def __init__(self, value_id, count, size):
+        self.value_id = value_id
+        self.count = count
+        self.size = size
+
+    def __repr__(self):
+        return '<ChunkedResult: {} bytes in {} chunks>'.format(self.size, self.count)
+
+
+class DroppedResult(object):
+    """
+    Marker stored in place of a result larger than ``SECURE_RQ_RESULT_MAX_SIZE``, which was not kept.
+    """
+
+    def __init__(self, size):
+        self.size = size
+
+    def __repr__(self):
+        return '<DroppedResult: {} bytes>'.format(self.size)
+
+
+_serializers = {}
+_serializers_lock = threading.Lock()
+
+
+def get_serializer():
+    """
+    :return: the secure serializer of the default secure cache, compressing with ``SECURE_RQ_RESULT_COMPRESSION``
+    when it is defined
+    """
+    compression = settings.get_result_compression()
+    if not compression:
+        return default_secure_serializer
+    serializer = _serializers.get(compression)
+    if serializer is None:
+        with _serializers_lock:
+            serializer = _serializers.get(compression)
+            if serializer is None:
+                options = dict(default_secure_serializer.options, SECURE_COMPRESSION=compression)
+                serializer = _serializers[compression] = SecureSerializer(options)
+    return serializer
+
+
+def _get_ttl(job):
+    """
+    :return: time to live of the result of ``job`` in milliseconds, ``None`` when it never expires
+    """
+    ttl = DEFAULT_RESULT_TTL if job.result_ttl is None else job.result_ttl
+    if ttl < 0:
+        return None
+    return int(ttl * 1000)
+
+
+def _store_chunks(serializer, plaintext, job):
+    options = serializer.options
+    chunk_size = options.get('SECURE_CHUNK_SIZE') or chunks.DEFAULT_CHUNK_SIZE
+    batch = options.get('SECURE_CHUNK_BATCH', chunks.DEFAULT_CHUNK_BATCH)
+    px = _get_ttl(job)
+    pipeline = job.connection.pipeline(transaction=False)
+
+    def store(value_id, index, chunk):
+        pipeline.set(chunks.get_chunk_key(CHUNK_PREFIX, value_id, index), chunk, px=px)
+        if len(pipeline) >= batch:
+            pipeline.execute()
+
+    writer = chunks.ChunkWriter(serializer, chunk_size, store)
+    plaintext = memoryview(plaintext)
+    for i in range(0, len(plaintext), chunk_size):
+        writer.write(plaintext[i:i + chunk_size])
+    writer.finish(inline=False)
+    pipeline.execute()
+    return ChunkedResult(writer.value_id, writer.count, len(plaintext))
+
+
+def wrap(value):
+    """
+    Encrypt the value returned by a secure task when ``SECURE_RQ_ENCRYPT_RESULTS`` is enabled. Values whose serialized
+    size is above ``SECURE_RQ_RESULT_MAX_SIZE`` are replaced by a ``DroppedResult`` marker, or stored as chunks
+    expiring with the result when ``SECURE_RQ_RESULT_OVERFLOW`` is ``chunk``.
+    :return: what RQ stores as the result of the job
+    """
+    if value is None or not settings.get_encrypt_results():
+        return value
+
+    serializer = get_serializer()
+    plaintext = serializer.serialize(value, pickled=True)
+    max_size = settings.get_result_max_size()
+    if max_size is None or len(plaintext) <= max_size:
+        return EncryptedResult(serializer.encrypt(plaintext))
+
+    job = get_current_job()
+    if settings.get_result_overflow() == 'drop' or job is None or job.result_ttl == 0:
+        return DroppedResult(len(plaintext))
+    return _store_chunks(serializer, plaintext, job)
+
+
+def get_result(job):
+    """
+    Decrypt the result of a secure job, only when it is asked for.
+    :return: the value returned by the task, the ``DroppedResult`` marker of a result too large to be kept, or the
+    result of a job whose result is not encrypted as is
+    :raise ChunkMissing: when the chunks of a result expired before the job
+    """
+    result = job.result
+    serializer = get_serializer()
+    if isinstance(result, EncryptedResult):
+        return serializer.loads(result.envelope)
+    if isinstance(result, ChunkedResult):
+        chunk_size = serializer.options.get('SECURE_CHUNK_SIZE') or chunks.DEFAULT_CHUNK_SIZE
+        batch = serializer.options.get('SECURE_CHUNK_BATCH', chunks.DEFAULT_CHUNK_BATCH)
+        return chunks.load(serializer, CHUNK_PREFIX, result.value_id, result.count,
+                           lambda keys: job.connection.mget(keys), chunk_size=chunk_size, batch=batch)
+    return result
+
+
+def reset_serializers(**kwargs):
+    if kwargs.get('setting') in (None, 'CACHES', 'DJANGO_REDIS_SECURE_CACHE_NAME', 'SECURE_RQ_RESULT_COMPRESSION'):
+        with _serializers_lock:
+            _serializers.clear()
+
+
+setting_changed.connect(reset_serializers)
@@ -0,0 +1,140 @@
+from __future__ import unicode_literals
+
+from collections import defaultdict
+import datetime
+import json
+import logging
+
+from django.conf import settings as global_settings
+
+import django_rq
+
+from . import tasks
+
+
+logger = logging.getLogger(__name__)
+
+# Redis hash of task name to the scheduled job id, interval and timeout of the periodic job of the task
+SCHEDULES_KEY = 'secure_redis:schedules'
+LOCK_KEY = 'secure_redis:schedules:lock:{}'
+LOCK_TIMEOUT = 30
+DEFAULT_TIMEOUT = 360
+
+# Periodic jobs scheduled by older versions, which are not in the schedules hash, by task name
+_legacy_jobs = {}
+
+
+def get_default_timeout():
+    return global_settings.RQ_QUEUES.get('DEFAULT_TIMEOUT') or DEFAULT_TIMEOUT
+
+
+def _get_legacy_job_ids(scheduler, name):
+    """
+    :return: ids of the jobs of ``name`` scheduled without ``schedule_once`` recording them, the scheduled jobs are
+    listed once per process and only when a task is missing from the schedules hash
+    """
+    key = id(scheduler.connection.connection_pool)
+    if key not in _legacy_jobs:
+        job_ids = defaultdict(list)
+        for job in scheduler.get_jobs():
+            job_ids[job.func_name].append(job.id)
+        _legacy_jobs[key] = job_ids
+    return _legacy_jobs[key].pop(name, [])
+
+
+def _schedule(scheduler, func, name, interval, timeout, job_ids):
+    """
+    Cancel the jobs ``job_ids`` and schedule ``func`` every ``interval`` seconds, starting now.
+    """
+    logger.info('Rescheduling job {} with interval: {}s'.format(name, interval))
+    for job_id in job_ids:
+        scheduler.cancel(job_id)
+    job = scheduler.schedule(datetime.datetime.now(), func, interval=interval, timeout=timeout)
+    scheduler.connection.hset(SCHEDULES_KEY, name, json.dumps({
+        'job_id': job.id,
+        'interval': interval,
+        'timeout': timeout,
+    }))
+    return job
+
+
+def _is_scheduled(entry, interval, timeout, score):
+    return entry is not None and score is not None and \
+        entry['interval'] == interval and entry['timeout'] == timeout
+
+
+def _load(entry):
+    if entry is None:
+        return
+    if isinstance(entry, bytes):
+        entry = entry.decode('utf-8')
+    return json.loads(entry)
+
+
+def schedule_once(func, interval, timeout=None, scheduler_name='default'):
+    """
+    Schedule ``func`` every ``interval`` seconds, unless it is already scheduled with the same interval and timeout.
+    The periodic job of each task is recorded in the ``SCHEDULES_KEY`` hash, so the check costs a single round trip.
+    :return: the new job, ``None`` if ``func`` was already scheduled
+    """
+    if not timeout:
+        timeout = get_default_timeout()
+    scheduler = django_rq.get_scheduler(scheduler_name)
+    connection = scheduler.connection
+    name = tasks.get_task_name(func)
+
+    with connection.lock(LOCK_KEY.format(name), timeout=LOCK_TIMEOUT):
+        entry = _load(connection.hget(SCHEDULES_KEY, name))
+        score = None
+        if entry is not None:
+            score = connection.zscore(scheduler.scheduled_jobs_key, entry['job_id'])
+        if _is_scheduled(entry, interval, timeout, score):
+            logger.info('Job already scheduled every {}s: {}'.format(interval, name))
+            return
+
+        job_ids = [entry['job_id']] if entry is not None else _get_legacy_job_ids(scheduler, name)
+        return _schedule(scheduler, func, name, interval, timeout, job_ids)
+
+
+def reconcile_schedules(schedules, scheduler_name='default', prune=False):
+    """
+    Make the periodic jobs match ``schedules`` in one pass: the recorded schedules and whether their jobs are still
+    scheduled are read with a single pipeline, then only the tasks whose interval or timeout changed are scheduled
+    again.
+    :param schedules: iterable of ``(func, interval)`` or ``(func, interval, timeout)`` tuples
+    :param prune: also cancel the periodic jobs recorded by ``schedule_once`` for tasks missing from ``schedules``
+    :return: tuple of the names of the tasks scheduled again and of the tasks cancelled
+    """
+    scheduler = django_rq.get_scheduler(scheduler_name)
+    connection = scheduler.connection
+    desired = {}
+    for schedule in schedules:
+        func, interval = schedule[:2]
+        timeout = (schedule[2] if len(schedule) > 2 else None) or get_default_timeout()
+        desired[tasks.get_task_name(func)] = (func, interval, timeout)
+
+    entries = dict((name.decode('utf-8') if isinstance(name, bytes) else name, _load(entry))
+                   for name, entry in connection.hgetall(SCHEDULES_KEY).items())
+    names = list(entries)
+    pipeline = connection.pipeline(transaction=False)
+    for name in names:
+        pipeline.zscore(scheduler.scheduled_jobs_key, entries[name]['job_id'])
+    scores = dict(zip(names, pipeline.execute()))
+
+    scheduled = []
+    for name, (func, interval, timeout) in desired.items():
+        entry = entries.get(name)
+        if _is_scheduled(entry, interval, timeout, scores.get(name)):
+            continue
+        job_ids = [entry['job_id']] if entry is not None else _get_legacy_job_ids(scheduler, name)
+        _schedule(scheduler, func, name, interval, timeout, job_ids)
+        scheduled.append(name)
+
+    cancelled = []
+    if prune:
+        for name in names:
+            if name not in desired:
+                scheduler.cancel(entries[name]['job_id'])
+                connection.hdel(SCHEDULES_KEY, name)
+                cancelled.append(name)
+    return scheduled, cancelled
@@ -1,40 +1,127 @@
 from __future__ import (division, unicode_literals)
 from functools import wraps
-from collections import defaultdict
 import logging
-import datetime
-
-from django.conf import settings as global_settings
+import uuid
 
+from cryptography.fernet import InvalidToken
 import django_rq
 from django_rq.queues import get_queue
+import redis
 import rq.utils
+from rq import get_current_job
 from rq.compat import string_types
 from rq.defaults import DEFAULT_RESULT_TTL
+from rq.job import Job, JobStatus
 from rq.queue import Queue
+from rq.worker import Worker
+from rq_scheduler.utils import to_unix
 
+from . import metrics
+from . import results
+from . import schedules
+from . import task_index
+from . import tasks
 from .serializer import default_secure_serializer as secure_serializer
 
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_CHUNK_SIZE = 1000
+
 
 def execute(method_name, *args, **kwargs):
-    return rq.utils.import_attribute(method_name)(*args, **kwargs)
+    return tasks.resolve(method_name)(*args, **kwargs)
+
+
+def encrypt_job_args(function_name, args, kwargs):
+    """
+    :return: the arguments of ``secure_job_proxy``, a single envelope holding the method name, args and kwargs,
+    always pickled so the task gets arguments of the same types
+    """
+    return [secure_serializer.dumps((function_name, args, kwargs), pickled=True)]
+
+
+def decrypt_job_args(args):
+    """
+    :param args: arguments given to ``secure_job_proxy``
+    :return: tuple of the actual method name, args and kwargs
+    """
+    if len(args) == 1:
+        return secure_serializer.loads(args[0])
+    # Jobs enqueued before the payload was packed in a single envelope
+    return tuple(secure_serializer.loads(arg) for arg in args[:3])
+
+
+def _chunks(iterable, chunk_size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _zadd(pipeline, name, score, value):
+    if redis.VERSION[0] >= 3:
+        pipeline.zadd(name, {value: score})
+    else:
+        pipeline.zadd(name, score, value)
 
 
 def secure_job_proxy(*args, **kwargs):
     """
-    The is a proxy method, each method wanted to be stored securely, it will be directed to this method. With first
-    argument is the encrypted original method name.
-    :param args: Always three parameters, first is the encrypted method name, second is the encrypted actual args,
-    third is the encrypted actual kwargs
-    :return: actual method return value
+    The is a proxy method, each method wanted to be stored securely, it will be directed to this method.
+    :param args: A single encrypted tuple of the original method name, the actual args and the actual kwargs. Jobs
+    enqueued by older versions have three parameters instead: the encrypted method name, the encrypted actual args and
+    the encrypted actual kwargs
+    :param kwargs: ``task_fingerprint`` only, used to display the method name in the admin
+    :return: actual method return value, wrapped by ``results.wrap`` when ``SECURE_RQ_ENCRYPT_RESULTS`` is enabled
+    """
+    try:
+        if not metrics.get_backends():
+            actual_function_name, decrypted_args, kwargs = decrypt_job_args(args)
+            return results.wrap(execute(actual_function_name, *decrypted_args, **kwargs))
+        return _execute_measured(args, kwargs)
+    finally:
+        if task_index.is_enabled():
+            current_job = get_current_job()
+            if current_job is not None:
+                task_index.remove_jobs([current_job], current_job.connection)
+
+
+def _execute_measured(args, kwargs):
+    """
+    Run a secure job recording the time spent decrypting it and running it by task, payloads which can not be
+    decrypted are counted by task fingerprint since their name can not be decrypted either.
     """
-    actual_function_name = secure_serializer.loads(args[0])
-    decrypted_args = secure_serializer.loads(args[1])
-    kwargs = secure_serializer.loads(args[2])
-    return execute(actual_function_name, *decrypted_args, **kwargs)
+    start = metrics.timer()
+    try:
+        actual_function_name, decrypted_args, decrypted_kwargs = decrypt_job_args(args)
+    except InvalidToken:
+        metrics.increment('job_invalid_tokens', task=kwargs.get(tasks.FINGERPRINT_KWARG))
+        metrics.flush()
+        raise
+    decrypted = metrics.timer()
+    try:
+        return results.wrap(execute(actual_function_name, *decrypted_args, **decrypted_kwargs))
+    finally:
+        metrics.observe('job_decrypt_seconds', decrypted - start, task=actual_function_name)
+        metrics.observe('job_seconds', metrics.timer() - decrypted, task=actual_function_name)
+        # Work horses exit right after the job
+        metrics.flush()
+
+
+class SecureWorker(Worker):
+    """
+    RQ worker importing the ``SECURE_RQ_TASK_MODULES`` before taking jobs, so the work horses it forks find every task
+    already registered. Use it with ``python manage.py rqworker --worker-class secure_redis.secure_rq.SecureWorker``.
+    """
+
+    def work(self, *args, **kwargs):
+        tasks.preload()
+        return super(SecureWorker, self).work(*args, **kwargs)
 
 
 def job(func_or_queue, connection=None, *args, **kwargs):
@@ -59,72 +146,135 @@ def job(func_or_queue, connection=None, *args, **kwargs):
 
             ``schedule_once`` method, schedule job once or reschedule when interval changes, if job already exists,
             this will not do anything.
+
+            ``delay_many`` and ``enqueue_at_many`` methods, the bulk versions of ``delay`` and ``enqueue_at``, which
+            encrypt the jobs in batches and write each chunk of jobs in a single pipeline.
             """
             self.queue = queue
             self.connection = connection
             self.timeout = timeout
             self.result_ttl = result_ttl
             self.ttl = ttl
+            self._queue = None
+            self._schedulers = {}
+
+        def get_queue(self):
+            if self._queue is None:
+                if isinstance(self.queue, string_types):
+                    self._queue = Queue(name=self.queue, connection=self.connection)
+                else:
+                    self._queue = self.queue
+            return self._queue
+
+        def get_scheduler(self, scheduler_name):
+            scheduler = self._schedulers.get(scheduler_name)
+            if scheduler is None:
+                scheduler = self._schedulers[scheduler_name] = django_rq.get_scheduler(scheduler_name)
+            return scheduler
 
         def __call__(self, f):
+            function_name = tasks.register(f)
+
             @wraps(f)
             def delay(*args, **kwargs):
-                if isinstance(self.queue, string_types):
-                    queue = Queue(name=self.queue, connection=self.connection)
-                else:
-                    queue = self.queue
+                queue = self.get_queue()
                 depends_on = kwargs.pop('depends_on', None)
-                function_name = '{}.{}'.format(f.__module__, f.__name__)
-                encrypted_args = [secure_serializer.dumps(function_name)]
-                encrypted_args += [secure_serializer.dumps(args)]
-
-                encrypted_args += [secure_serializer.dumps(kwargs)]
-                return queue.enqueue_call(secure_job_proxy, args=encrypted_args, kwargs={},
+                encrypted_args = encrypt_job_args(function_name, args, kwargs)
+                fingerprint = tasks.publish_name(function_name, queue.connection)
+                job_id = None
+                if task_index.is_enabled():
+                    # Indexed first, synchronous queues run the job before enqueue_call returns
+                    job_id = str(uuid.uuid4())
+                    task_index.add_jobs(queue, fingerprint, [job_id])
+                return queue.enqueue_call(secure_job_proxy, args=encrypted_args,
+                                          kwargs={tasks.FINGERPRINT_KWARG: fingerprint},
                                           timeout=self.timeout, result_ttl=self.result_ttl,
-                                          ttl=self.ttl, depends_on=depends_on)
+                                          ttl=self.ttl, depends_on=depends_on, job_id=job_id)
 
             @wraps(f)
             def enqueue_at(target_date, scheduler_name='default', *args, **kwargs):
-                function_name = '{0}.{1}'.format(f.__module__, f.__name__)
-                encrypted_args = [secure_serializer.dumps(function_name)]
-                encrypted_args += [secure_serializer.dumps(args)]
+                encrypted_args = encrypt_job_args(function_name, args, kwargs)
+
+                scheduler = self.get_scheduler(scheduler_name)
+                fingerprint = tasks.publish_name(function_name, scheduler.connection)
+                proxy_method_name = '{}.{}'.format(secure_job_proxy.__module__, secure_job_proxy.__name__)
+                return scheduler.enqueue_at(target_date, proxy_method_name, *encrypted_args,
+                                            **{tasks.FINGERPRINT_KWARG: fingerprint})
+
+            def delay_many(calls, chunk_size=DEFAULT_CHUNK_SIZE):
+                """
+                Enqueue a job for each call
+                :param calls: iterable of ``(args, kwargs)`` tuples
+                :param chunk_size: number of jobs encrypted together and written in a single pipeline
+                :return: list of the created job ids
+                """
+                queue = self.get_queue()
+                if not getattr(queue, 'is_async', getattr(queue, '_async', True)):
+                    # Synchronous queues run each job as it is enqueued
+                    return [delay(*args, **kwargs).id for args, kwargs in calls]
 
-                encrypted_args += [secure_serializer.dumps(kwargs)]
+                job_class = getattr(queue, 'job_class', Job)
+                timeout = self.timeout or getattr(queue, '_default_timeout', None)
+                job_ids = []
+                for chunk in _chunks(calls, chunk_size):
+                    payloads = secure_serializer.dumps_many(
+                        ((function_name, args, kwargs) for args, kwargs in chunk), pickled=True)
+                    pipeline = queue.connection.pipeline()
+                    pipeline.sadd(queue.redis_queues_keys, queue.key)
+                    fingerprint = tasks.publish_name(function_name, queue.connection, pipeline=pipeline)
+                    chunk_job_ids = []
+                    for payload in payloads:
+                        job = job_class.create(secure_job_proxy, args=[payload],
+                                               kwargs={tasks.FINGERPRINT_KWARG: fingerprint},
+                                               connection=queue.connection, result_ttl=self.result_ttl,
+                                               ttl=self.ttl, status=JobStatus.QUEUED, timeout=timeout,
+                                               origin=queue.name)
+                        job.enqueued_at = rq.utils.utcnow()
+                        job.save(pipeline=pipeline)
+                        queue.push_job_id(job.id, pipeline=pipeline)
+                        chunk_job_ids.append(job.id)
+                    if task_index.is_enabled():
+                        task_index.add_jobs(queue, fingerprint, chunk_job_ids, pipeline=pipeline)
+                    pipeline.execute()
+                    job_ids.extend(chunk_job_ids)
+                return job_ids
 
-                scheduler = django_rq.get_scheduler(scheduler_name)
+            def enqueue_at_many(calls, scheduler_name='default', chunk_size=DEFAULT_CHUNK_SIZE):
+                """
+                Schedule a job for each call
+                :param calls: iterable of ``(target_date, args, kwargs)`` tuples
+                :param chunk_size: number of jobs encrypted together and written in a single pipeline
+                :return: list of the created job ids
+                """
+                scheduler = self.get_scheduler(scheduler_name)
                 proxy_method_name = '{}.{}'.format(secure_job_proxy.__module__, secure_job_proxy.__name__)
-                return scheduler.enqueue_at(target_date, proxy_method_name, *encrypted_args, **{})
+                job_ids = []
+                for chunk in _chunks(calls, chunk_size):
+                    payloads = secure_serializer.dumps_many(
+                        ((function_name, args, kwargs) for _, args, kwargs in chunk), pickled=True)
+                    pipeline = scheduler.connection.pipeline()
+                    fingerprint = tasks.publish_name(function_name, scheduler.connection, pipeline=pipeline)
+                    for (target_date, _, _), payload in zip(chunk, payloads):
+                        job = scheduler._create_job(proxy_method_name, args=[payload],
+                                                    kwargs={tasks.FINGERPRINT_KWARG: fingerprint}, commit=False)
+                        job.save(pipeline=pipeline)
+                        _zadd(pipeline, scheduler.scheduled_jobs_key, to_unix(target_date), job.id)
+                        job_ids.append(job.id)
+                    pipeline.execute()
+                return job_ids
 
             @wraps(f)
             def schedule_once(interval, timeout=None):
                 """
                 Schedule job once or reschedule when interval changes
                 """
-                rq_scheduler = django_rq.get_scheduler('default')
-                jobs = rq_scheduler.get_jobs()
-
-                functions = defaultdict(lambda: list())
-                map(lambda x: functions[x.func].extend([x.meta.get('interval'), x.timeout,]), jobs)
-
-                if not timeout:
-                    default_timeout = global_settings.RQ_QUEUES.get('DEFAULT_TIMEOUT')
-                    if default_timeout:
-                        timeout = default_timeout
-                    else:
-                        timeout = 360
-
-                if f not in functions or interval not in functions[f] or functions[f][1] != timeout or len(functions[f]) > 2:
-                    logger.info('Rescheduling job {} with interval: {}s'.format(f.func_name, interval))
-                    # clear all scheduled jobs for this function
-                    map(rq_scheduler.cancel, filter(lambda x: x.func==f, jobs))
-
-                    # schedule with new interval and timeout
-                    return rq_scheduler.schedule(datetime.datetime.now(), f, interval=interval, timeout=timeout)
-                else:
-                    logger.info('Job already scheduled every {}s: {}'.format(interval, f.func_name))
+                return schedules.schedule_once(f, interval, timeout=timeout)
+
             f.enqueue_at = enqueue_at
             f.delay = delay
             f.schedule_once = schedule_once
+            f.delay_many = delay_many
+            f.enqueue_at_many = enqueue_at_many
             return f
 
     def job(func_or_queue, connection=None, *args, **kwargs):
@@ -1,26 +1,535 @@
-from __future__ import unicode_literals
+from __future__ import division, unicode_literals
 
-from cryptography.fernet import Fernet
+import base64
+import bz2
+import functools
+import hashlib
+import hmac
+import json
+import os
+import pickle
+import struct
+import threading
+import zlib
+
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.signals import setting_changed
+from django.utils import six
+from django.utils.functional import SimpleLazyObject, empty
 
 import django_redis.serializers.pickle
 
+from . import metrics
 from . import settings
 
+try:
+    from concurrent import futures
+except ImportError:
+    # python 2 without the ``futures`` backport
+    futures = None
+
+try:
+    import lzma
+except ImportError:
+    # python 2
+    lzma = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+except ImportError:
+    # cryptography < 2.0
+    AESGCM = ChaCha20Poly1305 = None
+
+
+DEFAULT_PARALLEL_THRESHOLD = 256
+DEFAULT_PARALLEL_CHUNK_SIZE = 64
+DEFAULT_COMPRESSION_THRESHOLD = 1024
+
+# The first byte of a framed payload records the codec in its low bits and the inner serializer in the high ones,
+# none of these values can start a pickle so values written before framing was introduced are read as plain pickles
+CODEC_NONE = 0x01
+CODEC_ZLIB = 0x02
+CODEC_BZ2 = 0x03
+CODEC_LZMA = 0x04
+CODEC_MASK = 0x07
+HEADER_MASK = 0x1f
+INNER_SERIALIZER_SHIFT = 3
+
+INNER_PICKLE = 0
+INNER_JSON = 1
+INNER_MSGPACK = 2
+INNER_PICKLE5 = 3
+
+INNER_SERIALIZERS = {
+    'pickle': INNER_PICKLE,
+    'json': INNER_JSON,
+    'msgpack': INNER_MSGPACK,
+    'pickle5': INNER_PICKLE5,
+}
+
+CODECS = {
+    'zlib': CODEC_ZLIB,
+    'bz2': CODEC_BZ2,
+    'lzma': CODEC_LZMA,
+}
+
+# The first byte of a binary envelope records its format, fernet tokens are base64 and always start with "g".
+# Envelopes flagged with KEY_ID_FLAG carry the id of their key right after the format byte.
+FORMAT_AES_GCM = 0x01
+FORMAT_CHACHA20_POLY1305 = 0x02
+FORMAT_FERNET = 0x03
+FORMAT_MASK = 0x0f
+KEY_ID_FLAG = 0x10
+KEY_ID_SIZE = 4
+NONCE_SIZE = 12
+
+CIPHERS = {
+    'fernet': FORMAT_FERNET,
+    'aes-gcm': FORMAT_AES_GCM,
+    'chacha20-poly1305': FORMAT_CHACHA20_POLY1305,
+}
+
+
+def compress(codec, data, level=None):
+    if codec == CODEC_ZLIB:
+        return zlib.compress(data, 6 if level is None else level)
+    if codec == CODEC_BZ2:
+        return bz2.compress(data, 9 if level is None else level)
+    if codec == CODEC_LZMA:
+        return lzma.compress(data, preset=level)
+    raise ValueError('Unknown compression codec: {}'.format(codec))
+
+
+def decompress(codec, data):
+    if codec == CODEC_NONE:
+        return data
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(data)
+    if codec == CODEC_BZ2:
+        return bz2.decompress(data)
+    if codec == CODEC_LZMA:
+        if lzma is None:
+            raise ImproperlyConfigured('lzma compressed values can not be read on this python version')
+        return lzma.decompress(data)
+    raise ValueError('Unknown compression codec: {}'.format(codec))
+
+
+def pickle5_dumps(value):
+    """
+    Pickle with protocol 5, the buffers of objects pickled as ``pickle.PickleBuffer``, like numpy arrays, are written
+    out of band after a table of their sizes instead of being pickled. ``bytes`` and ``bytearray`` are still pickled
+    in band.
+    """
+    buffers = []
+    data = pickle.dumps(value, protocol=5, buffer_callback=buffers.append)
+    raws = [buffer.raw() for buffer in buffers]
+    header = struct.pack('>I{}Q'.format(len(raws)), len(raws), *[raw.nbytes for raw in raws])
+    return b''.join([header] + raws + [data])
+
+
+def pickle5_loads(data):
+    data = memoryview(data)
+    count = struct.unpack_from('>I', data)[0]
+    sizes = struct.unpack_from('>{}Q'.format(count), data, 4)
+    offset = 4 + 8 * count
+    buffers = []
+    for size in sizes:
+        buffers.append(data[offset:offset + size])
+        offset += size
+    return pickle.loads(data[offset:], buffers=buffers)
+
+
+def derive_key(secret_key, info):
+    """
+    Derive a 256 bits key from a fernet secret key, so the binary envelopes and key ids never reuse the fernet key
+    material itself.
+    """
+    hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=info, backend=default_backend())
+    return hkdf.derive(base64.urlsafe_b64decode(secret_key))
+
+
+class SecretKey(object):
+    """
+    One key of the ``REDIS_SECRET_KEYS`` ring, with the ciphers of every envelope format derived from it.
+    """
+
+    def __init__(self, secret_key):
+        key = secret_key.encode('utf-8') if isinstance(secret_key, six.text_type) else secret_key
+        self.fernet = Fernet(key)
+        self.key_id = derive_key(key, b'secure_redis key id')[:KEY_ID_SIZE]
+        self.fingerprint_key = derive_key(key, b'secure_redis fingerprint')
+        self.aeads = {}
+        if AESGCM is not None:
+            self.aeads[FORMAT_AES_GCM] = AESGCM(derive_key(key, b'secure_redis aes-gcm'))
+            self.aeads[FORMAT_CHACHA20_POLY1305] = ChaCha20Poly1305(
+                derive_key(key, b'secure_redis chacha20-poly1305'))
+
+    def encrypt(self, format_tag, header, data):
+        if format_tag == FORMAT_FERNET:
+            return header + self.fernet.encrypt(data)
+        nonce = os.urandom(NONCE_SIZE)
+        return header + nonce + self.aeads[format_tag].encrypt(nonce, data, header)
+
+    def decrypt(self, format_tag, header, body):
+        """
+        :param header: format byte and key id, authenticated as associated data by the binary envelope
+        :param body: the envelope without its header
+        """
+        if format_tag == FORMAT_FERNET:
+            return self.fernet.decrypt(body)
+        try:
+            return self.aeads[format_tag].decrypt(body[:NONCE_SIZE], body[NONCE_SIZE:], header)
+        except (InvalidTag, KeyError):
+            raise InvalidToken
+
+
+_secret_keys = {}
+_secret_keys_lock = threading.Lock()
+
+_serializers = {}
+_serializers_lock = threading.Lock()
+
+
+def get_secret_key(secret_key):
+    """
+    :return: the ``SecretKey`` for ``secret_key``, derived once per process since django builds a serializer for
+    every cache in every thread
+    """
+    key = _secret_keys.get(secret_key)
+    if key is None:
+        with _secret_keys_lock:
+            key = _secret_keys.get(secret_key)
+            if key is None:
+                key = _secret_keys[secret_key] = SecretKey(secret_key)
+    return key
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+# Serializers built inside process pool workers, keyed by their options
+_process_serializers = {}
+
+
+def get_executor(kind, max_workers=None):
+    """
+    Return a pool shared by every serializer configured with the same ``kind`` and ``max_workers``, django caches
+    are built once per thread so pools can not live on the serializer instance itself.
+    """
+    if futures is None:
+        raise ImproperlyConfigured(
+            'SECURE_PARALLEL_EXECUTOR requires concurrent.futures, install the "futures" package on python 2')
+    if kind == 'thread':
+        executor_class = futures.ThreadPoolExecutor
+    elif kind == 'process':
+        executor_class = futures.ProcessPoolExecutor
+    else:
+        raise ImproperlyConfigured(
+            'SECURE_PARALLEL_EXECUTOR must be either "thread" or "process", got {!r}'.format(kind))
+
+    with _executors_lock:
+        executor = _executors.get((kind, max_workers))
+        if executor is None:
+            executor = executor_class(max_workers=max_workers or 4)
+            _executors[(kind, max_workers)] = executor
+        return executor
+
+
+def _get_process_serializer(options):
+    key = repr(sorted(options.items()))
+    serializer = _process_serializers.get(key)
+    if serializer is None:
+        serializer = _process_serializers[key] = SecureSerializer(options)
+    return serializer
+
+
+def _dumps_chunk(options, values, pickled=False):
+    serializer = _get_process_serializer(options)
+    return [serializer.dumps(value, pickled=pickled) for value in values]
+
+
+def _decrypt_chunk(options, values):
+    serializer = _get_process_serializer(options)
+    return [serializer.decrypt(value) for value in values]
+
 
 class SecureSerializer(django_redis.serializers.pickle.PickleSerializer):
     def __init__(self, options):
         super(SecureSerializer, self).__init__(options)
-        param_key = options.get("REDIS_SECRET_KEY")
-        key = param_key.encode("utf-8")
-        self.crypter = Fernet(key)
+        self.options = options
+        # The first key of the ring encrypts, all of them decrypt
+        self.key_ring = bool(options.get('REDIS_SECRET_KEYS'))
+        self.keys = [get_secret_key(key)
+                     for key in options.get('REDIS_SECRET_KEYS') or [options.get('REDIS_SECRET_KEY')]]
+        self.primary_key = self.keys[0]
+        self.keys_by_id = dict((key.key_id, key) for key in reversed(self.keys))
+        self.crypter = self.primary_key.fernet
+
+        cipher = options.get('SECURE_CIPHER', 'fernet')
+        if cipher not in CIPHERS:
+            raise ImproperlyConfigured(
+                'SECURE_CIPHER must be one of {}, got {!r}'.format(', '.join(sorted(CIPHERS)), cipher))
+        if cipher != 'fernet' and AESGCM is None:
+            raise ImproperlyConfigured('SECURE_CIPHER {!r} requires cryptography>=2.0'.format(cipher))
+        self.format = CIPHERS[cipher]
+
+        self.parallel_executor = options.get('SECURE_PARALLEL_EXECUTOR')
+        self.parallel_workers = options.get('SECURE_PARALLEL_WORKERS')
+        self.parallel_threshold = options.get('SECURE_PARALLEL_THRESHOLD', DEFAULT_PARALLEL_THRESHOLD)
+        self.parallel_chunk_size = options.get('SECURE_PARALLEL_CHUNK_SIZE', DEFAULT_PARALLEL_CHUNK_SIZE)
+
+        compression = options.get('SECURE_COMPRESSION')
+        if compression and compression not in CODECS:
+            raise ImproperlyConfigured(
+                'SECURE_COMPRESSION must be one of {}, got {!r}'.format(', '.join(sorted(CODECS)), compression))
+        if compression == 'lzma' and lzma is None:
+            raise ImproperlyConfigured('SECURE_COMPRESSION "lzma" requires python 3')
+        self.compression = CODECS.get(compression)
+        self.compression_level = options.get('SECURE_COMPRESSION_LEVEL')
+        self.compression_threshold = options.get('SECURE_COMPRESSION_THRESHOLD', DEFAULT_COMPRESSION_THRESHOLD)
+
+        inner_serializer = options.get('SECURE_INNER_SERIALIZER', 'pickle')
+        if inner_serializer not in INNER_SERIALIZERS:
+            raise ImproperlyConfigured('SECURE_INNER_SERIALIZER must be one of {}, got {!r}'.format(
+                ', '.join(sorted(INNER_SERIALIZERS)), inner_serializer))
+        if inner_serializer == 'msgpack' and msgpack is None:
+            raise ImproperlyConfigured('SECURE_INNER_SERIALIZER "msgpack" requires the msgpack package')
+        if inner_serializer == 'pickle5' and pickle.HIGHEST_PROTOCOL < 5:
+            raise ImproperlyConfigured('SECURE_INNER_SERIALIZER "pickle5" requires python 3.8')
+        self.inner_serializer = INNER_SERIALIZERS[inner_serializer]
+        self._alias = None
 
-    def dumps(self, value):
-        val = super(SecureSerializer, self).dumps(value)
-        return self.crypter.encrypt(val)
+    @property
+    def alias(self):
+        """
+        Alias of the cache using this serializer, which tags its metrics.
+        """
+        if self._alias is None:
+            self._alias = settings.get_cache_alias(self.options) or 'unknown'
+        return self._alias
+
+    def dumps(self, value, pickled=False):
+        """
+        :param pickled: pickle the value whatever ``SECURE_INNER_SERIALIZER`` is, see ``serialize``
+        """
+        if not metrics.get_backends():
+            return self.encrypt(self.serialize(value, pickled=pickled))
+        start = metrics.timer()
+        value = self.encrypt(self.serialize(value, pickled=pickled))
+        metrics.observe('dumps_seconds', metrics.timer() - start, cache=self.alias)
+        return value
 
     def loads(self, value):
-        val = self.crypter.decrypt(value)
-        return super(SecureSerializer, self).loads(val)
+        if not metrics.get_backends():
+            return self.deserialize(self.decrypt(value))
+        start = metrics.timer()
+        value = self.deserialize(self.decrypt(value))
+        metrics.observe('loads_seconds', metrics.timer() - start, cache=self.alias)
+        return value
+
+    def encrypt(self, value):
+        if not metrics.get_backends():
+            return self._encrypt(value)
+        start = metrics.timer()
+        envelope = self._encrypt(value)
+        metrics.observe('encrypt_seconds', metrics.timer() - start, cache=self.alias)
+        metrics.observe('plaintext_bytes', len(value), cache=self.alias)
+        metrics.observe('ciphertext_bytes', len(envelope), cache=self.alias)
+        return envelope
+
+    def decrypt(self, value):
+        if not metrics.get_backends():
+            return self._decrypt(value)
+        start = metrics.timer()
+        try:
+            plaintext = self._decrypt(value)
+        except InvalidToken:
+            metrics.increment('invalid_tokens', cache=self.alias)
+            raise
+        metrics.observe('decrypt_seconds', metrics.timer() - start, cache=self.alias)
+        return plaintext
+
+    def _encrypt(self, value):
+        if self.format == FORMAT_FERNET and not self.key_ring:
+            # Plain fernet token, readable by every version of this library
+            return self.crypter.encrypt(value)
+        header = six.int2byte(self.format | KEY_ID_FLAG) + self.primary_key.key_id
+        return self.primary_key.encrypt(self.format, header, value)
+
+    def _decrypt(self, value):
+        format_tag = six.indexbytes(value, 0) if value else None
+        if format_tag is not None and format_tag & KEY_ID_FLAG:
+            header_size = 1 + KEY_ID_SIZE
+            key = self.keys_by_id.get(bytes(value[1:header_size]))
+            if key is None:
+                raise InvalidToken
+            return key.decrypt(format_tag & FORMAT_MASK, value[:header_size], value[header_size:])
+
+        # Envelopes written without a key id, try every key starting with the primary one
+        if format_tag in (FORMAT_AES_GCM, FORMAT_CHACHA20_POLY1305):
+            header, body = value[:1], value[1:]
+        else:
+            format_tag, header, body = FORMAT_FERNET, None, value
+        for key in self.keys:
+            try:
+                return key.decrypt(format_tag, header, body)
+            except InvalidToken:
+                pass
+        raise InvalidToken
+
+    def fingerprint(self, value):
+        """
+        Keyed HMAC of a text, equal texts get equal fingerprints but a fingerprint reveals nothing about its text.
+        """
+        return hmac.new(self.primary_key.fingerprint_key, value.encode('utf-8'), hashlib.sha256).hexdigest()[:32]
+
+    def key_id(self, value):
+        """
+        :return: id of the key which encrypted ``value``, or ``None`` for envelopes written without a key id
+        """
+        if value and six.indexbytes(value, 0) & KEY_ID_FLAG:
+            return bytes(value[1:1 + KEY_ID_SIZE])
+
+    def reencrypt(self, value):
+        """
+        Encrypt again with the primary key, without deserializing the value.
+        :return: the new envelope, or ``None`` when ``value`` is already encrypted with the primary key
+        """
+        if self.key_id(value) == self.primary_key.key_id:
+            return
+        if not self.key_ring and self.format == FORMAT_FERNET and self.key_id(value) is None:
+            return
+        return self.encrypt(self.decrypt(value))
+
+    def serialize(self, value, pickled=False):
+        """
+        Serialize the value with ``SECURE_INNER_SERIALIZER``, compress it when ``SECURE_COMPRESSION`` is enabled and
+        prefix the header byte. Plain pickles are written without header when neither option is used.
+        :param pickled: pickle the value even when ``SECURE_INNER_SERIALIZER`` is ``json`` or ``msgpack``, for
+        payloads which must be read back with their exact types, like RQ job arguments and results
+        :return: plain text to be encrypted
+        """
+        inner_serializer = self.inner_serializer
+        if pickled and inner_serializer not in (INNER_PICKLE, INNER_PICKLE5):
+            inner_serializer = INNER_PICKLE
+        val = self.inner_dumps(inner_serializer, value)
+        if not self.compression and inner_serializer == INNER_PICKLE:
+            return val
+        codec = CODEC_NONE
+        if self.compression and len(val) >= self.compression_threshold:
+            compressed = compress(self.compression, val, self.compression_level)
+            metrics.observe('compression_ratio', len(compressed) / len(val), cache=self.alias)
+            if len(compressed) < len(val):
+                codec, val = self.compression, compressed
+        return six.int2byte(inner_serializer << INNER_SERIALIZER_SHIFT | codec) + val
+
+    def deserialize(self, value):
+        header = six.indexbytes(value, 0) if value else None
+        if header is None or header > HEADER_MASK:
+            return super(SecureSerializer, self).loads(value)
+        val = decompress(header & CODEC_MASK, value[1:])
+        return self.inner_loads(header >> INNER_SERIALIZER_SHIFT, val)
+
+    def inner_dumps(self, inner_serializer, value):
+        if inner_serializer == INNER_PICKLE:
+            return super(SecureSerializer, self).dumps(value)
+        if inner_serializer == INNER_JSON:
+            return json.dumps(value, cls=DjangoJSONEncoder, separators=(',', ':')).encode('utf-8')
+        if inner_serializer == INNER_MSGPACK:
+            return msgpack.packb(value, use_bin_type=True)
+        if inner_serializer == INNER_PICKLE5:
+            return pickle5_dumps(value)
+        raise ValueError('Unknown inner serializer: {}'.format(inner_serializer))
+
+    def inner_loads(self, inner_serializer, value):
+        if inner_serializer == INNER_PICKLE:
+            return super(SecureSerializer, self).loads(value)
+        if inner_serializer == INNER_JSON:
+            return json.loads(value.decode('utf-8'))
+        if inner_serializer == INNER_MSGPACK:
+            if msgpack is None:
+                raise ImproperlyConfigured('msgpack serialized values can not be read without the msgpack package')
+            return msgpack.unpackb(value, raw=False)
+        if inner_serializer == INNER_PICKLE5:
+            return pickle5_loads(value)
+        raise ValueError('Unknown inner serializer: {}'.format(inner_serializer))
+
+    def dumps_many(self, values, pickled=False):
+        """
+        Encrypt a list of values, large batches are spread over the configured ``SECURE_PARALLEL_EXECUTOR`` pool.
+        :param pickled: pickle the values whatever ``SECURE_INNER_SERIALIZER`` is, see ``serialize``
+        :return: list of encrypted values in the same order
+        """
+        if pickled:
+            return self._map(functools.partial(self.dumps, pickled=True),
+                             functools.partial(_dumps_chunk, pickled=True), values)
+        return self._map(self.dumps, _dumps_chunk, values)
+
+    def loads_many(self, values):
+        """
+        Decrypt a list of values previously encrypted by ``dumps`` or ``dumps_many``. With a process pool only the
+        decryption runs in the workers, values unpickled there would have to be pickled again to reach this process.
+        :return: list of decrypted values in the same order
+        """
+        if self.parallel_executor == 'process':
+            return [self.deserialize(plaintext) for plaintext in self._map(self.decrypt, _decrypt_chunk, values)]
+        return self._map(self.loads, None, values)
+
+    def _map(self, func, chunk_func, values):
+        values = list(values)
+        if not self.parallel_executor or len(values) < self.parallel_threshold:
+            return [func(value) for value in values]
+
+        executor = get_executor(self.parallel_executor, self.parallel_workers)
+        size = self.parallel_chunk_size
+        chunks = [values[i:i + size] for i in range(0, len(values), size)]
+        if self.parallel_executor == 'process':
+            results = executor.map(chunk_func, [self.options] * len(chunks), chunks)
+        else:
+            results = executor.map(lambda chunk: [func(value) for value in chunk], chunks)
+        return [value for chunk in results for value in chunk]
+
+
+def get_secure_serializer(cache_name=None):
+    """
+    Serializer of a secure cache, built on first use and shared by all threads.
+    :param cache_name: alias of the cache in ``CACHES``, defaults to ``DJANGO_REDIS_SECURE_CACHE_NAME``
+    """
+    if cache_name is None:
+        cache_name = settings.get_secure_cache_name()
+    serializer = _serializers.get(cache_name)
+    if serializer is None:
+        with _serializers_lock:
+            serializer = _serializers.get(cache_name)
+            if serializer is None:
+                options = settings.get_secure_cache_opts(cache_name)
+                if options is None:
+                    raise ImproperlyConfigured(
+                        'Cache {} must use {} as SERIALIZER'.format(cache_name, settings.SECURE_SERIALIZER))
+                serializer = _serializers[cache_name] = SecureSerializer(options)
+    return serializer
+
+
+def reset_secure_serializers(**kwargs):
+    if kwargs.get('setting') in (None, 'CACHES', 'DJANGO_REDIS_SECURE_CACHE_NAME'):
+        with _serializers_lock:
+            _serializers.clear()
+            # Resolved again on next use
+            default_secure_serializer._wrapped = empty
+
 
+setting_changed.connect(reset_secure_serializers)
 
-default_secure_serializer = SecureSerializer(settings.get_secure_cache_opts())
+default_secure_serializer = SimpleLazyObject(get_secure_serializer)
@@ -0,0 +1,41 @@
+from __future__ import unicode_literals
+
+from django.conf import settings as global_settings
+from django.contrib.sessions.backends import cache
+from django.contrib.sessions.backends.base import CreateError, UpdateError
+from django.core.exceptions import ImproperlyConfigured
+
+from . import settings
+
+
+class SessionStore(cache.SessionStore):
+    """
+    Session engine storing sessions in the secure cache ``SESSION_CACHE_ALIAS``, under the same keys and in the same
+    format as ``django.contrib.sessions.backends.cache``, so either engine reads the sessions of the other.
+
+    A session is decrypted only when its data is first accessed, and encrypted and written only when it was modified.
+    Saving an unmodified session, as ``SESSION_SAVE_EVERY_REQUEST`` does on every request, only extends its lifetime
+    with an ``EXPIRE``. Modified sessions are written with ``SET XX`` instead of being read again first.
+    """
+
+    def __init__(self, session_key=None):
+        if settings.get_secure_cache_opts(global_settings.SESSION_CACHE_ALIAS) is None:
+            raise ImproperlyConfigured('SESSION_CACHE_ALIAS {} does not use SecureSerializer'.format(
+                global_settings.SESSION_CACHE_ALIAS))
+        super(SessionStore, self).__init__(session_key)
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        if must_create:
+            if not self._cache.add(self.cache_key, self._get_session(no_load=True), self.get_expiry_age()):
+                raise CreateError
+            return
+
+        if self.modified:
+            saved = self._cache.set(self.cache_key, self._get_session(), self.get_expiry_age(), xx=True)
+        else:
+            saved = self._cache.touch(self.cache_key, self.get_expiry_age())
+        if not saved:
+            # The session expired or was deleted in the meantime
+            raise UpdateError
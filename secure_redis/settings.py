@@ -4,23 +4,121 @@ from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 
 
-def get_secure_cache_opts():
-    if hasattr(settings, 'DJANGO_REDIS_SECURE_CACHE_NAME'):
-        cache_name = settings.DJANGO_REDIS_SECURE_CACHE_NAME
-    else:
-        cache_name = 'default'
+SECURE_SERIALIZER = 'secure_redis.serializer.SecureSerializer'
+
+STATS_CACHE_TIMEOUT = 5
+REQUEUE_SYNC_LIMIT = 10000
+METRICS_FLUSH_INTERVAL = 10
+RESULT_OVERFLOW_MODES = ('drop', 'chunk')
+
+
+def get_secure_cache_name():
+    return getattr(settings, 'DJANGO_REDIS_SECURE_CACHE_NAME', 'default')
+
+
+def get_stats_cache_timeout():
+    """
+    :return: number of seconds the queue statistics displayed in the admin are cached by each process
+    """
+    return getattr(settings, 'SECURE_RQ_STATS_CACHE_TIMEOUT', STATS_CACHE_TIMEOUT)
+
+
+def get_requeue_sync_limit():
+    """
+    :return: number of jobs above which requeuing a whole queue from the admin continues in a background job
+    """
+    return getattr(settings, 'SECURE_RQ_REQUEUE_SYNC_LIMIT', REQUEUE_SYNC_LIMIT)
+
+
+def get_bulk_queue_name():
+    """
+    :return: name of the queue running the background jobs of the admin
+    """
+    return getattr(settings, 'SECURE_RQ_BULK_QUEUE', 'default')
+
+
+def get_task_index_enabled():
+    """
+    :return: whether the pending jobs of secure tasks are indexed by task for the admin
+    """
+    return getattr(settings, 'SECURE_RQ_TASK_INDEX', False)
+
+
+def get_encrypt_results():
+    """
+    :return: whether the values returned by secure tasks are encrypted before RQ stores them
+    """
+    return getattr(settings, 'SECURE_RQ_ENCRYPT_RESULTS', False)
+
+
+def get_result_compression():
+    """
+    :return: codec compressing the results of secure tasks, ``None`` to follow the secure cache ``OPTIONS``
+    """
+    return getattr(settings, 'SECURE_RQ_RESULT_COMPRESSION', None)
+
+
+def get_result_max_size():
+    """
+    :return: size in bytes of the serialized results of secure tasks above which they are not stored with the job,
+    ``None`` for no limit
+    """
+    return getattr(settings, 'SECURE_RQ_RESULT_MAX_SIZE', None)
+
+
+def get_result_overflow():
+    """
+    :return: what becomes of results above ``SECURE_RQ_RESULT_MAX_SIZE``, either ``drop`` or ``chunk``
+    """
+    overflow = getattr(settings, 'SECURE_RQ_RESULT_OVERFLOW', 'drop')
+    if overflow not in RESULT_OVERFLOW_MODES:
+        raise ImproperlyConfigured('SECURE_RQ_RESULT_OVERFLOW must be one of {}, got {!r}'.format(
+            ', '.join(RESULT_OVERFLOW_MODES), overflow))
+    return overflow
+
+
+def get_metrics_backends():
+    """
+    :return: dotted paths of the backends receiving the measurements of ``secure_redis.metrics``, none by default
+    """
+    return getattr(settings, 'SECURE_REDIS_METRICS_BACKENDS', [])
+
+
+def get_metrics_flush_interval():
+    """
+    :return: number of seconds ``RedisBackend`` aggregates measurements in memory before adding them to Redis
+    """
+    return getattr(settings, 'SECURE_REDIS_METRICS_FLUSH_INTERVAL', METRICS_FLUSH_INTERVAL)
+
+
+def get_cache_alias(options):
+    """
+    :return: alias of the first cache in ``CACHES`` whose ``OPTIONS`` are ``options``, apart from the client class
+    which the secure backend sets by default, ``None`` if there is none
+    """
+    options = dict(options, CLIENT_CLASS=None)
+    for alias, params in settings.CACHES.items():
+        if dict(params.get('OPTIONS') or {}, CLIENT_CLASS=None) == options:
+            return alias
+
+
+def get_secure_cache_opts(cache_name=None):
+    """
+    :param cache_name: alias of the cache in ``CACHES``, defaults to ``DJANGO_REDIS_SECURE_CACHE_NAME``
+    :return: the cache ``OPTIONS`` if it uses ``SecureSerializer``, ``None`` otherwise
+    """
+    if cache_name is None:
+        cache_name = get_secure_cache_name()
 
     secure_cache_options_settings = settings.CACHES[cache_name].get('OPTIONS')
     if not secure_cache_options_settings:
             raise ImproperlyConfigured(
                 'OPTIONS must be defined in settings in secure cache settings!')
-    if secure_cache_options_settings['SERIALIZER'] == 'secure_redis.serializer.SecureSerializer':
-        return secure_cache_options_settings
-
+    if secure_cache_options_settings.get('SERIALIZER') != SECURE_SERIALIZER:
+        return
 
-secure_cache_options_settings = get_secure_cache_opts()
-if secure_cache_options_settings:
-    if not secure_cache_options_settings.get('REDIS_SECRET_KEY'):
+    if not secure_cache_options_settings.get('REDIS_SECRET_KEY') and \
+            not secure_cache_options_settings.get('REDIS_SECRET_KEYS'):
         raise ImproperlyConfigured(
-            'REDIS_SECRET_KEY must be defined in settings in secure cache OPTIONS')
-
+            'REDIS_SECRET_KEY or REDIS_SECRET_KEYS must be defined in settings in secure cache OPTIONS')
+    return secure_cache_options_settings
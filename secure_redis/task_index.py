@@ -0,0 +1,139 @@
+from __future__ import unicode_literals
+
+from collections import defaultdict
+
+from rq.job import Job
+
+from . import settings
+from . import tasks
+
+
+# Sorted set of the pending job ids of a task in a queue, scored by enqueue order
+INDEX_KEY = 'secure_redis:task_index:{}:{}'
+# Set of the fingerprints of the tasks indexed for a queue
+TASKS_KEY = 'secure_redis:task_index:{}'
+SEQUENCE_KEY = 'secure_redis:task_index:sequence'
+DEFAULT_PRUNE_BATCH = 1000
+
+# Give the job ids consecutive scores from a shared sequence, so pages can be walked with a score cursor. KEYS are the
+# index, the tasks set and the sequence, ARGV the fingerprint followed by the job ids.
+ADD_SCRIPT = """
+local last = redis.call('INCRBY', KEYS[3], #ARGV - 1)
+for i = 2, #ARGV do
+    redis.call('ZADD', KEYS[1], last - #ARGV + i, ARGV[i])
+end
+redis.call('SADD', KEYS[2], ARGV[1])
+return last
+"""
+
+def is_enabled():
+    return settings.get_task_index_enabled()
+
+
+def get_index_key(queue_name, fingerprint):
+    return INDEX_KEY.format(queue_name, fingerprint)
+
+
+def add_jobs(queue, fingerprint, job_ids, pipeline=None):
+    """
+    Index ``job_ids``, enqueued in ``queue`` for the task of ``fingerprint``.
+    """
+    if not job_ids:
+        return
+    keys = [get_index_key(queue.name, fingerprint), TASKS_KEY.format(queue.name), SEQUENCE_KEY]
+    (pipeline or queue.connection).eval(ADD_SCRIPT, len(keys), *(keys + [fingerprint] + list(job_ids)))
+
+
+def remove_jobs(jobs, connection, pipeline=None):
+    """
+    Remove ``jobs`` from the index of their queue, jobs of other tasks than secure ones are ignored.
+    """
+    job_ids = defaultdict(list)
+    for job in jobs:
+        fingerprint = (job.kwargs or {}).get(tasks.FINGERPRINT_KWARG)
+        if fingerprint:
+            job_ids[get_index_key(job.origin, fingerprint)].append(job.id)
+    for key, ids in job_ids.items():
+        (pipeline or connection).zrem(key, *ids)
+
+
+def _get_fingerprints(queue):
+    return [fingerprint.decode('utf-8') if isinstance(fingerprint, bytes) else fingerprint
+            for fingerprint in queue.connection.smembers(TASKS_KEY.format(queue.name))]
+
+
+def get_counts(queue):
+    """
+    :return: list of ``(task name, fingerprint, number of pending jobs)`` of the tasks indexed for ``queue``, the
+    most frequent first
+    """
+    connection = queue.connection
+    fingerprints = _get_fingerprints(queue)
+    pipeline = connection.pipeline(transaction=False)
+    for fingerprint in fingerprints:
+        pipeline.zcard(get_index_key(queue.name, fingerprint))
+    counts = pipeline.execute()
+    names = tasks.resolve_fingerprints(fingerprints, connection)
+    counts = [(names.get(fingerprint, fingerprint), fingerprint, count)
+              for fingerprint, count in zip(fingerprints, counts) if count]
+    return sorted(counts, key=lambda count: (-count[2], count[0]))
+
+
+def clear(queue):
+    """
+    Remove every job of ``queue`` from the index, when the queue is emptied.
+    """
+    keys = [get_index_key(queue.name, fingerprint) for fingerprint in _get_fingerprints(queue)]
+    queue.connection.delete(TASKS_KEY.format(queue.name), *keys)
+
+
+def get_job_ids(queue, fingerprint, cursor=None, count=100):
+    """
+    :param cursor: ``None`` for the first page, otherwise the cursor returned with the previous page
+    :return: tuple of the ids of up to ``count`` pending jobs of the task of ``fingerprint`` in ``queue``, in enqueue
+    order, and the cursor of the next page, ``None`` on the last page
+    """
+    minimum = '({}'.format(int(cursor)) if cursor else '-inf'
+    entries = queue.connection.zrangebyscore(get_index_key(queue.name, fingerprint), minimum, '+inf',
+                                             start=0, num=count, withscores=True)
+    job_ids = [job_id.decode('utf-8') if isinstance(job_id, bytes) else job_id for job_id, _ in entries]
+    next_cursor = int(entries[-1][1]) if len(entries) == count else None
+    return job_ids, next_cursor
+
+
+def prune(queue, fingerprint, job_ids, jobs):
+    """
+    Remove the ids of a page of ``get_job_ids`` whose job was deleted without being removed from the index.
+    """
+    stale = set(job_ids) - set(job.id for job in jobs)
+    if stale:
+        queue.connection.zrem(get_index_key(queue.name, fingerprint), *stale)
+
+
+def prune_stale(queue, batch_size=DEFAULT_PRUNE_BATCH):
+    """
+    Remove from the index of ``queue`` the ids of the jobs which no longer exist, because they expired or were
+    deleted without being removed from the index. Each index is walked with ``ZSCAN``, ``batch_size`` ids per round
+    trip, so Redis is never blocked for a whole index.
+    :return: number of ids removed
+    """
+    connection = queue.connection
+    removed = 0
+    for fingerprint in _get_fingerprints(queue):
+        key = get_index_key(queue.name, fingerprint)
+        stale = []
+        cursor = 0
+        while True:
+            cursor, entries = connection.zscan(key, cursor, count=batch_size)
+            job_ids = [job_id for job_id, _ in entries]
+            if job_ids:
+                pipeline = connection.pipeline(transaction=False)
+                for job_id in job_ids:
+                    pipeline.exists(Job.key_for(job_id.decode('utf-8') if isinstance(job_id, bytes) else job_id))
+                stale.extend(job_id for job_id, exists in zip(job_ids, pipeline.execute()) if not exists)
+            if not cursor:
+                break
+        # Removed once the scan is over so it does not depend on how the cursor copes with removals
+        for i in range(0, len(stale), batch_size):
+            removed += connection.zrem(key, *stale[i:i + batch_size])
+    return removed
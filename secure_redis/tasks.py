@@ -0,0 +1,111 @@
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+from importlib import import_module
+import threading
+
+from django.conf import settings
+
+import rq.utils
+
+from .serializer import default_secure_serializer as secure_serializer
+
+
+# Plain text keyword argument of ``secure_job_proxy`` holding the fingerprint of the task name
+FINGERPRINT_KWARG = 'task_fingerprint'
+# Redis hash of task name fingerprint to encrypted task name
+TASK_NAMES_KEY = 'secure_redis:task_names'
+MAX_CACHED_NAMES = 1024
+
+# Task name to function, filled by the ``secure_rq.job`` decorator and by every name resolved since
+_tasks = {}
+
+_fingerprints = {}
+_published_fingerprints = set()
+_names = OrderedDict()
+_names_lock = threading.Lock()
+
+
+def get_task_name(func):
+    return '{}.{}'.format(func.__module__, func.__name__)
+
+
+def register(func):
+    """
+    :return: the name jobs of ``func`` are enqueued with
+    """
+    name = get_task_name(func)
+    _tasks[name] = func
+    return name
+
+
+def resolve(name):
+    """
+    :return: the function of the task ``name``, imported only the first time an unregistered name is seen
+    """
+    func = _tasks.get(name)
+    if func is None:
+        func = _tasks[name] = rq.utils.import_attribute(name)
+    return func
+
+
+def preload(modules=None):
+    """
+    Import the modules defining tasks so their functions are registered before the first job runs, workers fork a
+    work horse per job which inherits the registry of the worker process.
+    :param modules: module names, defaults to the ``SECURE_RQ_TASK_MODULES`` setting
+    """
+    if modules is None:
+        modules = getattr(settings, 'SECURE_RQ_TASK_MODULES', [])
+    for module in modules:
+        import_module(module)
+
+
+def get_fingerprint(name):
+    """
+    :return: the fingerprint stored in plain text with the jobs of the task ``name`` to display it in the admin
+    """
+    fingerprint = _fingerprints.get(name)
+    if fingerprint is None:
+        fingerprint = _fingerprints[name] = secure_serializer.fingerprint(name)
+    return fingerprint
+
+
+def publish_name(name, connection, pipeline=None):
+    """
+    Store the encrypted task name under its fingerprint, once per process and Redis server.
+    :return: the fingerprint of ``name``
+    """
+    fingerprint = get_fingerprint(name)
+    published = (id(connection.connection_pool), fingerprint)
+    if published not in _published_fingerprints:
+        (pipeline or connection).hsetnx(TASK_NAMES_KEY, fingerprint, secure_serializer.dumps(name))
+        _published_fingerprints.add(published)
+    return fingerprint
+
+
+def resolve_fingerprints(fingerprints, connection):
+    """
+    :return: dict of fingerprint to task name, fingerprints which are not known are missing. Names not seen by this
+    process yet are fetched in a single round trip and decrypted once.
+    """
+    fingerprints = set(fingerprints)
+    names = {}
+    with _names_lock:
+        for fingerprint in fingerprints:
+            name = _names.pop(fingerprint, None)
+            if name is not None:
+                _names[fingerprint] = names[fingerprint] = name
+
+    missing = [fingerprint for fingerprint in fingerprints if fingerprint not in names]
+    if missing:
+        found = [(fingerprint, value) for fingerprint, value in zip(missing, connection.hmget(TASK_NAMES_KEY, missing))
+                 if value is not None]
+        names.update(zip([fingerprint for fingerprint, _ in found],
+                         secure_serializer.loads_many([value for _, value in found])))
+        with _names_lock:
+            for fingerprint, _ in found:
+                _names[fingerprint] = names[fingerprint]
+            while len(_names) > MAX_CACHED_NAMES:
+                _names.popitem(last=False)
+    return names
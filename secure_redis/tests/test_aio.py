@@ -0,0 +1,85 @@
+from __future__ import unicode_literals
+
+import unittest
+
+import django.test
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured
+
+import mock
+
+from secure_redis import chunks
+
+try:
+    import asyncio
+    from secure_redis import aio
+except (ImportError, SyntaxError):
+    aio = None
+
+
+@unittest.skipIf(aio is None or aio.aioredis is None, 'requires python 3 and redis>=4.2')
+class SecureRedisAsyncTestCase(django.test.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.cache = aio.AsyncSecureCache()
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.cache.redis.close())
+        self.loop.close()
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def test_compatible_with_sync_client(self):
+        self.run_async(self.cache.aset('async-key', {'a': 1}))
+        self.assertEqual({'a': 1}, cache.get('async-key'))
+        cache.set('sync-key', [1, 2])
+        self.assertEqual([1, 2], self.run_async(self.cache.aget('sync-key')))
+        self.assertEqual('default', self.run_async(self.cache.aget('missing-key', 'default')))
+
+    def test_many(self):
+        self.run_async(self.cache.aset_many({'async-a': 1, 'async-b': 'b'}))
+        self.assertEqual({'async-a': 1, 'async-b': 'b'},
+                         self.run_async(self.cache.aget_many(['async-a', 'async-b', 'async-missing'])))
+
+    def test_large_values_offloaded(self):
+        value = 'x' * aio.DEFAULT_OFFLOAD_THRESHOLD
+        with mock.patch.object(self.cache.executor, 'submit', wraps=self.cache.executor.submit) as submit:
+            self.run_async(self.cache.aset('async-small', 'x'))
+            submit.assert_not_called()
+            self.run_async(self.cache.aset('async-large', value))
+            self.assertEqual(value, self.run_async(self.cache.aget('async-large')))
+        self.assertEqual(2, submit.call_count)
+
+    def test_secure_client_required(self):
+        with self.assertRaises(ImproperlyConfigured):
+            aio.AsyncSecureCache('plain_secure')
+
+    def test_structures_offloaded(self):
+        with mock.patch.object(self.cache.executor, 'submit', wraps=self.cache.executor.submit) as submit:
+            self.run_async(self.cache.aset('async-structure', {'a': 1}))
+        submit.assert_called_once()
+        self.assertEqual({'a': 1}, cache.get('async-structure'))
+
+    def test_chunked_values(self):
+        redis_cache = caches['default']
+        params = dict(redis_cache._params, OPTIONS=dict(redis_cache._params['OPTIONS'], SECURE_CHUNK_SIZE=1000))
+        client = self.cache.client = redis_cache.client.__class__(redis_cache._server, params, redis_cache)
+        value = {'data': 'x' * 5000, }
+
+        client.set('async-chunked', value)
+        self.assertEqual(value, self.run_async(self.cache.aget('async-chunked')))
+        self.assertEqual({'async-chunked': value}, self.run_async(self.cache.aget_many(['async-chunked'])))
+        self.run_async(self.cache.aset('async-chunked', 'small'))
+        self.assertFalse(client.get_client().keys('*secure_chunk*'))
+
+        client.set('async-chunked', value)
+        self.run_async(self.cache.aset_many({'async-chunked': 'small'}))
+        self.assertFalse(client.get_client().keys('*secure_chunk*'))
+
+        client.set('async-chunked', value)
+        value_id, _ = chunks.parse_manifest(client.get_client().get(client.make_key('async-chunked')))
+        client.get_client().delete(chunks.get_chunk_key(client._chunk_prefix, value_id, 0))
+        self.assertEqual('default', self.run_async(self.cache.aget('async-chunked', 'default')))
+        self.assertEqual({}, self.run_async(self.cache.aget_many(['async-chunked'])))
+        client.delete('async-chunked')
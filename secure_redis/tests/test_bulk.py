@@ -0,0 +1,81 @@
+from __future__ import unicode_literals
+
+import django.test
+import django_rq
+from rq.job import Job
+from rq.queue import Queue
+
+import mock
+
+from secure_redis import bulk
+
+
+def dummy(*args, **kwargs):
+    pass
+
+
+class SecureRedisBulkTestCase(django.test.TestCase):
+    def setUp(self):
+        connection = django_rq.get_connection('default')
+        self.source = Queue('bulk-source', connection=connection)
+        self.target = Queue('bulk-target', connection=connection)
+        self.job_ids = []
+        for i in range(5):
+            job = Job.create(dummy, args=(i, ), connection=connection, origin=self.target.name)
+            job.save()
+            connection.rpush(self.source.key, job.id)
+            self.job_ids.append(job.id)
+
+    def tearDown(self):
+        self.source.empty()
+        self.target.empty()
+
+    def test_requeue_jobs(self):
+        self.source.connection.rpush(self.source.key, 'missing')
+        self.assertEqual(6, bulk.requeue_jobs(self.source, chunk_size=2))
+        self.assertEqual(0, self.source.count)
+        self.assertEqual(self.job_ids, self.target.job_ids)
+        self.assertIsNone(bulk.get_progress(self.source))
+
+    def test_requeue_jobs_limit(self):
+        self.assertEqual(3, bulk.requeue_jobs(self.source, limit=3, chunk_size=2))
+        self.assertEqual(self.job_ids[3:], self.source.job_ids)
+        self.assertEqual(self.job_ids[:3], self.target.job_ids)
+
+    def test_requeue_jobs_progress(self):
+        progress = []
+        get_job_ids = self.source.get_job_ids
+
+        def get_and_report(offset, length):
+            progress.append(bulk.get_progress(self.source))
+            return get_job_ids(offset, length)
+
+        with mock.patch.object(self.source, 'get_job_ids', side_effect=get_and_report):
+            bulk.requeue_jobs(self.source, chunk_size=2)
+        self.assertEqual([(0, 5), (2, 5), (4, 5)], progress)
+
+    def test_requeue_jobs_interrupted(self):
+        jobs = bulk.fetch_jobs(self.job_ids[:2], self.source.connection)
+        with mock.patch('secure_redis.bulk.fetch_jobs', side_effect=[jobs, RuntimeError]):
+            with self.assertRaises(RuntimeError):
+                bulk.requeue_jobs(self.source, chunk_size=2)
+        self.assertEqual(self.job_ids[2:], self.source.job_ids)
+        self.assertEqual(self.job_ids[:2], self.target.job_ids)
+
+    def test_delete_jobs(self):
+        self.assertEqual(2, bulk.delete_jobs(self.source, [self.job_ids[3], self.job_ids[1], 'missing']))
+        self.assertEqual([self.job_ids[0], self.job_ids[2], self.job_ids[4]], self.source.job_ids)
+        self.assertFalse(self.source.connection.exists(Job.key_for(self.job_ids[1])))
+        self.assertTrue(self.source.connection.exists(Job.key_for(self.job_ids[0])))
+
+    def test_delete_jobs_duplicated(self):
+        self.source.connection.rpush(self.source.key, self.job_ids[1])
+        self.assertEqual(2, bulk.delete_jobs(self.source, [self.job_ids[1]]))
+        self.assertEqual([self.job_ids[0]] + self.job_ids[2:], self.source.job_ids)
+
+    def test_delete_matching(self):
+        even = set(self.job_ids[::2])
+        deleted = bulk.delete_matching(self.source, lambda jobs: [job for job in jobs if job.id in even],
+                                       chunk_size=2)
+        self.assertEqual(3, deleted)
+        self.assertEqual(self.job_ids[1::2], self.source.job_ids)
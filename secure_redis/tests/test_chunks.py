@@ -0,0 +1,68 @@
+from __future__ import unicode_literals
+
+import os
+
+from cryptography.fernet import InvalidToken
+
+import django.test
+
+from secure_redis import chunks
+from secure_redis.serializer import SecureSerializer
+
+
+SECRET_KEY = 'kPEDO_pSrPh3qGJVfGAflLZXKAh4AuHU64tTlP-f_PY='
+
+
+class SecureRedisChunksTestCase(django.test.SimpleTestCase):
+    def setUp(self):
+        self.store = {}
+
+    def dump(self, serializer, value, chunk_size=100):
+        def store(value_id, index, chunk):
+            self.store[chunks.get_chunk_key('', value_id, index)] = chunk
+
+        writer = chunks.ChunkWriter(serializer, chunk_size, store)
+        return writer.dump(value), writer
+
+    def load(self, serializer, writer):
+        value_id, count = chunks.parse_manifest(writer.manifest)
+        return chunks.load(serializer, '', value_id, count, lambda keys: [self.store.get(key) for key in keys],
+                           chunk_size=100, batch=3)
+
+    def test_round_trip(self):
+        value = {'data': os.urandom(1000), 'items': list(range(100)), }
+        for options in ({}, {'SECURE_INNER_SERIALIZER': 'json', 'SECURE_COMPRESSION': 'zlib', }, ):
+            options['REDIS_SECRET_KEY'] = SECRET_KEY
+            serializer = SecureSerializer(options)
+            if 'SECURE_INNER_SERIALIZER' in options:
+                value = {'data': 'x' * 2000, 'items': list(range(1000)), }
+            self.store.clear()
+            plaintext, writer = self.dump(serializer, value)
+            self.assertIsNone(plaintext)
+            self.assertEqual(writer.count, len(self.store))
+            self.assertEqual(value, self.load(serializer, writer))
+
+    def test_small_value_not_chunked(self):
+        serializer = SecureSerializer({'REDIS_SECRET_KEY': SECRET_KEY, })
+        plaintext, writer = self.dump(serializer, 'abc')
+        self.assertFalse(self.store)
+        self.assertEqual('abc', serializer.loads(serializer.encrypt(plaintext)))
+
+    def test_tampering_detected(self):
+        serializer = SecureSerializer({'REDIS_SECRET_KEY': SECRET_KEY, })
+        _, writer = self.dump(serializer, os.urandom(1000))
+        keys = sorted(self.store, key=lambda key: int(key.rsplit(':', 1)[1]))
+
+        # Truncated value
+        truncated = chunks.make_manifest(writer.value_id, writer.count - 1)
+        value_id, count = chunks.parse_manifest(truncated)
+        self.assertRaises(InvalidToken, chunks.load, serializer, '', value_id, count,
+                          lambda keys: [self.store.get(key) for key in keys])
+
+        # Swapped chunks
+        self.store[keys[0]], self.store[keys[1]] = self.store[keys[1]], self.store[keys[0]]
+        self.assertRaises(InvalidToken, self.load, serializer, writer)
+
+        del self.store[keys[2]]
+        self.store[keys[0]], self.store[keys[1]] = self.store[keys[1]], self.store[keys[0]]
+        self.assertRaises(chunks.ChunkMissing, self.load, serializer, writer)
@@ -0,0 +1,86 @@
+from __future__ import unicode_literals
+
+from cryptography.fernet import InvalidToken
+import django.test
+import django_rq
+from django.core.cache import caches
+from django.test.utils import override_settings
+
+from secure_redis import metrics
+import secure_redis.secure_rq
+
+
+def measured(value):
+    return value
+
+
+@override_settings(SECURE_REDIS_METRICS_BACKENDS=['secure_redis.metrics.MemoryBackend'])
+class SecureRedisMetricsTestCase(django.test.TestCase):
+    def setUp(self):
+        self.backend = metrics.get_aggregating_backend()
+        self.backend.reset()
+
+    def test_disabled(self):
+        with override_settings(SECURE_REDIS_METRICS_BACKENDS=[]):
+            self.assertFalse(metrics.is_enabled())
+            caches['default'].set('metrics-disabled', 1)
+        self.assertEqual(({}, {}), self.backend.snapshot())
+
+    def test_serializer(self):
+        cache = caches['default']
+        cache.set('metrics-test', 'x' * 100)
+        self.assertEqual('x' * 100, cache.get('metrics-test'))
+        histograms, _ = self.backend.snapshot()
+        for name in ('dumps_seconds', 'loads_seconds', 'encrypt_seconds', 'decrypt_seconds'):
+            self.assertEqual(1, histograms[name, 'cache=default'].count)
+        self.assertLess(histograms['plaintext_bytes', 'cache=default'].total,
+                        histograms['ciphertext_bytes', 'cache=default'].total)
+
+    def test_invalid_tokens(self):
+        serializer = caches['default'].client._serializer
+        with self.assertRaises(InvalidToken):
+            serializer.loads(b'not a token')
+        self.assertEqual(1, self.backend.snapshot()[1]['invalid_tokens', 'cache=default'])
+
+    def test_secure_job(self):
+        task = secure_redis.secure_rq.job(django_rq.get_queue('default'))(measured)
+        task.delay(1)
+        histograms, _ = self.backend.snapshot()
+        tags = 'task=secure_redis.tests.test_metrics.measured'
+        self.assertEqual(1, histograms['job_seconds', tags].count)
+        self.assertEqual(1, histograms['job_decrypt_seconds', tags].count)
+
+    def test_summarize(self):
+        for value in (0.001, 0.002, 0.1):
+            self.backend.observe('dumps_seconds', value, 'cache=default')
+        self.backend.observe('dumps_seconds', 1, 'cache=other')
+        histogram_rows, _ = metrics.summarize(*self.backend.snapshot())
+        row = [row for row in histogram_rows if row['tags'] == 'cache=default'][0]
+        self.assertEqual('dumps_ms', row['name'])
+        self.assertEqual(3, row['count'])
+        self.assertAlmostEqual(103 / 3.0, row['mean'])
+        self.assertEqual([2.0 ** metrics.get_bucket(0.002) * 1000, 2.0 ** metrics.get_bucket(0.1) * 1000,
+                          2.0 ** metrics.get_bucket(0.1) * 1000], row['quantiles'])
+
+
+@override_settings(SECURE_REDIS_METRICS_BACKENDS=['secure_redis.metrics.RedisBackend'])
+class SecureRedisMetricsRedisTestCase(django.test.TestCase):
+    def setUp(self):
+        self.backend = metrics.get_aggregating_backend()
+        self.backend.reset()
+
+    def tearDown(self):
+        self.backend.reset()
+
+    def test_flush(self):
+        metrics.observe('loads_seconds', 0.5, cache='default')
+        metrics.increment('invalid_tokens', cache='default')
+        self.assertFalse(self.backend.get_connection().exists(metrics.METRICS_KEY))
+        metrics.flush()
+        self.assertEqual(({}, {}), super(metrics.RedisBackend, self.backend).snapshot())
+
+        histograms, counters = self.backend.snapshot()
+        self.assertEqual(1, histograms['loads_seconds', 'cache=default'].count)
+        self.assertEqual(0.5, histograms['loads_seconds', 'cache=default'].total)
+        self.assertEqual({metrics.get_bucket(0.5): 1}, dict(histograms['loads_seconds', 'cache=default'].buckets))
+        self.assertEqual({('invalid_tokens', 'cache=default'): 1}, counters)
@@ -0,0 +1,52 @@
+from __future__ import unicode_literals
+
+import django.test
+
+import mock
+
+from secure_redis.near_cache import NearCache
+
+
+class NearCacheTestCase(django.test.SimpleTestCase):
+    def setUp(self):
+        self.near_cache = NearCache('test', max_entries=2, max_bytes=10, timeout=60)
+        self.near_cache.listening = True
+
+    def test_lru_bounds(self):
+        self.near_cache.set('a', b'1', None, 0)
+        self.near_cache.set('b', b'2', None, 0)
+        self.assertEqual(b'1', self.near_cache.get('a'))
+        self.near_cache.set('c', b'3', None, 0)
+        # "b" is the least recently used
+        self.assertIsNone(self.near_cache.get('b'))
+        self.assertEqual(b'1', self.near_cache.get('a'))
+
+        self.near_cache.set('d', b'123456789', None, 0)
+        self.assertEqual(10, self.near_cache.size)
+        self.assertIsNone(self.near_cache.get('c'))
+        self.near_cache.set('e', b'12345678901', None, 0)
+        self.assertIsNone(self.near_cache.get('e'))
+
+    @mock.patch('time.time')
+    def test_ttl(self, time_method):
+        time_method.return_value = 1000
+        self.near_cache.set('a', b'1', 2000, 0)
+        self.near_cache.set('b', b'2', -1, 0)
+        time_method.return_value = 1003
+        self.assertIsNone(self.near_cache.get('a'))
+        self.assertEqual(b'2', self.near_cache.get('b'))
+        time_method.return_value = 1061
+        self.assertIsNone(self.near_cache.get('b'))
+
+    def test_invalidation(self):
+        self.near_cache.set('a', b'1', None, 0)
+        generation = self.near_cache.generation
+        self.near_cache.invalidate(['a'])
+        self.assertIsNone(self.near_cache.get('a'))
+        # A value read before the invalidation is not stored
+        self.near_cache.set('a', b'1', None, generation)
+        self.assertIsNone(self.near_cache.get('a'))
+
+        self.near_cache.set('a', b'1', None, self.near_cache.generation)
+        self.near_cache.listening = False
+        self.assertIsNone(self.near_cache.get('a'))
@@ -0,0 +1,65 @@
+from __future__ import unicode_literals
+
+import django.test
+import django_rq
+from django.test.utils import override_settings
+from rq.job import Job
+
+from secure_redis import chunks
+from secure_redis import results
+import secure_redis.secure_rq
+
+
+SECRET = 'top secret report ' * 100
+
+
+def report():
+    return SECRET
+
+
+@override_settings(SECURE_RQ_ENCRYPT_RESULTS=True)
+class SecureRedisResultsTestCase(django.test.TestCase):
+    def setUp(self):
+        self.queue = django_rq.get_queue('default')
+        self.task = secure_redis.secure_rq.job(self.queue)(report)
+
+    def run_task(self):
+        job = self.task.delay()
+        self.addCleanup(job.delete)
+        return Job.fetch(job.id, connection=self.queue.connection)
+
+    def test_not_encrypted(self):
+        with override_settings(SECURE_RQ_ENCRYPT_RESULTS=False):
+            job = self.run_task()
+        self.assertEqual(SECRET, job.result)
+
+    def test_encrypted(self):
+        job = self.run_task()
+        self.assertIsInstance(job.result, results.EncryptedResult)
+        self.assertNotIn(b'top secret', self.queue.connection.hget(job.key, 'result'))
+        self.assertEqual(SECRET, results.get_result(job))
+
+    @override_settings(SECURE_RQ_RESULT_COMPRESSION='zlib')
+    def test_compressed(self):
+        job = self.run_task()
+        self.assertLess(len(job.result.envelope), len(SECRET))
+        self.assertEqual(SECRET, results.get_result(job))
+
+    @override_settings(SECURE_RQ_RESULT_MAX_SIZE=100)
+    def test_dropped(self):
+        job = self.run_task()
+        self.assertIsInstance(job.result, results.DroppedResult)
+        self.assertGreater(job.result.size, 100)
+        self.assertIsInstance(results.get_result(job), results.DroppedResult)
+
+    @override_settings(SECURE_RQ_RESULT_MAX_SIZE=100, SECURE_RQ_RESULT_OVERFLOW='chunk')
+    def test_chunked(self):
+        job = self.run_task()
+        self.assertIsInstance(job.result, results.ChunkedResult)
+        key = chunks.get_chunk_key(results.CHUNK_PREFIX, job.result.value_id, 0)
+        self.assertGreater(self.queue.connection.pttl(key), 0)
+        self.assertEqual(SECRET, results.get_result(job))
+
+        self.queue.connection.delete(key)
+        with self.assertRaises(chunks.ChunkMissing):
+            results.get_result(job)
@@ -1,9 +1,27 @@
 from __future__ import unicode_literals
 
+import copy
+import datetime
+import decimal
+
+from cryptography.fernet import InvalidToken
+
 import django.test
+from django.conf import settings as django_settings
 from django.core import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.utils import six
 
 import mock
+from redis.exceptions import WatchError
+
+from secure_redis import chunks
+from secure_redis.serializer import SecureSerializer, default_secure_serializer, get_secure_serializer
+
+
+SECRET_KEY = 'kPEDO_pSrPh3qGJVfGAflLZXKAh4AuHU64tTlP-f_PY='
+NEW_SECRET_KEY = 'Sd2Ao9CWTqQ0L0sQeQ_D1Zfn4XW7vJm6XqLxH8dYyN0='
 
 
 class SecureRedisTestCase(django.test.TestCase):
@@ -32,3 +50,241 @@ class SecureRedisTestCase(django.test.TestCase):
         get_method.return_value = enc_val
         decrypted_value = redis_cache.get('val')
         self.assertEqual(original_val, decrypted_value)
+
+    @mock.patch('redis.client.StrictRedis.mget')
+    @mock.patch('redis.client.StrictRedis.set')
+    def test_get_many_set_many_batched(self, set_method, mget_method):
+        redis_cache = cache.caches['default']
+        serializer = redis_cache.client._serializer
+        data = {'a': 'A', 'b': [1, 2, 3], 'c': 7, }
+        with mock.patch.object(serializer, 'dumps_many', wraps=serializer.dumps_many) as dumps_many:
+            redis_cache.set_many(data)
+        dumps_many.assert_called_once()
+        self.assertEqual(3, set_method.call_count)
+
+        stored = dict((call[0][0], call[0][1]) for call in set_method.call_args_list)
+        keys = [redis_cache.make_key(key) for key in ('a', 'b', 'c', 'd')]
+        mget_method.return_value = [stored.get(key) for key in keys]
+        with mock.patch.object(serializer, 'loads_many', wraps=serializer.loads_many) as loads_many:
+            values = redis_cache.get_many(['a', 'b', 'c', 'd'])
+        loads_many.assert_called_once()
+        self.assertEqual(data, dict(values))
+
+    def test_loads_many_parallel(self):
+        serializer = cache.caches['default'].client._serializer
+        values = [{'index': i} for i in range(50)]
+        with mock.patch.multiple(serializer, parallel_executor='thread', parallel_threshold=10,
+                                 parallel_chunk_size=7):
+            encrypted = serializer.dumps_many(values)
+            self.assertEqual(values, serializer.loads_many(encrypted))
+        self.assertEqual(values, [serializer.loads(value) for value in encrypted])
+
+    def test_loads_many_process(self):
+        serializer = SecureSerializer({
+            'REDIS_SECRET_KEY': SECRET_KEY,
+            'SECURE_PARALLEL_EXECUTOR': 'process',
+            'SECURE_PARALLEL_THRESHOLD': 10,
+            'SECURE_PARALLEL_CHUNK_SIZE': 7,
+        })
+        values = [{'index': i} for i in range(50)]
+        encrypted = serializer.dumps_many(values)
+        # Only decrypted in the workers, deserialized here
+        with mock.patch.object(serializer, 'deserialize', wraps=serializer.deserialize) as deserialize:
+            self.assertEqual(values, serializer.loads_many(encrypted))
+        self.assertEqual(50, deserialize.call_count)
+
+    def test_pickled_with_json_inner_serializer(self):
+        serializer = SecureSerializer({'REDIS_SECRET_KEY': SECRET_KEY, 'SECURE_INNER_SERIALIZER': 'json', })
+        value = (datetime.date(2020, 1, 2), decimal.Decimal('1.5'), (1, 2), {'when': datetime.datetime(2020, 1, 1)})
+        self.assertEqual(value, serializer.loads(serializer.dumps(value, pickled=True)))
+        self.assertEqual([value] * 2, serializer.loads_many(serializer.dumps_many([value] * 2, pickled=True)))
+        self.assertEqual(['2020-01-02', '1.5', [1, 2], {'when': '2020-01-01T00:00:00'}],
+                         serializer.loads(serializer.dumps(value)))
+
+    def test_compression_round_trip(self):
+        plain_serializer = SecureSerializer({'REDIS_SECRET_KEY': SECRET_KEY, })
+        value = {'report': ['row'] * 5000, }
+        small_value = 'abc'
+        for codec in ('zlib', 'bz2', 'lzma', ):
+            serializer = SecureSerializer({
+                'REDIS_SECRET_KEY': SECRET_KEY,
+                'SECURE_COMPRESSION': codec,
+                'SECURE_COMPRESSION_THRESHOLD': 100,
+            })
+            encrypted = serializer.dumps(value)
+            self.assertLess(len(encrypted), len(plain_serializer.dumps(value)))
+            self.assertEqual(value, serializer.loads(encrypted))
+            self.assertEqual(small_value, serializer.loads(serializer.dumps(small_value)))
+
+            # Values written with and without compression can be read by both
+            self.assertEqual(value, plain_serializer.loads(encrypted))
+            self.assertEqual(value, serializer.loads(plain_serializer.dumps(value)))
+
+    def test_binary_envelope(self):
+        fernet_serializer = SecureSerializer({'REDIS_SECRET_KEY': SECRET_KEY, })
+        value = {'a': list(range(100)), }
+        for cipher in ('aes-gcm', 'chacha20-poly1305', ):
+            serializer = SecureSerializer({'REDIS_SECRET_KEY': SECRET_KEY, 'SECURE_CIPHER': cipher, })
+            encrypted = serializer.dumps(value)
+            self.assertLess(len(encrypted), len(fernet_serializer.dumps(value)))
+            self.assertEqual(value, serializer.loads(encrypted))
+
+            # Existing fernet tokens are still read and the other way around
+            self.assertEqual(value, serializer.loads(fernet_serializer.dumps(value)))
+            self.assertEqual(value, fernet_serializer.loads(encrypted))
+
+            tampered = encrypted[:-1] + (b'\x00' if encrypted[-1:] != b'\x00' else b'\x01')
+            self.assertRaises(InvalidToken, serializer.loads, tampered)
+
+    def test_key_ring(self):
+        old_serializer = SecureSerializer({'REDIS_SECRET_KEY': SECRET_KEY, })
+        old_value = old_serializer.dumps('old')
+        for cipher in ('fernet', 'aes-gcm', ):
+            serializer = SecureSerializer({
+                'REDIS_SECRET_KEYS': [NEW_SECRET_KEY, SECRET_KEY, ],
+                'SECURE_CIPHER': cipher,
+            })
+            new_value = serializer.dumps('new')
+            self.assertEqual(serializer.primary_key.key_id, serializer.key_id(new_value))
+            self.assertEqual('new', serializer.loads(new_value))
+            self.assertEqual('old', serializer.loads(old_value))
+            self.assertRaises(InvalidToken, old_serializer.loads, new_value)
+
+            self.assertIsNone(serializer.reencrypt(new_value))
+            reencrypted = serializer.reencrypt(old_value)
+            self.assertEqual(serializer.primary_key.key_id, serializer.key_id(reencrypted))
+            self.assertEqual('old', serializer.loads(reencrypted))
+
+    @mock.patch('redis.client.StrictRedis.set')
+    def test_integers_encrypted(self, set_method):
+        redis_cache = cache.caches['default']
+        redis_cache.set('counter', 10)
+        self.assertNotEqual(10, set_method.call_args[0][1])
+        self.assertEqual(10, redis_cache.client.decode(set_method.call_args[0][1]))
+        # Integers stored in plain text are still read
+        self.assertEqual(10, redis_cache.client.decode(b'10'))
+
+    def test_cas_retried(self):
+        redis_cache = cache.caches['default']
+        pipeline = mock.MagicMock()
+        pipeline.__enter__.return_value = pipeline
+        pipeline.eval.return_value = [redis_cache.client.encode(10), 5000, ]
+        pipeline.execute.side_effect = [WatchError(), [True, ], ]
+        client = mock.Mock()
+        client.pipeline.return_value = pipeline
+
+        self.assertEqual(12, redis_cache.incr('counter', 2, client=client))
+        self.assertEqual(2, pipeline.multi.call_count)
+        self.assertEqual(5000, pipeline.set.call_args[1]['px'])
+        self.assertEqual(12, redis_cache.client.decode(pipeline.set.call_args[0][1]))
+
+        pipeline.eval.return_value = [None, -2, ]
+        self.assertRaises(ValueError, redis_cache.incr, 'missing', client=client)
+
+    def test_inner_serializers(self):
+        pickle_serializer = SecureSerializer({'REDIS_SECRET_KEY': SECRET_KEY, })
+        value = {'name': 'abc', 'items': [1, 2, 3], 'empty': None, }
+        for inner_serializer in ('json', 'msgpack', 'pickle5', ):
+            for compression in (None, 'zlib', ):
+                serializer = SecureSerializer({
+                    'REDIS_SECRET_KEY': SECRET_KEY,
+                    'SECURE_INNER_SERIALIZER': inner_serializer,
+                    'SECURE_COMPRESSION': compression,
+                    'SECURE_COMPRESSION_THRESHOLD': 10,
+                })
+                encrypted = serializer.dumps(value)
+                self.assertEqual(value, serializer.loads(encrypted))
+                # Values written with different inner serializers can be read by each other
+                self.assertEqual(value, pickle_serializer.loads(encrypted))
+                self.assertEqual(value, serializer.loads(pickle_serializer.dumps(value)))
+
+    def test_serializer_registry(self):
+        serializer = get_secure_serializer()
+        self.assertIs(serializer, get_secure_serializer('default'))
+        self.assertEqual('abc', serializer.loads(serializer.dumps('abc')))
+        self.assertRaises(ImproperlyConfigured, get_secure_serializer, 'insecure')
+
+        with self.settings(DJANGO_REDIS_SECURE_CACHE_NAME='default'):
+            self.assertIsNot(serializer, get_secure_serializer())
+
+    def test_default_serializer_reset(self):
+        self.assertEqual('abc', default_secure_serializer.loads(default_secure_serializer.dumps('abc')))
+        caches = copy.deepcopy(django_settings.CACHES)
+        caches['default']['OPTIONS']['REDIS_SECRET_KEY'] = NEW_SECRET_KEY
+        with self.settings(CACHES=caches):
+            self.assertEqual(get_secure_serializer().primary_key.key_id, default_secure_serializer.primary_key.key_id)
+            self.assertEqual(NEW_SECRET_KEY, default_secure_serializer.options['REDIS_SECRET_KEY'])
+        self.assertEqual(SECRET_KEY, default_secure_serializer.options['REDIS_SECRET_KEY'])
+
+    def get_chunked_client(self):
+        redis_cache = cache.caches['default']
+        params = dict(redis_cache._params, OPTIONS=dict(redis_cache._params['OPTIONS'], SECURE_CHUNK_SIZE=1000))
+        return redis_cache.client.__class__(redis_cache._server, params, redis_cache)
+
+    def test_chunked_values(self):
+        client = self.get_chunked_client()
+        value = {'data': 'x' * 5000, }
+        client.set('chunked', value)
+        self.assertEqual(value, client.get('chunked'))
+        self.assertEqual({'chunked': value}, client.get_many(['chunked']))
+        self.assertIsNotNone(chunks.parse_manifest(client.get_client().get(client.make_key('chunked'))))
+        client.delete('chunked')
+        self.assertFalse(client.get_client().keys('*secure_chunk*'))
+
+    def test_reencrypt_chunked_values(self):
+        client = self.get_chunked_client()
+        value = {'data': 'x' * 5000, }
+        client.set('chunked', value)
+        manifest = client.get_client().get(client.make_key('chunked'))
+
+        options = dict(client._options, REDIS_SECRET_KEYS=[NEW_SECRET_KEY, SECRET_KEY, ])
+        del options['REDIS_SECRET_KEY']
+        serializer = SecureSerializer(options)
+        with mock.patch.object(cache.caches['default'].client, '_serializer', serializer), \
+                mock.patch.object(serializer, 'reencrypt', wraps=serializer.reencrypt) as reencrypt:
+            call_command('reencrypt_secure_cache', stdout=six.StringIO())
+        self.assertNotIn(manifest, [call[0][0] for call in reencrypt.call_args_list])
+
+        self.assertEqual(manifest, client.get_client().get(client.make_key('chunked')))
+        for key in client.get_client().keys('*secure_chunk*'):
+            self.assertEqual(serializer.primary_key.key_id, serializer.key_id(client.get_client().get(key)))
+        client._serializer = SecureSerializer(dict(options, REDIS_SECRET_KEYS=[NEW_SECRET_KEY, ]))
+        self.assertEqual(value, client.get('chunked'))
+        client.delete('chunked')
+
+    def test_reencrypt_plain_client(self):
+        plain_cache = cache.caches['plain_secure']
+        plain_cache.set('reencrypted', 'value')
+        options = dict(plain_cache.client._options, REDIS_SECRET_KEYS=[NEW_SECRET_KEY, SECRET_KEY, ])
+        del options['REDIS_SECRET_KEY']
+        serializer = SecureSerializer(options)
+        with mock.patch.object(plain_cache.client, '_serializer', serializer):
+            call_command('reencrypt_secure_cache', cache_name='plain_secure', stdout=six.StringIO())
+            self.assertEqual('value', plain_cache.get('reencrypted'))
+        raw = plain_cache.client.get_client().get(plain_cache.client.make_key('reencrypted'))
+        self.assertEqual(serializer.primary_key.key_id, serializer.key_id(raw))
+        plain_cache.delete('reencrypted')
+
+    def test_chunked_values_overwritten(self):
+        client = self.get_chunked_client()
+        value = {'data': 'x' * 5000, }
+
+        client.set_many({'chunked': value, 'other': value})
+        client.set('chunked', value)
+        client.set_many({'chunked': 'small', 'other': 'small'})
+        self.assertFalse(client.get_client().keys('*secure_chunk*'))
+        self.assertEqual({'chunked': 'small', 'other': 'small'}, client.get_many(['chunked', 'other']))
+
+        client.set('chunked', value)
+        client.set('other', value)
+        client.delete_many(['chunked', 'other'])
+        self.assertFalse(client.get_client().keys('*secure_chunk*'))
+
+        client.set('chunked', value)
+        client.set('chunked', 'small', xx=True)
+        self.assertFalse(client.get_client().keys('*secure_chunk*'))
+        client.set('chunked', value)
+        client.cas('chunked', lambda old: old['data'][:5])
+        self.assertFalse(client.get_client().keys('*secure_chunk*'))
+        self.assertEqual('xxxxx', client.get('chunked'))
+        client.delete('chunked')
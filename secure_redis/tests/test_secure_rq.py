@@ -4,8 +4,12 @@ import mock
 import datetime
 
 import django.test
+import django_rq
+from rq.queue import Queue
 
+import secure_redis.schedules
 import secure_redis.secure_rq
+import secure_redis.tasks
 
 
 @secure_redis.secure_rq.job
@@ -41,6 +45,24 @@ class SecureRedisRQTestCase(django.test.TestCase):
         dummy.delay(*args, **kwargs)
         execute_method.assert_called_with('secure_redis.tests.test_secure_rq.dummy', *args, **kwargs)
 
+    @mock.patch('rq.queue.Queue.enqueue_call')
+    def test_delay_single_envelope(self, enqueue_call_method):
+        dummy.delay(1, 2, param1='A')
+        encrypted_args = enqueue_call_method.call_args[1]['args']
+        self.assertEqual(1, len(encrypted_args))
+        self.assertEqual(('secure_redis.tests.test_secure_rq.dummy', (1, 2, ), {'param1': 'A', }, ),
+                         secure_redis.secure_rq.secure_serializer.loads(encrypted_args[0]))
+
+    @mock.patch('secure_redis.secure_rq.execute')
+    def test_legacy_three_envelopes_executed(self, execute_method):
+        serializer = secure_redis.secure_rq.secure_serializer
+        secure_redis.secure_rq.secure_job_proxy(
+            serializer.dumps('secure_redis.tests.test_secure_rq.dummy'),
+            serializer.dumps((1, 2, )),
+            serializer.dumps({'a': '1', }),
+        )
+        execute_method.assert_called_with('secure_redis.tests.test_secure_rq.dummy', 1, 2, a='1')
+
     @mock.patch('rq_scheduler.scheduler.Scheduler.enqueue_at')
     def test_enqueue_at_called(self, enqueue_at_method):
         args = [1,2, ]
@@ -60,9 +82,84 @@ class SecureRedisRQTestCase(django.test.TestCase):
         job.perform()
         execute_method.assert_called_with('secure_redis.tests.test_secure_rq.dummy', *args, **kwargs)
 
-    @mock.patch('rq_scheduler.scheduler.Scheduler.schedule')
+    @mock.patch('secure_redis.secure_rq.execute')
+    def test_delay_many_synchronous(self, execute_method):
+        job_ids = dummy.delay_many([((1, ), {}), ((2, ), {'a': '1', })])
+        self.assertEqual(2, len(job_ids))
+        execute_method.assert_any_call('secure_redis.tests.test_secure_rq.dummy', 1)
+        execute_method.assert_called_with('secure_redis.tests.test_secure_rq.dummy', 2, a='1')
+
+    @mock.patch('rq.queue.Queue.push_job_id')
+    @mock.patch('rq.job.Job.save')
+    def test_delay_many_pipelined(self, save_method, push_job_id_method):
+        queue = Queue('default', connection=django_rq.get_connection('default'))
+
+        @secure_redis.secure_rq.job(queue)
+        def bulk(*args, **kwargs):
+            pass
+
+        pipeline = mock.MagicMock()
+        with mock.patch.object(queue.connection, 'pipeline', return_value=pipeline):
+            with mock.patch.object(secure_redis.secure_rq.secure_serializer, 'dumps_many',
+                                   wraps=secure_redis.secure_rq.secure_serializer.dumps_many) as dumps_many:
+                job_ids = bulk.delay_many([((i, ), {}) for i in range(5)], chunk_size=2)
+        self.assertEqual(5, len(job_ids))
+        self.assertEqual(3, dumps_many.call_count)
+        self.assertEqual(3, pipeline.execute.call_count)
+        self.assertEqual(5, save_method.call_count)
+        push_job_id_method.assert_called_with(job_ids[-1], pipeline=pipeline)
+
+    @mock.patch('rq.job.Job.save')
+    def test_enqueue_at_many(self, save_method):
+        t = datetime.datetime.now()
+        pipeline = mock.MagicMock()
+        with mock.patch('redis.client.StrictRedis.pipeline', return_value=pipeline):
+            job_ids = dummy.enqueue_at_many([(t, (i, ), {}) for i in range(3)], chunk_size=2)
+        self.assertEqual(3, len(job_ids))
+        self.assertEqual(2, pipeline.execute.call_count)
+        self.assertEqual(3, pipeline.zadd.call_count)
+        self.assertEqual(3, save_method.call_count)
+
+    @mock.patch('rq.utils.import_attribute')
+    def test_task_registry(self, import_attribute_method):
+        self.assertIs(dummy, secure_redis.tasks.resolve('secure_redis.tests.test_secure_rq.dummy'))
+        import_attribute_method.assert_not_called()
+
+        import_attribute_method.return_value = datetime.date
+        self.assertIs(datetime.date, secure_redis.tasks.resolve('datetime.date'))
+        self.assertIs(datetime.date, secure_redis.tasks.resolve('datetime.date'))
+        import_attribute_method.assert_called_once_with('datetime.date')
+
+    def tearDown(self):
+        django_rq.get_connection('default').delete(secure_redis.schedules.SCHEDULES_KEY)
+        secure_redis.schedules._legacy_jobs.clear()
+
+    @mock.patch('rq_scheduler.scheduler.Scheduler.schedule', return_value=mock.Mock(id='scheduled'))
     def test_scheduled_once_called(self, schedule_method):
         interval = 60
         dummy.schedule_once(interval)
         schedule_method.assert_called_once()
         self.assertIn(interval, schedule_method.call_args[1].values())
+
+    def test_scheduled_once_indexed(self):
+        scheduler = django_rq.get_scheduler('default')
+        job = dummy.schedule_once(60)
+        with mock.patch('rq_scheduler.scheduler.Scheduler.get_jobs') as get_jobs_method:
+            self.assertIsNone(dummy.schedule_once(60))
+            new_job = dummy.schedule_once(120)
+        get_jobs_method.assert_not_called()
+        self.assertNotIn(job.id, scheduler)
+        self.assertIn(new_job.id, scheduler)
+        scheduler.cancel(new_job)
+
+    def test_reconcile_schedules(self):
+        scheduler = django_rq.get_scheduler('default')
+        job = dummy.schedule_once(60)
+        self.assertEqual(([], []), secure_redis.schedules.reconcile_schedules([(dummy, 60)]))
+        scheduled, cancelled = secure_redis.schedules.reconcile_schedules([(dummy, 30)])
+        self.assertEqual((['secure_redis.tests.test_secure_rq.dummy'], []), (scheduled, cancelled))
+        self.assertNotIn(job.id, scheduler)
+        self.assertEqual(([], ['secure_redis.tests.test_secure_rq.dummy']),
+                         secure_redis.schedules.reconcile_schedules([], prune=True))
+        self.assertFalse([scheduled_job for scheduled_job in scheduler.get_jobs()
+                          if scheduled_job.func_name == 'secure_redis.tests.test_secure_rq.dummy'])
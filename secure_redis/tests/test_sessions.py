@@ -0,0 +1,64 @@
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.contrib.sessions.backends.base import UpdateError
+import django.test
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.test.utils import override_settings
+
+import mock
+
+from secure_redis.sessions import SessionStore
+
+
+class SecureRedisSessionsTestCase(django.test.TestCase):
+    def setUp(self):
+        session = SessionStore()
+        session['user'] = 'secret'
+        session.create()
+        session.save()
+        self.session_key = session.session_key
+        self.cache = caches[settings.SESSION_CACHE_ALIAS]
+        self.serializer = self.cache.client._serializer
+
+    def tearDown(self):
+        SessionStore().delete(self.session_key)
+
+    def test_lazy_load(self):
+        with mock.patch.object(self.serializer, 'loads', wraps=self.serializer.loads) as loads:
+            session = SessionStore(self.session_key)
+            self.assertTrue(session.exists(self.session_key))
+            loads.assert_not_called()
+            self.assertEqual('secret', session['user'])
+        loads.assert_called_once()
+
+    def test_unmodified_save_refreshes_ttl(self):
+        session = SessionStore(self.session_key)
+        self.assertEqual('secret', session['user'])
+        self.cache.expire(session.cache_key, 10)
+        with mock.patch.object(self.serializer, 'dumps') as dumps:
+            session.save()
+        dumps.assert_not_called()
+        self.assertGreater(self.cache.ttl(session.cache_key), 10)
+
+    def test_modified_save(self):
+        session = SessionStore(self.session_key)
+        session['user'] = 'other'
+        session.save()
+        self.assertEqual('other', SessionStore(self.session_key)['user'])
+
+    def test_save_expired(self):
+        session = SessionStore(self.session_key)
+        self.assertEqual('secret', session['user'])
+        session.delete()
+        with self.assertRaises(UpdateError):
+            session.save()
+        session['user'] = 'other'
+        with self.assertRaises(UpdateError):
+            session.save()
+
+    @override_settings(SESSION_CACHE_ALIAS='insecure')
+    def test_insecure_cache(self):
+        with self.assertRaises(ImproperlyConfigured):
+            SessionStore()
@@ -0,0 +1,79 @@
+from __future__ import unicode_literals
+
+import django.test
+import django_rq
+from rq.job import Job
+from django.test.utils import override_settings
+from rq.queue import Queue
+
+import mock
+
+import secure_redis.secure_rq
+from secure_redis import bulk
+from secure_redis import task_index
+from secure_redis import tasks
+
+
+def indexed(*args, **kwargs):
+    pass
+
+
+@override_settings(SECURE_RQ_TASK_INDEX=True)
+class SecureRedisTaskIndexTestCase(django.test.TestCase):
+    def setUp(self):
+        self.queue = Queue('index-test', connection=django_rq.get_connection('default'))
+        self.task = secure_redis.secure_rq.job(self.queue)(indexed)
+        self.fingerprint = tasks.get_fingerprint('secure_redis.tests.test_task_index.indexed')
+        self.job_ids = [self.task.delay(i).id for i in range(3)]
+        self.job_ids += self.task.delay_many([((i, ), {}) for i in range(2)])
+
+    def tearDown(self):
+        self.queue.empty()
+        self.queue.connection.delete(task_index.get_index_key(self.queue.name, self.fingerprint),
+                                     task_index.TASKS_KEY.format(self.queue.name))
+
+    def test_counts(self):
+        self.assertEqual([('secure_redis.tests.test_task_index.indexed', self.fingerprint, 5)],
+                         task_index.get_counts(self.queue))
+
+    def test_cursor_paging(self):
+        job_ids = []
+        cursor = None
+        while True:
+            page, cursor = task_index.get_job_ids(self.queue, self.fingerprint, cursor=cursor, count=2)
+            job_ids += page
+            if cursor is None:
+                break
+        self.assertEqual(self.job_ids, job_ids)
+
+    def test_removed_when_deleted(self):
+        bulk.delete_matching(self.queue, lambda jobs: jobs[:1])
+        self.assertEqual(4, task_index.get_counts(self.queue)[0][2])
+
+    def test_prune_stale(self):
+        self.queue.connection.delete(Job.key_for(self.job_ids[0]), Job.key_for(self.job_ids[3]))
+        self.assertEqual(5, task_index.get_counts(self.queue)[0][2])
+        self.assertEqual(2, task_index.prune_stale(self.queue, batch_size=2))
+        self.assertEqual(3, task_index.get_counts(self.queue)[0][2])
+        self.assertEqual([self.job_ids[1], self.job_ids[2], self.job_ids[4]],
+                         task_index.get_job_ids(self.queue, self.fingerprint)[0])
+
+    def test_clear(self):
+        self.queue.empty()
+        task_index.clear(self.queue)
+        self.assertFalse(self.queue.connection.keys('secure_redis:task_index:{}*'.format(self.queue.name)))
+
+    def test_indexed_when_requeued(self):
+        jobs = bulk.fetch_jobs(self.job_ids[:2], self.queue.connection)
+        task_index.remove_jobs(jobs, self.queue.connection)
+        self.assertEqual(3, task_index.get_counts(self.queue)[0][2])
+        bulk.index_requeued(jobs, self.queue.connection)
+        self.assertEqual(5, task_index.get_counts(self.queue)[0][2])
+
+    def test_removed_when_run(self):
+        queue = django_rq.get_queue('default')
+        task = secure_redis.secure_rq.job(queue)(indexed)
+        with mock.patch('secure_redis.task_index.remove_jobs', wraps=task_index.remove_jobs) as remove_jobs:
+            task.delay()
+        remove_jobs.assert_called_once()
+        self.assertFalse(queue.connection.zcard(task_index.get_index_key(queue.name, self.fingerprint)))
@@ -0,0 +1,82 @@
+from __future__ import unicode_literals
+
+import django.test
+import django_rq
+from django_rq.queues import get_queue_by_index
+from django_rq.settings import QUEUES_LIST
+from rq.queue import Queue
+from rq.registry import FinishedJobRegistry
+
+import mock
+
+import secure_redis.secure_rq
+from secure_redis import tasks
+from secure_redis import views
+
+
+def dummy(*args, **kwargs):
+    pass
+
+
+class SecureRedisViewsTestCase(django.test.TestCase):
+    def setUp(self):
+        self.queue = Queue('views-test', connection=django_rq.get_connection('default'))
+        self.task = secure_redis.secure_rq.job(self.queue)(dummy)
+        self.job_ids = self.task.delay_many([((i, ), {}) for i in range(3)])
+
+    def tearDown(self):
+        self.queue.empty()
+
+    def test_fetch_jobs(self):
+        with mock.patch('rq.job.Job.fetch') as fetch_method:
+            jobs = views.fetch_jobs(self.job_ids[:2] + ['missing'] + self.job_ids[2:], self.queue.connection)
+        fetch_method.assert_not_called()
+        self.assertEqual(self.job_ids, [job.id for job in jobs])
+        self.assertEqual(self.queue.connection, jobs[0].connection)
+
+    def test_use_actual_names(self):
+        jobs = views.fetch_jobs(self.job_ids, self.queue.connection)
+        serializer = secure_redis.secure_rq.secure_serializer
+        with mock.patch.object(serializer, 'loads_many', wraps=serializer.loads_many) as loads_many:
+            views.use_actual_names(jobs)
+        loads_many.assert_called_once()
+        self.assertEqual(['secure_redis.tests.test_views.dummy'] * 3, [job.func_name for job in jobs])
+
+    def test_use_actual_names_memoized(self):
+        jobs = views.fetch_jobs(self.job_ids, self.queue.connection)
+        self.assertEqual({tasks.get_fingerprint('secure_redis.tests.test_views.dummy')},
+                         {job.kwargs[tasks.FINGERPRINT_KWARG] for job in jobs})
+        views.use_actual_names(jobs)
+
+        jobs = views.fetch_jobs(self.job_ids, self.queue.connection)
+        serializer = secure_redis.secure_rq.secure_serializer
+        with mock.patch.object(serializer, 'loads_many') as loads_many:
+            views.use_actual_names(jobs)
+        loads_many.assert_not_called()
+        self.assertEqual(['secure_redis.tests.test_views.dummy'] * 3, [job.func_name for job in jobs])
+
+
+class SecureRedisStatsTestCase(django.test.TestCase):
+    def setUp(self):
+        views._stats.clear()
+
+    def tearDown(self):
+        views._stats.clear()
+
+    def test_collect_stats(self):
+        queue = get_queue_by_index(0)
+        queue.connection.rpush(queue.key, 'stats-test')
+        try:
+            queue_stats = views.collect_stats()
+        finally:
+            queue.connection.lrem(queue.key, 0, 'stats-test')
+        self.assertEqual([queue.name for queue in map(get_queue_by_index, range(len(QUEUES_LIST)))],
+                         [queue_data['name'] for queue_data in queue_stats])
+        self.assertEqual(queue.count + 1, queue_stats[0]['jobs'])
+        self.assertEqual(len(FinishedJobRegistry(queue.name, queue.connection)), queue_stats[0]['finished_jobs'])
+
+    def test_stats_cached(self):
+        with mock.patch('secure_redis.views.collect_stats', return_value=[]) as collect_stats:
+            views.get_stats()
+            views.get_stats()
+        collect_stats.assert_called_once()
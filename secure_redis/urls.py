@@ -5,6 +5,10 @@ from . import views
 urlpatterns = [
     url(r'^$',
         views.stats, name='rq_home'),
+    url(r'^stats\.json$',
+        views.stats_json, name='rq_home_json'),
+    url(r'^metrics/$',
+        views.metrics_panel, name='rq_metrics'),
     url(r'^queues/(?P<queue_index>[\d]+)/$',
         views.jobs, name='rq_jobs'),
     url(r'^queues/(?P<queue_index>[\d]+)/finished/$',
@@ -17,6 +21,10 @@ urlpatterns = [
         views.clear_queue, name='rq_clear'),
     url(r'^queues/(?P<queue_index>[\d]+)/requeue-all/$',
         views.requeue_all, name='rq_requeue_all'),
+    url(r'^queues/(?P<queue_index>[\d]+)/tasks/$',
+        views.task_jobs, name='rq_task_jobs'),
+    url(r'^queues/(?P<queue_index>[\d]+)/delete-matching/$',
+        views.delete_matching_jobs, name='rq_delete_matching_jobs'),
     url(r'^queues/(?P<queue_index>[\d]+)/(?P<job_id>[-\w]+)/$',
         views.job_detail, name='rq_job_detail'),
     url(r'^queues/(?P<queue_index>[\d]+)/(?P<job_id>[-\w]+)/delete/$',
@@ -1,10 +1,13 @@
 from __future__ import division
 
+from collections import Counter, OrderedDict
 from math import ceil
+import threading
+import time
 
 from django.contrib import messages
 from django.contrib.admin.views.decorators import staff_member_required
-from django.http import Http404
+from django.http import Http404, JsonResponse
 from django.shortcuts import redirect, render
 
 from redis.exceptions import ResponseError
@@ -13,63 +16,149 @@ from rq.exceptions import NoSuchJobError
 from rq.job import Job
 from rq.registry import (DeferredJobRegistry, FinishedJobRegistry,
                          StartedJobRegistry)
+from rq.utils import current_timestamp
 
-from django_rq.queues import get_connection, get_queue_by_index
+from django_rq.queues import get_queue_by_index
 from django_rq.settings import QUEUES_LIST
+from . import bulk
+from . import metrics
 from . import settings
+from . import task_index
+from . import tasks
 
+from .bulk import fetch_jobs
 from .serializer import default_secure_serializer as secure_serializer
 
 
-def use_actual_name(job):
-    if 'secure_redis.secure_rq.secure_job_proxy' != job.func_name:
+def use_actual_names(jobs):
+    """
+    Replace the proxy name of secure jobs by the actual method name. Names are looked up by their fingerprint, so only
+    the names of tasks not seen yet are decrypted, jobs without fingerprint are decrypted in a single batch.
+    """
+    secure_jobs = [job for job in jobs if 'secure_redis.secure_rq.secure_job_proxy' == job.func_name]
+    if not secure_jobs:
         return
-    encrypted_func_name = job.args[0]
-    actual_func_name = secure_serializer.loads(encrypted_func_name)
-    job.func_name = actual_func_name
-
 
-@staff_member_required
-def stats(request):
-    queues = []
-    for index, config in enumerate(QUEUES_LIST):
+    fingerprints = [job.kwargs.get(tasks.FINGERPRINT_KWARG) for job in secure_jobs]
+    names = tasks.resolve_fingerprints([fingerprint for fingerprint in fingerprints if fingerprint],
+                                       secure_jobs[0].connection)
+    for job, fingerprint in zip(secure_jobs, fingerprints):
+        if fingerprint in names:
+            job.func_name = names[fingerprint]
+    secure_jobs = [job for job, fingerprint in zip(secure_jobs, fingerprints) if fingerprint not in names]
+    if not secure_jobs:
+        return
 
-        queue = get_queue_by_index(index)
-        connection = queue.connection
+    actual_func_names = secure_serializer.loads_many([job.args[0] for job in secure_jobs])
+    for job, actual_func_name in zip(secure_jobs, actual_func_names):
+        if len(job.args) == 1:
+            # Single envelope of the method name, args and kwargs
+            actual_func_name = actual_func_name[0]
+        job.func_name = actual_func_name
 
-        queue_data = {
-            'name': queue.name,
-            'jobs': queue.count,
-            'index': index,
-            'connection_kwargs': connection.connection_pool.connection_kwargs
-        }
 
-        if queue.name == 'failed':
-            queue_data['workers'] = '-'
-            queue_data['finished_jobs'] = '-'
-            queue_data['started_jobs'] = '-'
-            queue_data['deferred_jobs'] = '-'
+def use_actual_name(job):
+    use_actual_names([job])
+
+
+REGISTRY_CLASSES = OrderedDict([
+    ('finished_jobs', FinishedJobRegistry),
+    ('started_jobs', StartedJobRegistry),
+    ('deferred_jobs', DeferredJobRegistry),
+])
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def collect_stats():
+    """
+    Count the jobs and workers of every queue in ``RQ_QUEUES``, with two round trips per Redis server whatever the
+    number of queues and workers.
+    """
+    queues = [get_queue_by_index(index) for index in range(len(QUEUES_LIST))]
+    queues_by_server = OrderedDict()
+    for index, queue in enumerate(queues):
+        connection_kwargs = queue.connection.connection_pool.connection_kwargs
+        queues_by_server.setdefault(repr(sorted(connection_kwargs.items())), []).append(index)
+
+    stats = [None] * len(queues)
+    for indexes in queues_by_server.values():
+        connection = queues[indexes[0]].connection
+        worker_keys = list(connection.smembers(Worker.redis_workers_keys))
+        now = current_timestamp()
+
+        pipeline = connection.pipeline(transaction=False)
+        for worker_key in worker_keys:
+            pipeline.hget(worker_key, 'queues')
+        for index in indexes:
+            queue = queues[index]
+            pipeline.llen(queue.key)
+            if queue.name != 'failed':
+                # Same as len(registry) without removing the expired jobs
+                for registry_class in REGISTRY_CLASSES.values():
+                    pipeline.zcount(registry_class(queue.name, connection).key, now, '+inf')
+        results = iter(pipeline.execute())
+
+        workers = Counter()
+        for worker_key in worker_keys:
+            queue_names = next(results)
+            # Workers which died without cleaning up are listed without a hash
+            if queue_names:
+                if isinstance(queue_names, bytes):
+                    queue_names = queue_names.decode('utf-8')
+                workers.update(set(queue_names.split(',')))
+
+        for index in indexes:
+            queue = queues[index]
+            queue_data = {
+                'name': queue.name,
+                'jobs': next(results),
+                'index': index,
+                'connection_kwargs': connection.connection_pool.connection_kwargs
+            }
+            if queue.name == 'failed':
+                queue_data['workers'] = '-'
+                for name in REGISTRY_CLASSES:
+                    queue_data[name] = '-'
+            else:
+                queue_data['workers'] = workers[queue.name]
+                for name in REGISTRY_CLASSES:
+                    queue_data[name] = next(results)
+            stats[index] = queue_data
+    return stats
+
+
+def get_stats():
+    """
+    :return: the statistics of ``collect_stats``, cached for ``SECURE_RQ_STATS_CACHE_TIMEOUT`` seconds
+    """
+    with _stats_lock:
+        if _stats.get('expires_at', 0) > time.time():
+            return _stats['queues']
+        queues = collect_stats()
+        _stats['queues'] = queues
+        _stats['expires_at'] = time.time() + settings.get_stats_cache_timeout()
+        return queues
 
-        else:
-            connection = get_connection(queue.name)
-            all_workers = Worker.all(connection=connection)
-            queue_workers = [worker for worker in all_workers if queue in worker.queues]
-            queue_data['workers'] = len(queue_workers)
 
-            finished_job_registry = FinishedJobRegistry(queue.name, connection)
-            started_job_registry = StartedJobRegistry(queue.name, connection)
-            deferred_job_registry = DeferredJobRegistry(queue.name, connection)
-            queue_data['finished_jobs'] = len(finished_job_registry)
-            queue_data['started_jobs'] = len(started_job_registry)
-            queue_data['deferred_jobs'] = len(deferred_job_registry)
+@staff_member_required
+@metrics.timed_view
+def stats(request):
+    context_data = {'queues': get_stats()}
+    return render(request, 'django_rq/stats.html', context_data)
 
-        queues.append(queue_data)
 
-    context_data = {'queues': queues}
-    return render(request, 'django_rq/stats.html', context_data)
+@staff_member_required
+@metrics.timed_view
+def stats_json(request):
+    queues = [{name: value for name, value in queue_data.items() if name != 'connection_kwargs'}
+              for queue_data in get_stats()]
+    return JsonResponse({'queues': queues})
 
 
 @staff_member_required
+@metrics.timed_view
 def jobs(request, queue_index):
     queue_index = int(queue_index)
     queue = get_queue_by_index(queue_index)
@@ -82,15 +171,14 @@ def jobs(request, queue_index):
         last_page = int(ceil(num_jobs / items_per_page))
         page_range = range(1, last_page + 1)
         offset = items_per_page * (page - 1)
-        jobs = queue.get_jobs(offset, items_per_page)
+        jobs = fetch_jobs(queue.get_job_ids(offset, items_per_page), queue.connection)
     else:
         jobs = []
         page_range = []
 
     ###
     # Custom logic here
-    for job in jobs:
-        use_actual_name(job)
+    use_actual_names(jobs)
     ##
 
     context_data = {
@@ -106,6 +194,7 @@ def jobs(request, queue_index):
 
 
 @staff_member_required
+@metrics.timed_view
 def finished_jobs(request, queue_index):
     queue_index = int(queue_index)
     queue = get_queue_by_index(queue_index)
@@ -122,20 +211,14 @@ def finished_jobs(request, queue_index):
         page_range = range(1, last_page + 1)
         offset = items_per_page * (page - 1)
         job_ids = registry.get_job_ids(offset, items_per_page)
-
-        for job_id in job_ids:
-            try:
-                jobs.append(Job.fetch(job_id, connection=queue.connection))
-            except NoSuchJobError:
-                pass
+        jobs = fetch_jobs(job_ids, queue.connection)
 
     else:
         page_range = []
 
     ###
     # Custom logic here
-    for job in jobs:
-        use_actual_name(job)
+    use_actual_names(jobs)
     ##
 
     context_data = {
@@ -151,6 +234,7 @@ def finished_jobs(request, queue_index):
 
 
 @staff_member_required
+@metrics.timed_view
 def started_jobs(request, queue_index):
     queue_index = int(queue_index)
     queue = get_queue_by_index(queue_index)
@@ -167,20 +251,14 @@ def started_jobs(request, queue_index):
         page_range = range(1, last_page + 1)
         offset = items_per_page * (page - 1)
         job_ids = registry.get_job_ids(offset, items_per_page)
-
-        for job_id in job_ids:
-            try:
-                jobs.append(Job.fetch(job_id, connection=queue.connection))
-            except NoSuchJobError:
-                pass
+        jobs = fetch_jobs(job_ids, queue.connection)
 
     else:
         page_range = []
 
     ###
     # Custom logic here
-    for job in jobs:
-        use_actual_name(job)
+    use_actual_names(jobs)
     ##
 
     context_data = {
@@ -196,6 +274,7 @@ def started_jobs(request, queue_index):
 
 
 @staff_member_required
+@metrics.timed_view
 def deferred_jobs(request, queue_index):
     queue_index = int(queue_index)
     queue = get_queue_by_index(queue_index)
@@ -212,20 +291,14 @@ def deferred_jobs(request, queue_index):
         page_range = range(1, last_page + 1)
         offset = items_per_page * (page - 1)
         job_ids = registry.get_job_ids(offset, items_per_page)
-
-        for job_id in job_ids:
-            try:
-                jobs.append(Job.fetch(job_id, connection=queue.connection))
-            except NoSuchJobError:
-                pass
+        jobs = fetch_jobs(job_ids, queue.connection)
 
     else:
         page_range = []
 
     ###
     # Custom logic here
-    for job in jobs:
-        use_actual_name(job)
+    use_actual_names(jobs)
     ##
 
     context_data = {
@@ -241,6 +314,7 @@ def deferred_jobs(request, queue_index):
 
 
 @staff_member_required
+@metrics.timed_view
 def job_detail(request, queue_index, job_id):
     queue_index = int(queue_index)
     queue = get_queue_by_index(queue_index)
@@ -263,6 +337,7 @@ def job_detail(request, queue_index, job_id):
 
 
 @staff_member_required
+@metrics.timed_view
 def delete_job(request, queue_index, job_id):
     queue_index = int(queue_index)
     queue = get_queue_by_index(queue_index)
@@ -270,8 +345,9 @@ def delete_job(request, queue_index, job_id):
 
     if request.method == 'POST':
         # Remove job id from queue and delete the actual job
-        queue.connection._lrem(queue.key, 0, job.id)
-        job.delete()
+        bulk.delete_jobs(queue, [job.id])
+        if task_index.is_enabled():
+            task_index.remove_jobs([job], queue.connection)
         messages.info(request, 'You have successfully deleted %s' % job.id)
         return redirect('rq_jobs', queue_index)
 
@@ -289,6 +365,7 @@ def delete_job(request, queue_index, job_id):
 
 
 @staff_member_required
+@metrics.timed_view
 def requeue_job_view(request, queue_index, job_id):
     queue_index = int(queue_index)
     queue = get_queue_by_index(queue_index)
@@ -296,6 +373,8 @@ def requeue_job_view(request, queue_index, job_id):
 
     if request.method == 'POST':
         requeue_job(job_id, connection=queue.connection)
+        if task_index.is_enabled():
+            bulk.index_requeued([job], queue.connection)
         messages.info(request, 'You have successfully requeued %s' % job.id)
         return redirect('rq_job_detail', queue_index, job_id)
 
@@ -313,6 +392,7 @@ def requeue_job_view(request, queue_index, job_id):
 
 
 @staff_member_required
+@metrics.timed_view
 def clear_queue(request, queue_index):
     queue_index = int(queue_index)
     queue = get_queue_by_index(queue_index)
@@ -320,6 +400,7 @@ def clear_queue(request, queue_index):
     if request.method == 'POST':
         try:
             queue.empty()
+            task_index.clear(queue)
             messages.info(request, 'You have successfully cleared the queue %s' % queue.name)
         except ResponseError as e:
             if 'EVALSHA' in e.message:
@@ -336,29 +417,37 @@ def clear_queue(request, queue_index):
 
 
 @staff_member_required
+@metrics.timed_view
 def requeue_all(request, queue_index):
     queue_index = int(queue_index)
     queue = get_queue_by_index(queue_index)
-    jobs = queue.get_jobs()
+    total_jobs = queue.count
 
     if request.method == 'POST':
         # Confirmation received
-        for job in jobs:
-            requeue_job(job.id, connection=queue.connection)
-
-        messages.info(request, 'You have successfully requeued all %d jobs!' % len(jobs))
+        if total_jobs > settings.get_requeue_sync_limit():
+            bulk.start_requeue(queue_index, total_jobs)
+            messages.info(request, 'Requeuing %d jobs in the background' % total_jobs)
+        else:
+            requeued = bulk.requeue_jobs(queue, total_jobs)
+            messages.info(request, 'You have successfully requeued all %d jobs!' % requeued)
         return redirect('rq_jobs', queue_index)
 
+    progress = bulk.get_progress(queue)
+    if progress:
+        messages.info(request, 'Requeued %d of %d jobs so far' % progress)
+
     context_data = {
         'queue_index': queue_index,
         'queue': queue,
-        'total_jobs':len(jobs),
+        'total_jobs': total_jobs,
     }
 
     return render(request, 'django_rq/requeue_all.html', context_data)
 
 
 @staff_member_required
+@metrics.timed_view
 def actions(request, queue_index):
     queue_index = int(queue_index)
     queue = get_queue_by_index(queue_index)
@@ -379,15 +468,102 @@ def actions(request, queue_index):
             job_ids = request.POST.getlist('job_ids')
 
             if request.POST['action'] == 'delete':
-                for job_id in job_ids:
-                    job = Job.fetch(job_id, connection=queue.connection)
-                    # Remove job id from queue and delete the actual job
-                    queue.connection._lrem(queue.key, 0, job.id)
-                    job.delete()
+                # Remove job ids from queue and delete the actual jobs
+                if task_index.is_enabled():
+                    task_index.remove_jobs(fetch_jobs(job_ids, queue.connection), queue.connection)
+                bulk.delete_jobs(queue, job_ids)
                 messages.info(request, 'You have successfully deleted %s jobs!' % len(job_ids))
             elif request.POST['action'] == 'requeue':
                 for job_id in job_ids:
                     requeue_job(job_id, connection=queue.connection)
+                if task_index.is_enabled():
+                    bulk.index_requeued(fetch_jobs(job_ids, queue.connection), queue.connection)
                 messages.info(request, 'You have successfully requeued %d  jobs!' % len(job_ids))
 
     return redirect('rq_jobs', queue_index)
+
+
+@staff_member_required
+@metrics.timed_view
+def task_jobs(request, queue_index):
+    """
+    Pending jobs of a queue counted by task, and the jobs of the ``task`` parameter paged with a cursor, from the
+    ``SECURE_RQ_TASK_INDEX`` index.
+    """
+    queue_index = int(queue_index)
+    queue = get_queue_by_index(queue_index)
+
+    items_per_page = 100
+    fingerprint = request.GET.get('task')
+    cursor = request.GET.get('cursor')
+    if cursor:
+        try:
+            cursor = int(cursor)
+        except ValueError:
+            raise Http404('Invalid cursor: %s' % cursor)
+    jobs = []
+    next_cursor = None
+
+    if fingerprint:
+        job_ids, next_cursor = task_index.get_job_ids(queue, fingerprint, cursor=cursor, count=items_per_page)
+        jobs = fetch_jobs(job_ids, queue.connection)
+        task_index.prune(queue, fingerprint, job_ids, jobs)
+        use_actual_names(jobs)
+        # The status fetched with the job, instead of a round trip per row for get_status
+        jobs = [(job, job._status) for job in jobs]
+
+    context_data = {
+        'queue': queue,
+        'queue_index': queue_index,
+        'enabled': task_index.is_enabled(),
+        'task_counts': task_index.get_counts(queue),
+        'task': fingerprint,
+        'jobs': jobs,
+        'next_cursor': next_cursor,
+    }
+    return render(request, 'secure_redis/task_jobs.html', context_data)
+
+
+@staff_member_required
+@metrics.timed_view
+def delete_matching_jobs(request, queue_index):
+    """
+    Delete the jobs of a queue whose actual method name is the ``func_name`` parameter, without selecting them.
+    """
+    queue_index = int(queue_index)
+    queue = get_queue_by_index(queue_index)
+
+    if request.method == 'POST' and request.POST.get('func_name'):
+        func_name = request.POST['func_name']
+
+        def matching(jobs):
+            use_actual_names(jobs)
+            return [job for job in jobs if job.func_name == func_name]
+
+        deleted = bulk.delete_matching(queue, matching)
+        messages.info(request, 'You have successfully deleted %d %s jobs!' % (deleted, func_name))
+
+    return redirect('rq_jobs', queue_index)
+
+
+@staff_member_required
+def metrics_panel(request):
+    """
+    Aggregates of the ``secure_redis.metrics`` measurements: serializer timings and sizes per cache, secure job
+    timings per task, admin view timings and ``InvalidToken`` failures. A post resets them.
+    """
+    backend = metrics.get_aggregating_backend()
+    if request.method == 'POST' and backend is not None:
+        backend.reset()
+        messages.info(request, 'You have successfully reset the metrics!')
+        return redirect('rq_metrics')
+
+    histograms, counters = [], []
+    if backend is not None:
+        histograms, counters = metrics.summarize(*backend.snapshot())
+    context_data = {
+        'enabled': backend is not None,
+        'histograms': histograms,
+        'counters': counters,
+    }
+    return render(request, 'secure_redis/metrics.html', context_data)
@@ -37,7 +37,7 @@ REDIS_DB = 0
 
 CACHES = {
     'default': {
-        'BACKEND': 'django_redis.cache.RedisCache',
+        'BACKEND': 'secure_redis.cache.SecureRedisCache',
         'LOCATION': REDIS_URL,
         'OPTIONS': {
             # "SOCKET_CONNECT_TIMEOUT": 5,  # in seconds
@@ -49,6 +49,19 @@ CACHES = {
         'KEY_PREFIX': 'register:secure',
         'TIMEOUT': 60 * 60 * 24,  # 1 day
     },
+    # Configuration documented in the README, without the secure client
+    'plain_secure': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': REDIS_URL,
+        'OPTIONS': {
+            'DB': REDIS_DB,
+            'PARSER_CLASS': 'redis.connection.HiredisParser',
+            'SERIALIZER': 'secure_redis.serializer.SecureSerializer',
+            'REDIS_SECRET_KEY': 'kPEDO_pSrPh3qGJVfGAflLZXKAh4AuHU64tTlP-f_PY=',
+        },
+        'KEY_PREFIX': 'register:plain',
+        'TIMEOUT': 60 * 60 * 24,  # 1 day
+    },
     'insecure': {
         'BACKEND': 'django_redis.cache.RedisCache',
         'LOCATION': REDIS_URL,
@@ -40,5 +40,9 @@ setup(
         'rq-scheduler>=0.6.1',
         'django-redis',
     ],
+    extras_require={
+        'msgpack': ['msgpack>=0.6', ],
+        'async': ['redis>=4.2', ],
+    },
     keywords=['encryption', 'django', 'redis', 'rq', ],
 )